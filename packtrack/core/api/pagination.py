@@ -0,0 +1,144 @@
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from urllib import parse
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from django.utils.translation import gettext_lazy as _
+
+
+class KeysetPagination(PageNumberPagination):
+    '''
+    Page number pagination with opt-in keyset cursors.
+
+    Passing `cursor` (empty for the first page) switches to pages keyed on the
+    view's `keyset_field` plus `id`, filtered by range instead of skipped by
+    OFFSET. With a (field, id) index on the paged model itself, as Event has
+    for its date, a deep page costs the same index range scan as the first
+    one. Keys on a related model's field (attendance and records by event
+    date) walk that index but sort the rows sharing a date, and filtered lists
+    sort every matching row.
+    Keyset pages have `next`/`previous` links but no `count`.
+    '''
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.display_page_controls = False
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.field = view.keyset_field
+        self.descending = self.field.startswith('-')
+        self.attr = self.field.lstrip('-')
+        self.model = queryset.model
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor['reverse']
+
+        if cursor is not None:
+            op = 'lt' if self.descending != reverse else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{self.attr}__{op}': cursor['position']})
+                | Q(**{
+                    self.attr: cursor['position'],
+                    f'id__{op}': cursor['id']
+                }))
+        ordering = (self.field, '-id' if self.descending else 'id')
+        if reverse:
+            ordering = tuple(o[1:] if o.startswith('-') else f'-{o}'
+                             for o in ordering)
+        results = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        return self.page
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response(
+            OrderedDict([('next', self.get_next_link()),
+                         ('previous', self.get_previous_link()),
+                         ('results', data)]))
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_position(self, instance) -> str:
+        '''
+        Reads the keyset field value from an instance, following `__` lookups,
+        or from a `.values()` row.
+        '''
+        if isinstance(instance, dict):
+            return str(instance[self.attr])
+        value = instance
+        for attr in self.attr.split('__'):
+            value = getattr(value, attr)
+        return str(value)
+
+    def get_keyset_model_field(self):
+        '''
+        The model field the keyset field's `__` lookups lead to.
+        '''
+        *relations, name = self.attr.split('__')
+        model = self.model
+        for relation in relations:
+            model = model._meta.get_field(relation).related_model
+        return model._meta.get_field(name)
+
+    def decode_cursor(self, request) -> dict:
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            tokens = parse.parse_qs(b64decode(encoded.encode('ascii')).decode(
+                'ascii'),
+                                    keep_blank_values=True)
+            cursor = {
+                'position':
+                self.get_keyset_model_field().to_python(tokens['p'][0]),
+                'id': int(tokens['i'][0]),
+                'reverse': bool(int(tokens['r'][0]))
+            }
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        # forged positions or ids the database can't compare against
+        if cursor['position'] is None or not 0 < cursor['id'] < 2**63:
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def encode_cursor(self, instance, reverse: bool) -> str:
+        pk = instance['id'] if isinstance(instance, dict) else instance.id
+        querystring = parse.urlencode({
+            'p': self.get_position(instance),
+            'i': pk,
+            'r': int(reverse)
+        })
+        encoded = b64encode(querystring.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param,
+                                   encoded)
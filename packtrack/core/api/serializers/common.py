@@ -1,5 +1,406 @@
-from rest_framework import serializers
-from typing import List
+from collections import OrderedDict
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Count, F, QuerySet, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+from django.urls import NoReverseMatch
+from django.utils.module_loading import import_string
+from django.utils.translation import gettext_lazy as _
+from rest_framework import serializers, relations
+from rest_framework.exceptions import NotFound
+from rest_framework.reverse import reverse
+from rest_framework.utils.field_mapping import get_detail_view_name
+from rest_framework.utils.serializer_helpers import BindingDict
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import copy
+
+from ...middleware import measure
+
+# stands in for the lookup value while reversing a URL template
+LOOKUP_PLACEHOLDER = 'lookupplaceholder'
+
+
+def clone_field(field, parent):
+    '''
+    Copies an already bound field tree onto a new parent without rebuilding it.
+    Nested serializers get their own field dicts so later pruning can't leak
+    back into the original.
+    '''
+    clone = copy.copy(field)
+    clone.parent = parent
+    if isinstance(field, serializers.ListSerializer):
+        clone.child = clone_field(field.child, clone)
+    elif isinstance(field, serializers.Serializer):
+        fields = BindingDict(clone)
+        for field_name, f in field.fields.items():
+            fields.fields[field_name] = clone_field(f, clone)
+        clone.__dict__['fields'] = fields
+    elif isinstance(field, relations.ManyRelatedField):
+        clone.child_relation = clone_field(field.child_relation, clone)
+    return clone
+
+
+def get_query_plan(serializer) -> Tuple[List[str], List[str]]:
+    '''
+    Derives `select_related` and `prefetch_related` lookups from the fields a
+    serializer will render. Relations reached through a to-many relation are
+    prefetched, all others are selected.
+    '''
+    select_related, prefetch_related = [], []
+
+    def walk(serializer, model, prefix: str, to_many: bool):
+        if isinstance(serializer, serializers.ListSerializer):
+            serializer = serializer.child
+        for field in serializer.fields.values():
+            if field.write_only or field.source == '*':
+                continue
+            if isinstance(field, (serializers.BaseSerializer,
+                                  relations.RelatedField,
+                                  relations.ManyRelatedField)):
+                attrs = field.source_attrs
+            else:  # only relations traversed by a dotted source are needed
+                attrs = field.source_attrs[:-1]
+            # forward foreign keys rendered as a pk/url only need the id column
+            pk_only = isinstance(field, relations.RelatedField
+                                 ) and field.use_pk_only_optimization()
+
+            path, related, many = prefix, model, to_many
+            for i, attr in enumerate(attrs):
+                try:
+                    model_field = related._meta.get_field(attr)
+                except FieldDoesNotExist:
+                    break
+                if not model_field.is_relation:
+                    break
+                if pk_only and i == len(attrs) - 1 and model_field.concrete:
+                    break
+                path = f'{path}__{attr}' if path else attr
+                many = many or model_field.many_to_many or model_field.one_to_many
+                lookups = prefetch_related if many else select_related
+                if path not in lookups:
+                    lookups.append(path)
+                related = model_field.related_model
+            else:
+                if isinstance(field, serializers.BaseSerializer):
+                    walk(field, related, path, many)
+
+    walk(serializer, serializer.Meta.model, '', False)
+    return select_related, prefetch_related
+
+
+class BatchLoader:
+    '''
+    Loads a child collection for a whole page of parent instances in one query
+    and hands each parent its slice.
+
+    With a `limit`, each parent gets at most `limit` children (after skipping
+    `offset`), ranked per parent in the same query.
+    '''
+
+    def __init__(self,
+                 queryset: QuerySet,
+                 parent_lookup: str,
+                 limit: Optional[int] = None,
+                 offset: int = 0):
+        self.queryset = queryset
+        self.parent_lookup = parent_lookup
+        self.limit = limit
+        self.offset = offset
+        self.results = {}
+        self.totals = {}
+
+    def ranked(self, ids) -> RawSQL:
+        '''
+        The pks of each parent's children from `offset` to `offset + limit`,
+        in the queryset's order.
+        '''
+        order_by = [
+            F(o[1:]).desc() if o.startswith('-') else F(o).asc()
+            for o in self.queryset.query.order_by
+        ]
+        ranked = self.queryset.filter(**{
+            f'{self.parent_lookup}__in': ids
+        }).order_by().annotate(batch_id=F('pk'),
+                               batch_rank=Window(
+                                   RowNumber(),
+                                   partition_by=F(self.parent_lookup),
+                                   order_by=order_by or None))
+        sql, params = ranked.values('batch_id',
+                                    'batch_rank').query.sql_with_params()
+        return RawSQL(
+            f'SELECT batch_id FROM ({sql}) AS batch_ranked '
+            'WHERE batch_rank > %s AND batch_rank <= %s',
+            (*params, self.offset, self.offset + self.limit))
+
+    def children(self, ids) -> QuerySet:
+        '''
+        The children of the parents in `ids`, annotated with their parent's id
+        as `batch_parent_id`.
+        '''
+        queryset = self.queryset.filter(**{f'{self.parent_lookup}__in': ids})
+        if self.limit is not None:
+            queryset = queryset.filter(pk__in=self.ranked(ids))
+        return queryset.annotate(batch_parent_id=F(self.parent_lookup))
+
+    def counts(self, ids) -> Dict[int, int]:
+        '''
+        The number of children (ignoring `limit`) of each parent in `ids` that
+        has any.
+        '''
+        return dict(
+            self.queryset.filter(**{
+                f'{self.parent_lookup}__in': ids
+            }).order_by().values_list(self.parent_lookup).annotate(
+                Count('pk')))
+
+    def load(self, instance, page) -> list:
+        '''
+        Returns the children of `instance`, fetching them for every unloaded
+        parent in `page` on a cache miss.
+        '''
+        if instance.pk not in self.results:
+            ids = {p.pk for p in page if p.pk not in self.results}
+            ids.add(instance.pk)
+            for pk in ids:
+                self.results[pk] = []
+            for child in self.children(ids):
+                self.results[child.batch_parent_id].append(child)
+        return self.results[instance.pk]
+
+    def count(self, instance, page) -> int:
+        '''
+        Returns the number of children of `instance`, counting them for every
+        uncounted parent in `page` on a cache miss.
+        '''
+        if instance.pk not in self.totals:
+            ids = {p.pk for p in page if p.pk not in self.totals}
+            ids.add(instance.pk)
+            counts = self.counts(ids)
+            for pk in ids:
+                self.totals[pk] = counts.get(pk, 0)
+        return self.totals[instance.pk]
+
+
+class BatchedListField(serializers.Field):
+    '''
+    Read-only list of an instance's children (the `serializer` model rows
+    whose `parent_lookup` is the instance), rendered with `fields`.
+    Children are loaded for the whole page of parents in one query (see
+    NestedDynamicFieldsModelSerializer.get_batch_loader).
+
+    A `limit` or `expandable` collection is rendered as a page:
+    `{count, next, results}`, with `limit` children per page and `next`
+    linking to the parent's detail view for the following page (the
+    `<field>_page` query parameter). Expandable collections only include
+    `results` when the field is named in the `expand` query parameter, so
+    callers opt in to loading them.
+    '''
+    expand_query_param = 'expand'
+    page_query_param = '{field_name}_page'
+    invalid_page_message = _('Invalid page.')
+    # for get_url_template
+    lookup_url_kwarg = 'pk'
+    reverse = staticmethod(reverse)
+
+    def __init__(self,
+                 serializer,
+                 fields: List[str],
+                 parent_lookup: str,
+                 order_by: Tuple[str] = ('id', ),
+                 limit: Optional[int] = None,
+                 expandable: bool = False,
+                 **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+        # a dotted path for serializers defined later or in another app
+        self.serializer = serializer
+        self.child_fields = fields
+        self.parent_lookup = parent_lookup
+        self.order_by = order_by
+        self.limit = limit
+        self.expandable = expandable
+        self.queryset = None
+
+    @property
+    def paginated(self) -> bool:
+        return self.limit is not None or self.expandable
+
+    def get_child(self, *args, **kwargs):
+        if isinstance(self.serializer, str):
+            self.serializer = import_string(self.serializer)
+        return self.serializer(*args,
+                               fields=self.child_fields,
+                               context=self.context,
+                               **kwargs)
+
+    def get_queryset(self) -> QuerySet:
+        '''
+        Children in `order_by` order, without the related rows they render.
+        '''
+        return self.get_child().Meta.model.objects.order_by(*self.order_by)
+
+    def get_loader(self, queryset: QuerySet) -> BatchLoader:
+        if self.limit is None:
+            return BatchLoader(queryset, self.parent_lookup)
+        offset = (self.get_page_number() - 1) * self.limit
+        return BatchLoader(queryset, self.parent_lookup, self.limit, offset)
+
+    def is_expanded(self) -> bool:
+        if not self.expandable:
+            return True
+        request = self.context.get('request')
+        if request is None:
+            return False
+        return self.field_name in {
+            name.strip()
+            for value in request.query_params.getlist(self.expand_query_param)
+            for name in value.split(',')
+        }
+
+    def get_page_number(self) -> int:
+        request = self.context.get('request')
+        param = self.page_query_param.format(field_name=self.field_name)
+        if request is None or param not in request.query_params:
+            return 1
+        try:
+            number = int(request.query_params[param])
+        except ValueError:
+            raise NotFound(self.invalid_page_message)
+        if number < 1:
+            raise NotFound(self.invalid_page_message)
+        return number
+
+    def get_next_link(self, pk, count: int) -> Optional[str]:
+        '''
+        The parent's detail URL for the children after this page, or for all
+        of them when they aren't expanded.
+        '''
+        if self.is_expanded():
+            number = self.get_page_number() + 1
+            if self.limit is None or (number - 1) * self.limit >= count:
+                return None
+        else:
+            number = 1
+            if not count:
+                return None
+        template = get_url_template(
+            self, get_detail_view_name(self.parent.Meta.model),
+            self.context['request'], None)
+        if template is None:
+            return None
+        query = {self.expand_query_param: self.field_name}
+        if number > 1:
+            query[self.page_query_param.format(
+                field_name=self.field_name)] = number
+        return f'{template[0]}{pk}{template[1]}?{urlencode(query)}'
+
+    def paginate(self, pk, count: int, results: Optional[list]) -> dict:
+        '''
+        The page of children rendered for a paginated collection, without
+        `results` when they aren't expanded.
+        '''
+        page = OrderedDict([('count', count),
+                            ('next', self.get_next_link(pk, count))])
+        if results is not None:
+            page['results'] = results
+        return page
+
+    def to_representation(self, instance):
+        if self.queryset is None:
+            select_related, prefetch_related = get_query_plan(
+                self.get_child())
+            self.queryset = self.get_queryset()
+            if select_related:
+                self.queryset = self.queryset.select_related(*select_related)
+            if prefetch_related:
+                self.queryset = self.queryset.prefetch_related(
+                    *prefetch_related)
+        loader = self.parent.get_batch_loader(
+            self.field_name, lambda: self.get_loader(self.queryset))
+        page = self.parent.get_page(instance)
+        if not self.paginated:
+            children = loader.load(instance, page)
+            return self.get_child(children, many=True).data
+        results = None
+        if self.is_expanded():
+            results = self.get_child(loader.load(instance, page),
+                                     many=True).data
+        return self.paginate(instance.pk, loader.count(instance, page),
+                             results)
+
+
+def get_url_template(field, view_name: str, request,
+                     format) -> Optional[Tuple[str, str]]:
+    '''
+    The URL a hyperlinked field would build for `view_name`, split around
+    the lookup value. Reversed once per request, or None if the route
+    doesn't take a placeholder value.
+    '''
+    templates = request.__dict__.setdefault('_url_templates', {})
+    key = (view_name, field.lookup_url_kwarg, format)
+    if key not in templates:
+        try:
+            url = field.reverse(
+                view_name,
+                kwargs={field.lookup_url_kwarg: LOOKUP_PLACEHOLDER},
+                request=request,
+                format=format)
+        except NoReverseMatch:
+            url = ''
+        templates[key] = (tuple(url.split(LOOKUP_PLACEHOLDER))
+                          if url.count(LOOKUP_PLACEHOLDER) == 1 else None)
+    return templates[key]
+
+
+class CachedHyperlinkMixin:
+    '''
+    Builds hyperlinks by formatting integer lookup values into the route's
+    URL template instead of reversing the route for every object.
+    '''
+
+    def get_url(self, obj, view_name, request, format):
+        if hasattr(obj, 'pk') and obj.pk in (None, ''):
+            return None
+        lookup_value = getattr(obj, self.lookup_field)
+        template = None
+        if type(lookup_value) is int:
+            template = get_url_template(self, view_name, request, format)
+        if template is None:
+            return super().get_url(obj, view_name, request, format)
+        return f'{template[0]}{lookup_value}{template[1]}'
+
+
+class CachedHyperlinkedRelatedField(CachedHyperlinkMixin,
+                                    serializers.HyperlinkedRelatedField):
+    pass
+
+
+class CachedHyperlinkedIdentityField(CachedHyperlinkMixin,
+                                     serializers.HyperlinkedIdentityField):
+    pass
+
+
+class CachedHyperlinkedModelSerializer(
+        serializers.HyperlinkedModelSerializer):
+    '''
+    HyperlinkedModelSerializer whose generated hyperlinks are built from
+    per-request URL templates.
+    '''
+    serializer_related_field = CachedHyperlinkedRelatedField
+    serializer_url_field = CachedHyperlinkedIdentityField
+
+
+class HyperlinkedLookupField(CachedHyperlinkedRelatedField):
+    '''
+    Validates a hyperlink and returns its lookup value (usually the pk)
+    without fetching the object, so bulk input can be loaded in one query.
+    '''
+
+    def get_object(self, view_name, view_args, view_kwargs):
+        return view_kwargs[self.lookup_url_kwarg]
 
 
 class NestedDynamicFieldsModelSerializer(serializers.ModelSerializer):
@@ -7,7 +408,27 @@ class NestedDynamicFieldsModelSerializer(serializers.ModelSerializer):
     Allows dynamic control over the depth and information presented in nested serializers.
     '''
 
+    # Pruned field trees, built once per (serializer class, fields)
+    _compiled_fields = {}
+
     def __init__(self, *args, **kwargs):
+        # Don't pass the `fields` arg up to the superclass
+        fields = kwargs.pop('fields', None)
+
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            # Clone the cached field tree instead of rebuilding and pruning it
+            compiled = self.get_compiled_fields(tuple(fields))
+            self.__dict__['fields'] = BindingDict(self)
+            for field_name, field in compiled.items():
+                self.fields.fields[field_name] = clone_field(field, self)
+
+    @classmethod
+    def get_compiled_fields(cls, fields: Tuple[str]) -> BindingDict:
+        '''
+        Returns the field tree for `fields`, building and pruning it on first use.
+        '''
 
         def parse_nested_fields(fields: List[str]) -> dict:
             '''
@@ -53,12 +474,49 @@ class NestedDynamicFieldsModelSerializer(serializers.ModelSerializer):
                 for field_name in existing - allowed:
                     serializer.fields.pop(field_name)
 
-        # Don't pass the `fields` arg up to the superclass
-        fields = kwargs.pop('fields', None)
+        key = (cls, fields)
+        if key not in cls._compiled_fields:
+            prototype = cls()
+            # Drop any fields that are not specified in the `fields` argument.
+            select_nested_fields(prototype, parse_nested_fields(fields))
+            cls._compiled_fields[key] = prototype.fields
+        return cls._compiled_fields[key]
 
-        super().__init__(*args, **kwargs)
+    def to_representation(self, instance):
+        # reported as serializer time by RequestMetricsMiddleware
+        with measure('serializer'):
+            return super().to_representation(instance)
 
-        if fields is not None:
-            fields = parse_nested_fields(fields)
-            # Drop any fields that are not specified in the `fields` argument.
-            select_nested_fields(self, fields)
+    def get_page(self, instance) -> list:
+        '''
+        Returns the instances being rendered alongside `instance` by a parent
+        list serializer.
+        '''
+        page = getattr(self.parent, 'instance', None)
+        if isinstance(self.parent, serializers.ListSerializer):
+            if isinstance(page, (list, tuple)):
+                return page
+            # only reuse querysets the list serializer has already evaluated
+            if isinstance(page, QuerySet) and page._result_cache is not None:
+                return page
+        return [instance]
+
+    def get_batch_loader(self, name: str,
+                         factory: Callable[[], BatchLoader]) -> BatchLoader:
+        '''
+        The loader for a BatchedListField, made by `factory` on first use and
+        cached in the serializer context for the rest of the response, so
+        children are fetched for the whole page at once.
+        '''
+        loaders = self.context.setdefault('batch_loaders', {})
+        key = f'{self.__class__.__name__}.{name}'
+        if key not in loaders:
+            loaders[key] = factory()
+        return loaders[key]
+
+    def get_query_plan(self) -> Tuple[List[str], List[str]]:
+        '''
+        Returns the (select_related, prefetch_related) lookups needed to render
+        this serializer's selected fields.
+        '''
+        return get_query_plan(self)
@@ -8,10 +8,11 @@ from django.utils.translation import gettext_lazy as _
 import datetime, base64
 
 from ... import models, settings
-from .common import NestedDynamicFieldsModelSerializer
+from .common import (BatchedListField, CachedHyperlinkedModelSerializer,
+                     NestedDynamicFieldsModelSerializer)
 
 
-class UserCreateSerializer(serializers.HyperlinkedModelSerializer):
+class UserCreateSerializer(CachedHyperlinkedModelSerializer):
     '''
     Allows anon (not logged in) users to register a new account.
     '''
@@ -79,7 +80,7 @@ class UserCreateSerializer(serializers.HyperlinkedModelSerializer):
 
 
 class UserSerializer(NestedDynamicFieldsModelSerializer,
-                     serializers.HyperlinkedModelSerializer):
+                     CachedHyperlinkedModelSerializer):
     '''
     Serializer for browsing/editing User model
     '''
@@ -88,7 +89,13 @@ class UserSerializer(NestedDynamicFieldsModelSerializer,
         write_only=True,
         help_text=password_validation.password_validators_help_text_html(),
         style={'input_type': 'password'})
-    membership = serializers.SerializerMethodField()
+    membership = BatchedListField(
+        'kennels.api.serializers.MembershipSerializer',
+        fields=[
+            'url', 'is_admin', 'is_approved', 'kennel', 'kennel__name',
+            'kennel__acronym'
+        ],
+        parent_lookup='user')
     from profiles.api.serializers import ProfileSerializer
     profile = ProfileSerializer(fields=['url', 'hash_name', 'avatar'])
 
@@ -102,22 +109,6 @@ class UserSerializer(NestedDynamicFieldsModelSerializer,
             'url', 'profile', 'password', 'invite_code', 'membership'
         ]
 
-    def get_membership(self, instance):
-        '''
-        Gets nested serializer with custom depth and fields
-        '''
-        from kennels.models import Membership
-        from kennels.api.serializers import MembershipSerializer
-        membership = Membership.objects.filter(user=instance)
-        return MembershipSerializer(membership,
-                                    many=True,
-                                    context=self.context,
-                                    fields=[
-                                        'url', 'is_admin', 'is_approved',
-                                        'kennel', 'kennel__name',
-                                        'kennel__acronym'
-                                    ]).data
-
     def validate_password(self, value):
         '''
         Validates password agains django.contrib.auth password validation
@@ -130,7 +121,7 @@ class UserSerializer(NestedDynamicFieldsModelSerializer,
         return value
 
 
-class InviteSerializer(serializers.HyperlinkedModelSerializer):
+class InviteSerializer(CachedHyperlinkedModelSerializer):
     '''
     serializer for InviteCode API endpoint.
     '''
@@ -173,7 +164,7 @@ class InviteSerializer(serializers.HyperlinkedModelSerializer):
         )
 
 
-class InviteSerializerAdmin(serializers.HyperlinkedModelSerializer):
+class InviteSerializerAdmin(CachedHyperlinkedModelSerializer):
     '''
     Serializer for InviteCode model
     '''
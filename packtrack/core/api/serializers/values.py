@@ -0,0 +1,251 @@
+from types import SimpleNamespace
+from typing import Callable, List
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.db.models import QuerySet
+from rest_framework import relations, serializers
+
+from .common import BatchedListField, BatchLoader, get_url_template
+
+# serializer fields rendering these model fields' values unchanged
+PASSTHROUGH_FIELDS = {
+    serializers.CharField: (models.CharField, models.TextField),
+    serializers.IntegerField: (models.IntegerField, ),
+    serializers.BooleanField: (models.BooleanField, ),
+}
+
+
+class UnsupportedField(Exception):
+    '''
+    Raised while compiling a serializer with a field that can't be rendered
+    from `.values()` rows.
+    '''
+
+
+class HyperlinkTemplate:
+    '''
+    A hyperlinked field's URL template (see get_url_template), with the
+    lookup value filled in per row.
+    '''
+
+    def __init__(self, field: relations.HyperlinkedRelatedField):
+        self.field = field
+        self.request = field.context['request']
+        # as HyperlinkedRelatedField.to_representation picks it
+        self.format = field.context.get('format')
+        if self.format and field.format and field.format != self.format:
+            self.format = field.format
+        template = get_url_template(field, field.view_name, self.request,
+                                    self.format)
+        if template is None:
+            raise UnsupportedField(field.field_name)
+        self.prefix, self.suffix = template
+
+    def get_url(self, value) -> str:
+        obj = SimpleNamespace(**{'pk': value, self.field.lookup_field: value})
+        return self.field.get_url(obj, self.field.view_name, self.request,
+                                  self.format)
+
+    def render(self, value) -> str:
+        if value is None or value == '':
+            return None
+        # other values may need quoting
+        if type(value) is int:
+            return f'{self.prefix}{value}{self.suffix}'
+        return self.get_url(value)
+
+
+class NestedList:
+    '''
+    A to-many field's children for a page of parent rows, loaded in one
+    query and grouped by the parent's primary key (read from `key`).
+    Paginated BatchedListFields are rendered as their pages, with the
+    children counted in one more query.
+    '''
+
+    def __init__(self,
+                 child: 'ValuesSerializer',
+                 loader: BatchLoader,
+                 key: str,
+                 field: BatchedListField = None):
+        self.child = child
+        self.loader = loader
+        self.key = key
+        self.field = field if field is not None and field.paginated else None
+        self.expanded = self.field is None or self.field.is_expanded()
+        self.results = {}
+        self.counts = {}
+
+    def load(self, rows: List[dict]) -> None:
+        ids = {row[self.key] for row in rows if row[self.key] is not None}
+        self.results, self.counts = {}, {}
+        if not ids:
+            return
+        if self.field is not None:
+            self.counts = self.loader.counts(ids)
+        if not self.expanded:
+            return
+        children = list(
+            self.loader.children(ids).values('batch_parent_id',
+                                             *self.child.columns))
+        for child, data in zip(children, self.child.render_many(children)):
+            self.results.setdefault(child['batch_parent_id'], []).append(data)
+
+    def render(self, row: dict) -> list:
+        pk = row[self.key]
+        if self.field is None:
+            return self.results.get(pk, [])
+        return self.field.paginate(
+            pk, self.counts.get(pk, 0),
+            self.results.get(pk, []) if self.expanded else None)
+
+
+class ValuesSerializer:
+    '''
+    Renders a model serializer's representation of `.values()` rows.
+
+    Compiled once per request from the serializer's field tree: model fields
+    read their column, hyperlinks fill in a URL reversed once, nested
+    serializers read their relation's columns from the same row and to-many
+    fields are loaded for the whole page in one query each. Raises
+    UnsupportedField for anything else (method fields, properties, files),
+    for which the serializer itself has to be used.
+    '''
+
+    def __init__(self, serializer, prefix: str = ''):
+        if isinstance(serializer, serializers.ListSerializer):
+            serializer = serializer.child
+        self.model = serializer.Meta.model
+        self.prefix = prefix
+        # primary key of the rendered object
+        self.pk = prefix or 'pk'
+        self.columns = [self.pk]
+        self.lists = []
+        self.writers = [(field.field_name, self.compile(field))
+                        for field in serializer.fields.values()
+                        if not field.write_only]
+        self.columns = list(dict.fromkeys(self.columns))
+
+    def column(self, attrs: List[str]) -> str:
+        return '__'.join([self.prefix, *attrs] if self.prefix else attrs)
+
+    def resolve(self, attrs: List[str]) -> List[models.Field]:
+        '''
+        The model fields along a source path.
+        '''
+        model, path = self.model, []
+        for attr in attrs:
+            try:
+                field = model._meta.get_field(attr)
+            except FieldDoesNotExist:
+                raise UnsupportedField('.'.join(attrs))
+            path.append(field)
+            model = field.related_model
+        return path
+
+    def compile(self, field) -> Callable[[dict], object]:
+        '''
+        Returns a function rendering `field` from a row, adding the columns
+        it reads.
+        '''
+        if isinstance(field, BatchedListField):
+            child = field.get_child()
+            loader = field.get_loader(field.get_queryset())
+            return self.compile_list(ValuesSerializer(child), loader, field)
+
+        if isinstance(field, serializers.ListSerializer):
+            relation = self.resolve(field.source_attrs)
+            if len(relation) != 1 or not (relation[0].one_to_many
+                                          or relation[0].many_to_many):
+                raise UnsupportedField(field.field_name)
+            relation = relation[0]
+            # the lookup back to this model (what prefetch_related filters on)
+            parent_lookup = (relation.field.name if isinstance(
+                relation, models.ForeignObjectRel) else
+                             relation.related_query_name())
+            loader = BatchLoader(relation.related_model._default_manager.all(),
+                                 parent_lookup)
+            return self.compile_list(ValuesSerializer(field.child), loader)
+
+        if isinstance(field, serializers.BaseSerializer):
+            relation = self.resolve(field.source_attrs)
+            if any(f.one_to_many or f.many_to_many for f in relation):
+                raise UnsupportedField(field.field_name)
+            nested = ValuesSerializer(field, self.column(field.source_attrs))
+            self.columns += nested.columns
+            self.lists += nested.lists
+            return nested.render_or_none
+
+        if isinstance(field, relations.HyperlinkedIdentityField):
+            column = (self.pk if field.lookup_field == 'pk' else self.column(
+                [field.lookup_field]))
+            return self.compile_link(field, column)
+
+        if isinstance(field, relations.HyperlinkedRelatedField):
+            relation = self.resolve(field.source_attrs)
+            if not (relation[-1].many_to_one or relation[-1].one_to_one):
+                raise UnsupportedField(field.field_name)
+            attrs = field.source_attrs
+            if field.lookup_field != 'pk':
+                attrs = [*attrs, field.lookup_field]
+            return self.compile_link(field, self.column(attrs))
+
+        if isinstance(field, (relations.RelatedField,
+                              relations.ManyRelatedField,
+                              serializers.SerializerMethodField)
+                      ) or field.source == '*':
+            raise UnsupportedField(field.field_name)
+
+        model_field = self.resolve(field.source_attrs)[-1]
+        if model_field.is_relation or isinstance(model_field,
+                                                 models.FileField):
+            raise UnsupportedField(field.field_name)
+        column = self.column(field.source_attrs)
+        self.columns.append(column)
+        if isinstance(model_field, PASSTHROUGH_FIELDS.get(type(field), ())):
+            return lambda row: row[column]
+        to_representation = field.to_representation
+        return lambda row: (None if row[column] is None else
+                            to_representation(row[column]))
+
+    def compile_link(self, field, column: str):
+        self.columns.append(column)
+        template = HyperlinkTemplate(field)
+        return lambda row: template.render(row[column])
+
+    def compile_list(self,
+                     child: 'ValuesSerializer',
+                     loader: BatchLoader,
+                     field: BatchedListField = None):
+        nested = NestedList(child, loader, self.pk, field)
+        self.lists.append(nested)
+        return nested.render
+
+    def values(self, queryset: QuerySet, *columns: str) -> QuerySet:
+        '''
+        `queryset` as the rows this serializer renders (plus `columns`).
+        '''
+        rows = queryset.prefetch_related(None).values(
+            *dict.fromkeys([*self.columns, *columns]))
+        # the joins for the columns don't change the number of rows, so
+        # paginators count without them
+        rows.count = queryset.count
+        return rows
+
+    def render(self, row: dict) -> dict:
+        return {name: write(row) for name, write in self.writers}
+
+    def render_or_none(self, row: dict) -> dict:
+        # a nested serializer's object is missing when its key is null
+        if row[self.pk] is None:
+            return None
+        return self.render(row)
+
+    def render_many(self, rows: List[dict]) -> List[dict]:
+        '''
+        Renders a page of rows, loading their to-many fields first.
+        '''
+        for nested in self.lists:
+            nested.load(rows)
+        return [self.render(row) for row in rows]
@@ -1,4 +1,72 @@
-from rest_framework import viewsets
+from functools import partial, wraps
+from typing import List
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from rest_framework import renderers, status, viewsets
+from rest_framework.response import Response
+
+from ... import cache
+from ...middleware import measure
+from ...settings import RESPONSE_CACHE_TIMEOUT
+from ..renderers import FastJSONRenderer
+from ..serializers.common import get_query_plan
+from ..serializers.values import UnsupportedField, ValuesSerializer
+
+
+class QueryPlanMixin:
+    '''
+    Applies the serializer's select_related/prefetch_related plan to querysets
+    for read actions, so nested fields don't cost a query per row.
+    '''
+
+    query_plan_actions = ['list', 'retrieve']
+
+    def apply_query_plan(self, queryset, serializer_class=None):
+        serializer_class = serializer_class or self.serializer_class
+        serializer = serializer_class(context=self.get_serializer_context())
+        select_related, prefetch_related = get_query_plan(serializer)
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in self.query_plan_actions:
+            queryset = self.apply_query_plan(queryset)
+        return queryset
+
+
+class ValuesListMixin:
+    '''
+    Serializes list pages from `.values()` rows instead of model instances
+    (see core.api.serializers.values.ValuesSerializer) and renders them with
+    FastJSONRenderer. Lists whose serializer has fields the values path
+    can't render use the serializer as usual.
+    '''
+
+    renderer_classes = [FastJSONRenderer, renderers.BrowsableAPIRenderer]
+
+    def list(self, request, *args, **kwargs):
+        try:
+            serializer = ValuesSerializer(self.get_serializer())
+        except UnsupportedField:
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        # keyset pagination reads its cursor from the rows
+        keyset = getattr(self, 'keyset_field', '').lstrip('-')
+        rows = serializer.values(queryset, 'id', *filter(None, [keyset]))
+        page = self.paginate_queryset(rows)
+        if page is None:
+            page = list(rows)
+        # reported as serializer time by RequestMetricsMiddleware
+        with measure('serializer'):
+            data = serializer.render_many(page)
+        if self.paginator is None:
+            return Response(data)
+        return self.get_paginated_response(data)
 
 
 class MultiClassModelViewSet(viewsets.ModelViewSet):
@@ -7,4 +75,103 @@ class MultiClassModelViewSet(viewsets.ModelViewSet):
         try:
             return self.serializer_action_classes[self.action]
         except (KeyError, AttributeError):
-            return super().get_serializer_class()
\ No newline at end of file
+            return super().get_serializer_class()
+
+
+class ResponseCacheMixin:
+    '''
+    Caches the data of successful GET responses for `cached_actions` (and
+    actions decorated with `cached_action`), and answers conditional GETs for
+    them with 304s.
+
+    Entries and ETags are keyed by URL, `get_cache_scope()` and the
+    generations from `get_cache_dependencies()` (see core.cache), so model
+    signals expire them by bumping a kennel's, user's or model's generation.
+    By default responses depend on the models in `cache_models` (the
+    queryset's model if unset), which must list every model they show.
+
+    Cached responses are answered without fetching objects, so without
+    object permission checks, and are kept per user unless `shared_cache`
+    declares that every authenticated user sees the same data.
+    '''
+
+    cached_actions = ['list', 'retrieve']
+    cache_models = None
+    shared_cache = False
+
+    def get_cache_dependencies(self) -> List[str]:
+        models = self.cache_models or [self.queryset.model]
+        return [cache.model_generation(model) for model in models]
+
+    def get_cache_scope(self) -> str:
+        '''
+        Distinguishes requesters who would see different data at one URL.
+        '''
+        if not self.request.user.is_authenticated:
+            return 'anonymous'
+        if self.shared_cache:
+            return 'authenticated'
+        return f'user:{self.request.user.pk}'
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        '''
+        Answers GETs with a 304 when the client's copy is still current,
+        from the response cache, or else from `handler`.
+        '''
+        if request.method not in ('GET', 'HEAD'):
+            return handler(request, *args, **kwargs)
+        names = self.get_cache_dependencies()
+        generations = cache.get_generations(names)
+        key = cache.response_key(request, self.get_cache_scope(), names,
+                                 generations)
+        # validators derive from the generations, so checking them costs no
+        # more than the cache lookup
+        etag = quote_etag(f'{key}.{request.accepted_renderer.format}')
+        last_modified = cache.last_modified(generations)
+        response = get_conditional_response(request,
+                                            etag=etag,
+                                            last_modified=last_modified)
+        if response is None:
+            response = self.cached_data_response(key, handler, request,
+                                                 *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK,
+                                    status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def cached_data_response(self, key, handler, request, *args, **kwargs):
+        if not RESPONSE_CACHE_TIMEOUT:
+            return handler(request, *args, **kwargs)
+        data = cache.get_response(key)
+        if data is not None:
+            return Response(data)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set_response(key, response.data)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        if 'list' not in self.cached_actions:
+            return super().list(request, *args, **kwargs)
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        if 'retrieve' not in self.cached_actions:
+            return super().retrieve(request, *args, **kwargs)
+        return self.cached_response(super().retrieve, request, *args,
+                                    **kwargs)
+
+
+def cached_action(method):
+    '''
+    Serves a ResponseCacheMixin viewset action from the response cache.
+    '''
+
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        return self.cached_response(partial(method, self), request, *args,
+                                    **kwargs)
+
+    return wrapper
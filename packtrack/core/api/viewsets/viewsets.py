@@ -1,15 +1,21 @@
 from urllib.request import Request
 from django.shortcuts import redirect
 from rest_framework import viewsets, permissions, throttling, filters, status
+from rest_framework.decorators import action
 from django.contrib.auth.models import User
+from django.shortcuts import get_object_or_404
 from rest_framework.response import Response
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth import login, authenticate
 from django_filters.rest_framework import DjangoFilterBackend
 
 from ..serializers import serializers
-from .common import MultiClassModelViewSet
+from .common import (MultiClassModelViewSet, QueryPlanMixin,
+                     ResponseCacheMixin)
+from ...search import FullTextSearchFilter
 from ... import models
+from kennels.models import Kennel, Membership
+from profiles.models import Profile
 
 
 class UserPermission(permissions.BasePermission):
@@ -27,6 +33,9 @@ class UserPermission(permissions.BasePermission):
 
     UPDATE:
     Users can modify their own account
+
+    SUMMARY:
+    Authenticated users can view any hasher's profile summary
     '''
 
     def has_permission(self, request, view):
@@ -34,7 +43,9 @@ class UserPermission(permissions.BasePermission):
             return not request.user.is_authenticated
         elif view.action == 'list':
             return True
-        elif view.action in ['retrieve', 'update', 'partial_update']:
+        elif view.action in [
+                'retrieve', 'update', 'partial_update', 'summary'
+        ]:
             return request.user.is_authenticated
         else:
             return False
@@ -50,7 +61,8 @@ class UserPermission(permissions.BasePermission):
             return False
 
 
-class UserViewSet(MultiClassModelViewSet):
+class UserViewSet(QueryPlanMixin, ResponseCacheMixin,
+                  MultiClassModelViewSet):
     """
     API endpoint that allows users to be viewed or edited.
     """
@@ -61,7 +73,9 @@ class UserViewSet(MultiClassModelViewSet):
     http_method_names = ['get', 'head', 'put', 'patch', 'options', 'post']
     permission_classes = [UserPermission]
     throttle_classes = [throttling.AnonRateThrottle]
-    filter_backends = [filters.SearchFilter, DjangoFilterBackend]
+    cache_models = [User, Profile, Membership, Kennel]
+    shared_cache = True
+    filter_backends = [FullTextSearchFilter, DjangoFilterBackend]
     filterset_fields = [
         'username', 'email', 'profile__hash_name', 'kennels__name',
         'kennels__acronym', 'id'
@@ -77,7 +91,7 @@ class UserViewSet(MultiClassModelViewSet):
         '''
         if not self.request.user.is_authenticated:
             return User.objects.none()
-        return User.objects.all()
+        return super().get_queryset()
 
     def create(self, request, *args, **kwargs) -> Response:
         '''
@@ -105,8 +119,18 @@ class UserViewSet(MultiClassModelViewSet):
                 login(request, user)
             return res
 
+    @action(detail=False, url_path=r'(?P<username>[^/]+)/summary')
+    def summary(self, request, username):
+        '''
+        Run/hare counts, kennels, longevity and the first attendance page of
+        a hasher, for rendering their profile in one request.
+        '''
+        from profiles.summary import get_summary
+        user = get_object_or_404(User, username=username)
+        return Response(get_summary(user, request))
+
 
-class InviteViewSet(viewsets.ModelViewSet):
+class InviteViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows a invite codes to be viewed or created.
     """
@@ -123,6 +147,8 @@ class InviteViewSet(viewsets.ModelViewSet):
         queryset = models.InviteCode.objects.filter(
             creator=self.request.user).order_by('expiration').order_by(
                 'receiver')
+        if self.action in self.query_plan_actions:
+            queryset = self.apply_query_plan(queryset)
         return queryset
 
     def perform_create(self, serializer):
@@ -0,0 +1,108 @@
+import hashlib
+import time
+from typing import Iterable, List, Tuple
+
+from django.core.cache import caches
+from django.db import transaction
+
+from .settings import RESPONSE_CACHE, RESPONSE_CACHE_TIMEOUT
+
+
+def get_cache():
+    return caches[RESPONSE_CACHE]
+
+
+def _generation_key(name: str) -> str:
+    return f'generation:{name}'
+
+
+def _new_generation() -> int:
+    # generations are bump timestamps, so a lost (culled or evicted) one
+    # restarts from a value no cached entry can have been keyed with
+    return time.time_ns()
+
+
+def get_generations(names: Iterable[str]) -> Tuple[int]:
+    '''
+    Current values of the named generations.
+    '''
+    cache = get_cache()
+    keys = [_generation_key(name) for name in names]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            generation = _new_generation()
+            cache.add(key, generation, None)
+            # another process may have added it first
+            found[key] = cache.get(key, generation)
+    return tuple(found[key] for key in keys)
+
+
+def bump(names: Iterable[str]) -> None:
+    '''
+    Moves the named generations on to the current time.
+    '''
+    get_cache().set_many(
+        {_generation_key(name): _new_generation()
+         for name in names}, None)
+
+
+def last_modified(generations: Iterable[int]) -> int:
+    '''
+    Timestamp (in seconds) of the latest bump among `generations`.
+    '''
+    return max(generations, default=_new_generation()) // 10**9
+
+
+def model_generation(model) -> str:
+    '''
+    Name of the generation of responses listing rows of `model`.
+    '''
+    return f'model:{model._meta.label_lower}'
+
+
+def expire(kennels: Iterable = (),
+           users: Iterable = (),
+           models: Iterable = ()) -> None:
+    '''
+    Retires cached responses depending on the given kennel or user ids, or
+    on rows of the given models, once the current transaction commits.
+    '''
+    names = [model_generation(model) for model in set(models)]
+    names += [f'kennel:{k}' for k in set(kennels) if k is not None]
+    names += [f'user:{u}' for u in set(users) if u is not None]
+    transaction.on_commit(lambda: bump(names))
+
+
+def response_key(request, scope: str, names: List[str],
+                 generations: Tuple[int]) -> str:
+    '''
+    Cache key for a GET request: its absolute URL (pagination links embed
+    the host) with sorted query parameters, the requester's scope and the
+    current values of the generations the response depends on.
+    '''
+    params = sorted(request.query_params.lists())
+    raw = repr((request.build_absolute_uri(request.path), params, scope,
+                names, generations))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def get_response(key: str):
+    return get_cache().get(f'response:{key}')
+
+
+def _plain(data):
+    # serialized data holds Hyperlinks referencing their model instances,
+    # which would be pickled along with them
+    if isinstance(data, dict):
+        return {key: _plain(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [_plain(value) for value in data]
+    if isinstance(data, str):
+        return str(data)
+    return data
+
+
+def set_response(key: str, data) -> None:
+    get_cache().set(f'response:{key}', _plain(data),
+                    RESPONSE_CACHE_TIMEOUT)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from core.cache import expire
+from core.search import indexes
+
+
+class Command(BaseCommand):
+    '''
+    Rebuilds the SQLite full-text search index from scratch.
+    '''
+    help = 'Rebuilds the full-text search index for kennels, hashers, events and attendance'
+
+    def handle(self, *args, **options):
+        for index in indexes.values():
+            if not index.is_available():
+                self.stdout.write(
+                    self.style.WARNING(f'Skipping {index.table} (unavailable)'))
+                continue
+            count = index.rebuild()
+            # cached search results were matched against the old documents
+            expire(models=[index.model])
+            self.stdout.write(
+                self.style.SUCCESS(f'Indexed {count} rows into {index.table}'))
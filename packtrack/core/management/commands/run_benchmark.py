@@ -0,0 +1,223 @@
+import json
+import logging
+import math
+import platform
+import subprocess
+import time
+import tracemalloc
+from typing import List
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core.cache import get_cache
+from events.models import Attend, Event, LongevityRecord
+from kennels.models import Kennel, Membership
+from packtrack.urls import router
+
+# query parameters for list actions that need them ({user} is substituted)
+ACTION_PARAMS = {
+    ('attend', 'count'): {
+        'user__username': '{user}'
+    },
+    ('longevityrecord', 'count'): {
+        'attend__user__username': '{user}'
+    },
+    ('kennel', 'cities'): {
+        'search': 'anch'
+    },
+}
+# URL kwargs for list actions routed below a lookup ({user} is substituted)
+ACTION_KWARGS = {
+    ('user', r'(?P<username>[^/]+)/summary'): {
+        'username': '{user}'
+    },
+}
+
+
+def percentile(values: List[float], p: float) -> float:
+    '''
+    Nearest-rank percentile.
+    '''
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=settings.BASE_DIR,
+                              capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class Command(BaseCommand):
+    '''
+    Times every API list, detail and list action through the test client.
+    '''
+    help = 'Benchmarks the /api/ endpoints against the current database and reports JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--user',
+                            help='Username to request as (defaults to the '
+                            'admin with the most attendance)')
+        parser.add_argument('--only',
+                            nargs='*',
+                            help='Endpoint names to run, e.g. event-list')
+        parser.add_argument('--output', help='Write the report to a file')
+        parser.add_argument('--compare',
+                            help='Earlier report to print changes against')
+        parser.add_argument('--cached',
+                            action='store_true',
+                            help='Time responses served from the response '
+                            'cache instead of clearing it before each request')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        client = APIClient()
+        client.force_authenticate(user)
+        logger = logging.getLogger('packtrack.requests')
+        disabled, logger.disabled = logger.disabled, True
+
+        results = {}
+        try:
+            with override_settings(ALLOWED_HOSTS=['*']):
+                for name, url, params in self.get_cases(client, user):
+                    if options['only'] and name not in options['only']:
+                        continue
+                    results[name] = self.measure(client, url, params,
+                                                 options['warmup'],
+                                                 options['repeat'],
+                                                 options['cached'])
+        finally:
+            logger.disabled = disabled
+
+        report = {
+            'meta': {
+                'revision': git_revision(),
+                'timestamp': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'user': user.username,
+                'repeat': options['repeat'],
+                'cached': options['cached'],
+                'rows': {
+                    model._meta.label: model.objects.count()
+                    for model in (User, Kennel, Membership, Event, Attend,
+                                  LongevityRecord)
+                },
+            },
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    def get_user(self, username: str) -> User:
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f'No user named {username}')
+        user = User.objects.filter(memberships__is_admin=True).annotate(
+            runs=Count('attendance', distinct=True)).order_by('-runs',
+                                                              'pk').first()
+        if user is None:
+            raise CommandError('No kennel admins; run seed_benchmark first')
+        return user
+
+    def get_cases(self, client, user):
+        '''
+        Yields (name, url, query params) for every registered viewset's list,
+        detail (the middle item of the first list page) and GET list actions.
+        '''
+        for prefix, viewset, basename in router.registry:
+            list_url = reverse(f'{basename}-list')
+            yield f'{basename}-list', list_url, {}
+
+            response = client.get(list_url)
+            items = response.data.get('results', []) if isinstance(
+                response.data, dict) else []
+            if items and 'url' in items[len(items) // 2]:
+                yield f'{basename}-detail', items[len(items) //
+                                                  2]['url'], {}
+
+            for action in viewset.get_extra_actions():
+                if action.detail or 'get' not in action.mapping:
+                    continue
+                params, kwargs = ({
+                    key: value.format(user=user.username)
+                    for key, value in values.get((basename,
+                                                  action.url_path), {}).items()
+                } for values in (ACTION_PARAMS, ACTION_KWARGS))
+                yield (f'{basename}-{action.url_name}',
+                       reverse(f'{basename}-{action.url_name}',
+                               kwargs=kwargs), params)
+
+    def measure(self, client, url: str, params: dict, warmup: int,
+                repeat: int, cached: bool) -> dict:
+        for _ in range(warmup):
+            client.get(url, params)
+
+        timings, queries = [], []
+        for _ in range(repeat):
+            if not cached:
+                get_cache().clear()
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = client.get(url, params)
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(len(context.captured_queries))
+
+        # traced separately, tracemalloc slows the request down
+        if not cached:
+            get_cache().clear()
+        tracemalloc.start()
+        client.get(url, params)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        return {
+            'url': url,
+            'params': params,
+            'status': response.status_code,
+            'bytes': len(response.content),
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'queries': max(queries),
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
+
+    def compare(self, path: str, results: dict) -> None:
+        with open(path) as f:
+            baseline = json.load(f)['results']
+        self.stderr.write(
+            f'{"endpoint":32} {"p50 ms":>16} {"queries":>12} {"peak kb":>18}')
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            old = baseline[name]
+            change = (result['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100
+            self.stderr.write(
+                f'{name:32} {result["p50_ms"]:>8} ({change:+5.0f}%) '
+                f'{old["queries"]:>5} -> {result["queries"]:<4} '
+                f'{old["peak_memory_kb"]:>8} -> {result["peak_memory_kb"]}')
@@ -0,0 +1,241 @@
+import datetime
+import random
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.search import indexes
+from events.models import Attend, AttendClaim, Event, Longevity, LongevityRecord
+from kennels.models import (Consensus, ConsensusVote, Kennel, LegacyLongevity,
+                            Membership, UserKennelStats)
+from profiles.models import Profile
+
+USER_PREFIX = 'bench_'
+KENNEL_PREFIX = 'Bench '
+# events are dated back from a fixed day so every run seeds the same data
+LAST_EVENT_DATE = datetime.date(2022, 1, 1)
+
+WORDS = [
+    'Full', 'Moon', 'Drinking', 'Club', 'Running', 'Red', 'Dress', 'Pub',
+    'Crawl', 'Trail', 'Beer', 'Bay', 'River', 'Hills', 'Valley', 'Harbour',
+    'Night', 'Sunday', 'Tuesday', 'Bush', 'Swamp', 'Mud', 'Ice', 'Desert'
+]
+
+
+class Command(BaseCommand):
+    '''
+    Bulk-generates a deterministic dataset for benchmarking.
+    '''
+    help = 'Generates kennels, hashers, events, attendance and votes for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kennels', type=int, default=40)
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--kennels-per-user', type=int, default=3)
+        parser.add_argument('--events-per-kennel', type=int, default=250)
+        parser.add_argument('--attendance', type=int, default=25,
+                            help='Mean attendance per event')
+        parser.add_argument('--unclaimed', type=float, default=0.05,
+                            help='Share of attendance without a user')
+        parser.add_argument('--joint-events', type=float, default=0.1,
+                            help='Share of events counting for a second kennel')
+        parser.add_argument('--consensuses', type=int, default=3,
+                            help='Open votes per kennel')
+        parser.add_argument('--legacy', type=float, default=0.1,
+                            help='Share of memberships with legacy longevity')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--flush',
+                            action='store_true',
+                            help='Empty the database first')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        if options['flush']:
+            call_command('flush', interactive=False, verbosity=0)
+        with transaction.atomic():
+            users = self.create_users(options['users'])
+            kennels = self.create_kennels(options['kennels'])
+            members = self.create_memberships(users, kennels,
+                                              options['kennels_per_user'])
+            events = self.create_events(kennels,
+                                        options['events_per_kennel'],
+                                        options['joint_events'])
+            self.create_attendance(events, members, options['attendance'],
+                                   options['unclaimed'])
+            self.create_consensuses(kennels, members, options['consensuses'])
+            self.create_legacy(members, options['legacy'])
+
+            stats = UserKennelStats.rebuild()
+            for index in indexes.values():
+                if index.is_available():
+                    index.rebuild()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Seeded {len(users)} hashers, {len(kennels)} kennels, '
+                f'{len(events)} events, {Attend.objects.count()} attendance, '
+                f'{LongevityRecord.objects.count()} longevity records, '
+                f'{stats} stats rows'))
+
+    def bulk_create(self, model, objs) -> list:
+        return model.objects.bulk_create(objs, batch_size=self.batch_size)
+
+    def name(self, words: int) -> str:
+        return ' '.join(self.rng.sample(WORDS, words))
+
+    def create_users(self, count: int) -> list:
+        users = self.bulk_create(User, [
+            User(username=f'{USER_PREFIX}{i}',
+                 email=f'{USER_PREFIX}{i}@example.com',
+                 password='!') for i in range(count)
+        ])
+        # bulk_create skips the signal creating profiles
+        self.bulk_create(Profile, [
+            Profile(user=u, hash_name=f'{self.name(2)} {u.pk}')
+            for u in users
+        ])
+        return users
+
+    def create_kennels(self, count: int) -> list:
+        return self.bulk_create(Kennel, [
+            Kennel(name=f'{KENNEL_PREFIX}{self.name(3)} {i}',
+                   acronym=f'B{i}H3',
+                   city=self.rng.choice(['Anchorage, AK, United States',
+                                         'London, ENG, United Kingdom',
+                                         'Berlin, 16, Germany']))
+            for i in range(count)
+        ])
+
+    def create_memberships(self, users, kennels, per_user: int) -> dict:
+        '''
+        Hashers join kennels with a long-tailed popularity. Returns
+        {kennel: [(user, is_admin), ...]}.
+        '''
+        weights = [1 / (rank + 1) for rank in range(len(kennels))]
+        members = {k: [] for k in kennels}
+        memberships = []
+        for user in users:
+            joined = dict.fromkeys(
+                self.rng.choices(kennels,
+                                 weights=weights,
+                                 k=self.rng.randint(1, per_user)))
+            for kennel in joined:
+                members[kennel].append(user)
+                memberships.append(
+                    Membership(user=user,
+                               kennel=kennel,
+                               is_approved=self.rng.random() > 0.05))
+        for kennel, joined in members.items():
+            if not joined:  # every kennel needs an admin
+                user = self.rng.choice(users)
+                joined.append(user)
+                memberships.append(Membership(user=user, kennel=kennel))
+        self.bulk_create(Membership, memberships)
+
+        # the first few members of each kennel are admins
+        admins = {
+            k: set(u.pk for u in joined[:max(1, len(joined) // 50)])
+            for k, joined in members.items()
+        }
+        for kennel, pks in admins.items():
+            Membership.objects.filter(kennel=kennel,
+                                      user__in=pks).update(is_admin=True,
+                                                           is_approved=True)
+        return {
+            k: [(u, u.pk in admins[k]) for u in joined]
+            for k, joined in members.items()
+        }
+
+    def create_events(self, kennels, per_kennel: int, joint: float) -> list:
+        events = []
+        for kennel in kennels:
+            for i in range(per_kennel):
+                days = i * 7 + self.rng.randint(0, 6)
+                events.append(
+                    Event(name=f'{kennel.acronym} Run #{per_kennel - i}',
+                          date=LAST_EVENT_DATE - datetime.timedelta(days=days),
+                          host=kennel))
+        events = self.bulk_create(Event, events)
+
+        # bulk_create skips the signal creating the host kennel longevity
+        longevity = [Longevity(event=e, kennel=e.host) for e in events]
+        for event in events:
+            if len(kennels) > 1 and self.rng.random() < joint:
+                other = self.rng.choice([k for k in kennels if k != event.host])
+                longevity.append(Longevity(event=event, kennel=other))
+        self.bulk_create(Longevity, longevity)
+        return events
+
+    def create_attendance(self, events, members, mean: int,
+                          unclaimed: float) -> None:
+        attendance = []
+        for event in events:
+            pool = members[event.host]
+            size = min(len(pool), max(1, int(self.rng.gauss(mean, mean / 3))))
+            for i, (user, _) in enumerate(self.rng.sample(pool, size)):
+                attendance.append(
+                    Attend(event=event,
+                           user=user,
+                           is_hare=i < self.rng.choice([1, 1, 2])))
+            for i in range(int(size * unclaimed)):
+                attendance.append(
+                    Attend(event=event, unclaimed_name=f'{self.name(2)} {i}'))
+        attendance = self.bulk_create(Attend, attendance)
+
+        # some unclaimed attendance has pending claims
+        users = [u for pool in members.values() for u, _ in pool]
+        self.bulk_create(AttendClaim, [
+            AttendClaim(attend=a, claimant=self.rng.choice(users))
+            for a in attendance
+            if a.user_id is None and self.rng.random() < 0.3
+        ])
+
+        # bulk_create skips the signals creating longevity records
+        longevity = {}
+        for l in Longevity.objects.filter(event__in=events):
+            longevity.setdefault(l.event_id, []).append(l)
+        self.bulk_create(LongevityRecord, [
+            LongevityRecord(attend=a, longevity=l) for a in attendance
+            for l in longevity[a.event_id]
+        ])
+
+    def create_consensuses(self, kennels, members, per_kennel: int) -> None:
+        '''
+        Open "make admin" votes, with the initiator's vote cast.
+        '''
+        memberships = {(m.kennel_id, m.user_id): m
+                       for m in Membership.objects.filter(kennel__in=kennels)}
+        consensuses, admins = [], {}
+        for kennel in kennels:
+            admins[kennel.pk] = [u for u, is_admin in members[kennel] if is_admin]
+            candidates = [u for u, is_admin in members[kennel] if not is_admin]
+            for user in self.rng.sample(candidates,
+                                        min(per_kennel, len(candidates))):
+                consensuses.append(
+                    Consensus(initiator=self.rng.choice(admins[kennel.pk]),
+                              kennel=kennel,
+                              type=1,
+                              membership=memberships[(kennel.pk, user.pk)],
+                              yes_votes=1,
+                              pool_size=len(admins[kennel.pk])))
+        consensuses = self.bulk_create(Consensus, consensuses)
+        self.bulk_create(ConsensusVote, [
+            ConsensusVote(consensus=c,
+                          voter=a,
+                          vote=True if a.pk == c.initiator_id else None)
+            for c in consensuses for a in admins[c.kennel_id]
+        ])
+
+    def create_legacy(self, members, share: float) -> None:
+        self.bulk_create(LegacyLongevity, [
+            LegacyLongevity(user=user,
+                            kennel=kennel,
+                            count=self.rng.randint(1, 300),
+                            hares=self.rng.randint(0, 30))
+            for kennel, pool in members.items() for user, _ in pool
+            if self.rng.random() < share
+        ])
@@ -0,0 +1,147 @@
+import json
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from typing import List, Tuple
+
+from django.conf import settings
+from django.db import connections
+
+from .settings import (REQUEST_LOG_LEVEL, SERVER_TIMING_HEADER,
+                       SLOW_REQUEST_MS, SLOWEST_QUERIES_LOGGED)
+
+logger = logging.getLogger('packtrack.requests')
+
+# metrics of the request being handled in this thread/task
+current_metrics = ContextVar('current_metrics', default=None)
+
+
+class RequestMetrics:
+    '''
+    SQL statements and named timings recorded while handling one request.
+    '''
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries: List[Tuple[str, float]] = []
+        self.timings = {}
+        self._active = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        '''
+        Database execute wrapper timing every statement.
+        '''
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    @contextmanager
+    def measure(self, name: str):
+        '''
+        Adds the time spent in the block to `name`. Nested blocks with the
+        same name are only counted once.
+        '''
+        if name in self._active:
+            yield
+            return
+        self._active.add(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._active.discard(name)
+            self.timings[name] = self.timings.get(
+                name, 0) + time.perf_counter() - start
+
+    @property
+    def db_time(self) -> float:
+        return sum(duration for _, duration in self.queries)
+
+    def summary(self, request, response) -> dict:
+        duration = time.perf_counter() - self.started
+        record = {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'db_queries': len(self.queries),
+            'db_ms': round(self.db_time * 1000, 2),
+            **{
+                f'{name}_ms': round(t * 1000, 2)
+                for name, t in self.timings.items()
+            },
+        }
+        if duration * 1000 >= SLOW_REQUEST_MS:
+            slowest = sorted(self.queries, key=lambda q: q[1],
+                             reverse=True)[:SLOWEST_QUERIES_LOGGED]
+            record['slowest'] = [{
+                'sql': sql,
+                'ms': round(t * 1000, 2)
+            } for sql, t in slowest]
+            record['queries'] = [{
+                'sql': sql,
+                'ms': round(t * 1000, 2)
+            } for sql, t in self.queries]
+        return record
+
+    def server_timing(self) -> str:
+        duration = time.perf_counter() - self.started
+        entries = [
+            f'db;dur={self.db_time * 1000:.2f};desc="{len(self.queries)} queries"'
+        ]
+        entries += [
+            f'{name};dur={t * 1000:.2f}' for name, t in self.timings.items()
+        ]
+        entries.append(f'total;dur={duration * 1000:.2f}')
+        return ', '.join(entries)
+
+
+@contextmanager
+def measure(name: str):
+    '''
+    Times a block against the current request, if one is being measured.
+    '''
+    metrics = current_metrics.get()
+    if metrics is None:
+        yield
+    else:
+        with metrics.measure(name):
+            yield
+
+
+class RequestMetricsMiddleware:
+    '''
+    Records query count, SQL time and serializer time for each request and
+    logs them as one JSON line to `packtrack.requests`. Requests slower than
+    SLOW_REQUEST_MS are logged at WARNING with their slowest statements and
+    every query, others at INFO; levels below REQUEST_LOG_LEVEL aren't
+    logged. The timings are also returned in a `Server-Timing` header when
+    SERVER_TIMING_HEADER is on, or is None and DEBUG is.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+
+        send_timing = (settings.DEBUG if SERVER_TIMING_HEADER is None else
+                       SERVER_TIMING_HEADER)
+        if send_timing:
+            response['Server-Timing'] = metrics.server_timing()
+        record = metrics.summary(request, response)
+        level = logging.WARNING if 'queries' in record else logging.INFO
+        if level >= logging.getLevelName(REQUEST_LOG_LEVEL):
+            logger.log(level, json.dumps(record), extra={'metrics': record})
+        return response
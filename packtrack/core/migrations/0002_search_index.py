@@ -0,0 +1,90 @@
+from collections import defaultdict
+
+from django.db import migrations
+
+# the search tables as this migration creates them: {table: (model, columns)}
+# with the lookups each column's text is read from. Frozen here so that later
+# changes to core.search or the apps' indexes don't change this migration.
+SEARCH_TABLES = {
+    'search_kennel': ('kennels.Kennel', {
+        'name': ['name'],
+        'acronym': ['acronym'],
+        'city': ['city'],
+        'members': ['members__username', 'members__profile__hash_name'],
+    }),
+    'search_user': ('auth.User', {
+        'username': ['username'],
+        'email': ['email'],
+        'hash_name': ['profile__hash_name'],
+        'kennels': ['kennels__name', 'kennels__acronym'],
+    }),
+    'search_event': ('events.Event', {
+        'name': ['name'],
+        'date': ['date'],
+        'host': ['host__name', 'host__acronym'],
+        'kennels': ['kennels__name', 'kennels__acronym'],
+    }),
+    'search_attend': ('events.Attend', {
+        'user': ['user__username', 'user__profile__hash_name'],
+        'event': ['event__name', 'event__date'],
+        'kennels': [
+            'event__host__name', 'event__host__acronym',
+            'event__kennels__name', 'event__kennels__acronym'
+        ],
+    }),
+}
+
+BATCH_SIZE = 500
+
+
+def index_rows(schema_editor, model, table, columns, pks):
+    documents = {pk: defaultdict(list) for pk in pks}
+    for column, lookups in columns.items():
+        for lookup in lookups:
+            values = model.objects.filter(pk__in=pks).values_list(
+                'pk', lookup).order_by()
+            for pk, value in values:
+                if value is not None:
+                    documents[pk][column].append(str(value))
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {table} (rowid, {", ".join(columns)}) '
+            f'VALUES ({", ".join(["%s"] * (len(columns) + 1))})',
+            [[pk] + [' '.join(d[column]) for column in columns]
+             for pk, d in documents.items()])
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table, (label, columns) in SEARCH_TABLES.items():
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5('
+            f'{", ".join(columns)}, '
+            "tokenize = 'unicode61 remove_diacritics 2')")
+        model = apps.get_model(label)
+        pks = list(model.objects.values_list('pk', flat=True).order_by('pk'))
+        for i in range(0, len(pks), BATCH_SIZE):
+            index_rows(schema_editor, model, table, columns,
+                       pks[i:i + BATCH_SIZE])
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table in SEARCH_TABLES:
+        schema_editor.execute(f'DROP TABLE IF EXISTS {table}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+        ('events', '0012_event_date_id_idx'),
+        ('kennels', '0016_userkennelstats'),
+        ('profiles', '0002_alter_profile_avatar'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
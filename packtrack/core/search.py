@@ -0,0 +1,282 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import (post_save, post_delete, pre_delete,
+                                      pre_save)
+from rest_framework import filters
+
+# registered indexes, keyed by model
+indexes = {}
+
+
+class SearchIndex:
+    '''
+    An SQLite FTS5 table holding one document per model row (rowid = pk).
+
+    `columns` maps each FTS column to the lookups whose values are joined into
+    it. `dependencies` lists (sender model, lookup from the indexed model) pairs
+    whose changes require the matching documents to be rebuilt.
+
+    The table's schema is frozen in core/migrations/0002_search_index.py;
+    changing `columns` needs a migration recreating the table.
+    '''
+
+    # {(database name, table)} of tables found to exist (missing ones are
+    # looked for again, as migrations may create them in this process)
+    _available = set()
+
+    def __init__(self, model, table: str, columns: Dict[str, List[str]],
+                 dependencies: List[Tuple] = ()):
+        self.model = model
+        self.table = table
+        self.columns = columns
+        self.dependencies = dependencies
+
+    def is_available(self) -> bool:
+        '''
+        Checks that the database is SQLite and the FTS table exists.
+        '''
+        if connection.vendor != 'sqlite':
+            return False
+        key = (connection.settings_dict['NAME'], self.table)
+        if key not in self._available:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+                    [self.table])
+                if cursor.fetchone() is None:
+                    return False
+            self._available.add(key)
+        return True
+
+    def get_documents(self, pks: Iterable[int], model=None) -> dict:
+        '''
+        Builds {pk: [column text, ...]} for the given rows.
+        '''
+        model = model or self.model
+        pks = list(pks)
+        documents = {
+            pk: defaultdict(list)
+            for pk in model.objects.filter(
+                pk__in=pks).values_list('pk', flat=True)
+        }
+        for column, lookups in self.columns.items():
+            for lookup in lookups:
+                values = model.objects.filter(pk__in=pks).values_list(
+                    'pk', lookup).order_by()
+                for pk, value in values:
+                    if value is not None and pk in documents:
+                        documents[pk][column].append(str(value))
+        return {
+            pk: [' '.join(d[column]) for column in self.columns]
+            for pk, d in documents.items()
+        }
+
+    def get_fields(self, lookup: str = '') -> set:
+        '''
+        Fields of the model reached by `lookup` (the indexed model's own when
+        empty) that the documents are built from.
+        '''
+        prefix = f'{lookup}__' if lookup else ''
+        return {
+            column_lookup[len(prefix):].split('__')[0]
+            for lookups in self.columns.values() for column_lookup in lookups
+            if column_lookup.startswith(prefix)
+        }
+
+    def update(self,
+               pks: Iterable[int],
+               model=None,
+               batch_size: int = 500) -> None:
+        '''
+        Replaces the documents for the given rows (removing deleted rows),
+        `batch_size` rows at a time.
+        '''
+        pks = sorted(set(pks))
+        for i in range(0, len(pks), batch_size):
+            self.update_batch(pks[i:i + batch_size], model)
+
+    def update_batch(self, pks: List[int], model=None) -> None:
+        documents = self.get_documents(pks, model)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {self.table} WHERE rowid IN '
+                f'({", ".join(["%s"] * len(pks))})', pks)
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, {", ".join(self.columns)}) '
+                f'VALUES ({", ".join(["%s"] * (len(self.columns) + 1))})',
+                [[pk] + document for pk, document in documents.items()])
+
+    def rebuild(self, model=None, batch_size: int = 500) -> int:
+        '''
+        Re-indexes every row. Returns the number of documents written.
+        '''
+        model = model or self.model
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+        pks = list(model.objects.values_list('pk', flat=True).order_by('pk'))
+        self.update(pks, model, batch_size)
+        return len(pks)
+
+    def rank(self, query: str) -> RawSQL:
+        '''
+        bm25 rank of the matching document for each row of the indexed model
+        (NULL for rows that don't match).
+        '''
+        return RawSQL(
+            f'SELECT rank FROM {self.table} WHERE {self.table} MATCH %s '
+            f'AND rowid = {self.model._meta.db_table}.'
+            f'{self.model._meta.pk.column}', [query])
+
+    def matches(self, query: str) -> RawSQL:
+        return RawSQL(
+            f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s',
+            [query])
+
+
+def get_watched_fields(sender, fields: set) -> set:
+    '''
+    Attribute names of the concrete fields of `sender` whose changes alter
+    documents built from `fields` of it. Link models (whose fields the documents don't read) are
+    watched for their relations only.
+    '''
+    if not fields:
+        fields = {f.name for f in sender._meta.concrete_fields if f.is_relation}
+    fields = [sender._meta.get_field(name) for name in fields]
+    return {field.attname for field in fields if field.concrete}
+
+
+def skips_save(sender, update_fields, watched: set) -> bool:
+    '''
+    Whether a save restricted to `update_fields` (e.g. update_last_login's)
+    leaves every watched field alone.
+    '''
+    return update_fields is not None and not {
+        sender._meta.get_field(name).attname
+        for name in update_fields
+    } & watched
+
+
+def register(index: SearchIndex) -> SearchIndex:
+    '''
+    Registers an index and connects the signals that keep it current.
+
+    Saves are skipped when `update_fields` or the stored values show that no
+    field the documents read has changed.
+    '''
+    indexes[index.model] = index
+    uid = f'search_{index.table}'
+    own_fields = get_watched_fields(index.model, index.get_fields())
+
+    def update_self(sender, instance, update_fields=None, **kwargs):
+        if skips_save(sender, update_fields, own_fields):
+            return
+        if index.is_available():
+            index.update([instance.pk])
+
+    post_save.connect(update_self, sender=index.model, weak=False,
+                      dispatch_uid=uid)
+    post_delete.connect(update_self, sender=index.model, weak=False,
+                        dispatch_uid=uid)
+
+    for sender, lookup in index.dependencies:
+        dependency_uid = f'{uid}_{sender._meta.label}_{lookup}'
+        stash = f'_{dependency_uid}'
+        watched = get_watched_fields(sender, index.get_fields(lookup))
+
+        def get_affected(instance, lookup=lookup):
+            return index.model.objects.filter(**{
+                lookup: instance.pk
+            }).values_list('pk', flat=True).order_by()
+
+        def stash_saved(sender,
+                        instance,
+                        update_fields=None,
+                        watched=watched,
+                        stash=stash,
+                        **kwargs):
+            # values before the save, to tell whether it changes documents
+            if instance.pk is None or skips_save(sender, update_fields,
+                                                 watched):
+                return
+            if index.is_available():
+                setattr(
+                    instance, stash,
+                    sender._default_manager.filter(pk=instance.pk).values(
+                        *watched).first())
+
+        def update_saved(sender,
+                         instance,
+                         created=False,
+                         update_fields=None,
+                         get_affected=get_affected,
+                         watched=watched,
+                         stash=stash,
+                         **kwargs):
+            if skips_save(sender, update_fields, watched):
+                return
+            previous = instance.__dict__.pop(stash, None)
+            current = {name: getattr(instance, name) for name in watched}
+            if not created and previous == current:
+                return
+            if index.is_available():
+                index.update(get_affected(instance))
+
+        def stash_deleted(sender,
+                          instance,
+                          get_affected=get_affected,
+                          stash=stash,
+                          **kwargs):
+            # related rows are still there before the delete
+            if index.is_available():
+                setattr(instance, stash, list(get_affected(instance)))
+
+        def update_deleted(sender, instance, stash=stash, **kwargs):
+            if index.is_available():
+                index.update(getattr(instance, stash, []))
+
+        pre_save.connect(stash_saved, sender=sender, weak=False,
+                         dispatch_uid=dependency_uid)
+        post_save.connect(update_saved, sender=sender, weak=False,
+                          dispatch_uid=dependency_uid)
+        pre_delete.connect(stash_deleted, sender=sender, weak=False,
+                           dispatch_uid=dependency_uid)
+        post_delete.connect(update_deleted, sender=sender, weak=False,
+                            dispatch_uid=dependency_uid)
+    return index
+
+
+def update_index(model, pks: Iterable[int]) -> None:
+    '''
+    Re-indexes rows written without signals (e.g. by bulk_create).
+    '''
+    index = indexes.get(model)
+    if index is not None and index.is_available():
+        index.update(pks)
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    '''
+    Answers `?search=` from the model's FTS5 index with prefix matching and
+    rank ordering. Falls back to SearchFilter when the model isn't indexed
+    or the database isn't SQLite.
+    '''
+
+    def get_match_query(self, terms: List[str]) -> str:
+        '''
+        Every term must match as a prefix of some token.
+        '''
+        return ' '.join('"{}"*'.format(t.replace('"', '""')) for t in terms)
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        index = indexes.get(queryset.model)
+        if not terms or index is None or not index.is_available():
+            return super().filter_queryset(request, queryset, view)
+
+        query = self.get_match_query(terms)
+        return queryset.filter(pk__in=index.matches(query)).annotate(
+            search_rank=index.rank(query)).order_by('search_rank',
+                                                    *queryset.query.order_by)
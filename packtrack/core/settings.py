@@ -1,2 +1,15 @@
 INVITE_CODE_LIMIT = 20  # number of unused invite codes a user is allowed to have
 DEFAULT_INVITE_EXPIRATION_DAYS = 7
+
+# Request instrumentation (core.middleware.RequestMetricsMiddleware)
+SLOW_REQUEST_MS = 500  # only slower requests log their SQL
+REQUEST_LOG_LEVEL = 'WARNING'  # 'INFO' also logs every faster request
+SLOWEST_QUERIES_LOGGED = 3
+SERVER_TIMING_HEADER = None  # None sends it only when DEBUG is on
+
+# API response cache (core.api.viewsets.common.ResponseCacheMixin)
+RESPONSE_CACHE = 'default'  # CACHES alias for responses and generations
+RESPONSE_CACHE_TIMEOUT = 300  # seconds, 0 disables caching
+
+# Capped nested collections (core.api.serializers.common.BatchedListField)
+NESTED_LIST_LIMIT = 20  # children per page of a nested collection
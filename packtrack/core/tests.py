@@ -1,3 +1,727 @@
-from django.test import TestCase
+import datetime
+import json
+import tempfile
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser, User, update_last_login
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Count, F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import relations
+from rest_framework.relations import HyperlinkedRelatedField
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from events.api.serializers import EventSerializer, LongevityRecordSerializer
+from events.models import Attend, Event, LongevityRecord
+from events.tests import create_events
+from kennels.api.serializers import MembershipSerializer
+from kennels.models import Kennel, Membership, UserKennelStats
+from profiles.api.serializers import ProfileSerializer
+from .api.serializers.common import (BatchLoader, CachedHyperlinkMixin,
+                                     CachedHyperlinkedRelatedField,
+                                     get_query_plan)
+from .api.serializers.values import (HyperlinkTemplate, UnsupportedField,
+                                     ValuesSerializer)
+from .api.viewsets.common import ResponseCacheMixin
+from .search import SearchIndex, indexes as search_indexes
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+    }
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RequestMetricsMiddlewareTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create(username='user1')
+        Kennel.objects.create(name='kennel1', acronym='K1', city='anchorage')
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @mock.patch('core.middleware.REQUEST_LOG_LEVEL', 'INFO')
+    def get_logged(self, url):
+        with self.assertLogs('packtrack.requests', 'INFO') as logs:
+            response = self.client.get(url)
+        self.assertEqual(len(logs.records), 1)
+        return response, logs.records[0]
+
+    def test_only_slow_requests_are_logged_by_default(self):
+        with self.assertNoLogs('packtrack.requests', 'INFO'):
+            self.client.get('/api/kennels/')
+        with mock.patch('core.middleware.SLOW_REQUEST_MS', 0), \
+                self.assertLogs('packtrack.requests', 'WARNING') as logs:
+            self.client.get('/api/kennels/')
+        self.assertEqual(len(logs.records), 1)
+
+    def test_logs_counts_without_sql(self):
+        response, record = self.get_logged('/api/kennels/')
+        self.assertEqual(record.levelname, 'INFO')
+        self.assertEqual(record.metrics['status'], 200)
+        self.assertGreater(record.metrics['db_queries'], 0)
+        self.assertIn('serializer_ms', record.metrics)
+        self.assertNotIn('slowest', record.metrics)
+        self.assertNotIn('queries', record.metrics)
+        self.assertEqual(json.loads(record.getMessage()), record.metrics)
+
+    def test_slow_requests_log_their_sql(self):
+        with mock.patch('core.middleware.SLOW_REQUEST_MS', 0):
+            response, record = self.get_logged('/api/kennels/')
+        self.assertEqual(record.levelname, 'WARNING')
+        self.assertEqual(len(record.metrics['queries']),
+                         record.metrics['db_queries'])
+        self.assertLessEqual(len(record.metrics['slowest']), 3)
+        self.assertIn('SELECT', record.metrics['slowest'][0]['sql'])
+
+    def test_server_timing_follows_debug(self):
+        response, record = self.get_logged('/api/kennels/')
+        self.assertNotIn('Server-Timing', response)
+        with override_settings(DEBUG=True):
+            response, record = self.get_logged('/api/kennels/?page=1')
+        self.assertIn(f'desc="{record.metrics["db_queries"]} queries"',
+                      response['Server-Timing'])
+        with mock.patch('core.middleware.SERVER_TIMING_HEADER', False), \
+                override_settings(DEBUG=True):
+            response, record = self.get_logged('/api/kennels/')
+        self.assertNotIn('Server-Timing', response)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ResponseCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.users = [User.objects.create(username=f'user{i}') for i in range(2)]
+        cls.kennel = Kennel.objects.create(name='kennel1',
+                                           acronym='K1',
+                                           city='anchorage')
+        Membership.objects.create(user=cls.users[0],
+                                  kennel=cls.kennel,
+                                  is_approved=True)
+        cls.event = Event.objects.create(name='run 1',
+                                         date=datetime.date(2020, 1, 1),
+                                         host=cls.kennel)
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def assertCached(self, url, cached=True):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(not queries.captured_queries, cached, url)
+        return response
+
+    def test_writes_expire_only_their_models_and_scopes(self):
+        urls = ['/api/kennels/', '/api/users/', '/api/attendance/']
+        for url in urls:
+            self.assertCached(url, cached=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            Attend.objects.create(event=self.event, unclaimed_name='anon')
+        self.assertCached('/api/kennels/')
+        self.assertCached('/api/users/')
+        self.assertCached('/api/attendance/', cached=False)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.kennel.name = 'kennel one'
+            self.kennel.save()
+        response = self.assertCached(f'/api/kennels/{self.kennel.pk}/',
+                                     cached=False)
+        self.assertEqual(response.data['name'], 'kennel one')
+        self.assertCached(f'/api/kennels/{self.kennel.pk}/')
+
+    def test_hasher_renames_expire_kennels_they_are_shown_in(self):
+        # a visiting hasher, ranked on the leaderboard without a membership
+        with self.captureOnCommitCallbacks(execute=True):
+            Attend.objects.create(event=self.event, user=self.users[1])
+        url = f'/api/kennels/{self.kennel.pk}/leaderboard/'
+        self.assertCached(url, cached=False)
+        self.assertCached(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = self.users[1].profile
+            profile.hash_name = 'Speedy'
+            profile.save()
+        response = self.assertCached(url, cached=False)
+        self.assertEqual(
+            response.data['results'][0]['user']['profile']['hash_name'],
+            'Speedy')
+
+    def test_cache_scope(self):
+        view = ResponseCacheMixin()
+        view.request = mock.Mock(user=self.users[0])
+        self.assertEqual(view.get_cache_scope(), f'user:{self.users[0].pk}')
+        view.shared_cache = True
+        self.assertEqual(view.get_cache_scope(), 'authenticated')
+        view.request.user = AnonymousUser()
+        self.assertEqual(view.get_cache_scope(), 'anonymous')
+
+        self.assertCached('/api/kennels/', cached=False)
+        self.client.force_authenticate(self.users[1])
+        self.assertCached('/api/kennels/')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class QueryPlanTest(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.kennel = Kennel.objects.create(name='kennel1',
+                                            acronym='K1',
+                                            city='anchorage')
+        self.users = [User.objects.create(username=f'user{i}') for i in range(4)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def test_plan_follows_rendered_fields(self):
+        self.assertEqual(
+            get_query_plan(LongevityRecordSerializer()),
+            ([
+                'longevity', 'longevity__kennel', 'longevity__event',
+                'longevity__event__host', 'attend', 'attend__user',
+                'attend__user__profile'
+            ], []))
+        self.assertEqual(get_query_plan(EventSerializer()),
+                         (['host'], ['kennels']))
+        self.assertEqual(
+            get_query_plan(MembershipSerializer(fields=['url', 'kennel'])),
+            (['kennel'], []))
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries.captured_queries)
+
+    def test_list_queries_do_not_grow_with_rows(self):
+        urls = ['/api/longevityrecords/', '/api/memberships/', '/api/users/']
+        for i, user in enumerate(self.users[:2]):
+            Membership.objects.create(user=user, kennel=self.kennel)
+            Event.objects.create(name=f'run {i}',
+                                 date=datetime.date(2020, 1, 1),
+                                 host=self.kennel).attendance.create(user=user)
+        few = [self.count_queries(url) for url in urls]
+        for i, user in enumerate(self.users[2:]):
+            Membership.objects.create(user=user, kennel=self.kennel)
+            event = Event.objects.create(name=f'run {i + 2}',
+                                         date=datetime.date(2020, 1, 2),
+                                         host=self.kennel)
+            for attendee in self.users:
+                event.attendance.create(user=attendee)
+        self.assertEqual([self.count_queries(url) for url in urls], few)
+
+
+class CompiledFieldsTest(TestCase):
+    fields = ['url', 'user__username', 'user__profile__hash_name',
+              'kennel__name']
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.membership = Membership.objects.create(
+            user=User.objects.create(username='user1'),
+            kennel=Kennel.objects.create(name='kennel1',
+                                         acronym='K1',
+                                         city='anchorage'))
+
+    def get_serializer(self):
+        request = Request(APIRequestFactory().get('/'))
+        return MembershipSerializer(self.membership,
+                                    fields=self.fields,
+                                    context={'request': request})
+
+    def test_pruned_fields(self):
+        self.assertEqual(
+            json.loads(json.dumps(self.get_serializer().data)), {
+                'url':
+                f'http://testserver/api/memberships/{self.membership.pk}/',
+                'user': {
+                    'username': 'user1',
+                    'profile': {
+                        'hash_name': 'user1'
+                    }
+                },
+                'kennel': {
+                    'name': 'kennel1'
+                }
+            })
+
+    def test_field_trees_are_built_once_and_cloned(self):
+        compiled = MembershipSerializer.get_compiled_fields(tuple(self.fields))
+        self.assertIs(
+            MembershipSerializer.get_compiled_fields(tuple(self.fields)),
+            compiled)
+        first, second = self.get_serializer(), self.get_serializer()
+        self.assertIsNot(first.fields['user'], second.fields['user'])
+        self.assertIsNot(first.fields['user'], compiled['user'])
+        self.assertIs(first.fields['user'].parent, first)
+        self.assertIs(first.fields['user'].fields['profile'].parent,
+                      first.fields['user'])
+
+    def test_pruning_a_clone_does_not_leak(self):
+        first = self.get_serializer()
+        first.fields.pop('kennel')
+        first.fields['user'].fields.pop('profile')
+        second = self.get_serializer()
+        self.assertEqual(list(second.fields), ['url', 'user', 'kennel'])
+        self.assertEqual(list(second.fields['user'].fields),
+                         ['username', 'profile'])
+
+
+class BatchLoaderTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        kennel = Kennel.objects.create(name='kennel1',
+                                       acronym='K1',
+                                       city='anchorage')
+        cls.events = [
+            Event.objects.create(name=f'run {i}',
+                                 date=datetime.date(2020, 1, 1),
+                                 host=kennel) for i in range(3)
+        ]
+        for i, event in enumerate(cls.events[:2]):
+            for j in range(4 + i):
+                event.attendance.create(unclaimed_name=f'hasher {j}')
+
+    def get_expected(self, event, start=0, stop=None):
+        return list(
+            event.attendance.order_by('-id').values_list('pk',
+                                                         flat=True))[start:stop]
+
+    def test_loads_a_page_of_children_in_one_query(self):
+        loader = BatchLoader(Attend.objects.order_by('-id'), 'event')
+        with self.assertNumQueries(1):
+            loaded = [[a.pk for a in loader.load(event, self.events)]
+                      for event in self.events]
+        self.assertEqual(loaded,
+                         [self.get_expected(event) for event in self.events])
+        self.assertEqual(
+            [loader.load(event, self.events)[0].batch_parent_id
+             for event in self.events[:2]],
+            [event.pk for event in self.events[:2]])
+
+    def test_limited_children_are_ranked_per_parent(self):
+        loader = BatchLoader(Attend.objects.order_by('-id'),
+                             'event',
+                             limit=2,
+                             offset=1)
+        with self.assertNumQueries(2):
+            loaded = [[a.pk for a in loader.load(event, self.events)]
+                      for event in self.events]
+            counts = [loader.count(event, self.events)
+                      for event in self.events]
+        self.assertEqual(
+            loaded, [self.get_expected(event, 1, 3) for event in self.events])
+        self.assertEqual(counts, [4, 5, 0])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SearchIndexTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.kennel = Kennel.objects.create(name='Anchorage H3',
+                                           acronym='AH3',
+                                           city='anchorage')
+        cls.user = User.objects.create(username='zippy')
+        cls.user.profile.hash_name = 'Speedy Gonzales'
+        cls.user.profile.save()
+        Membership.objects.create(user=cls.user, kennel=cls.kennel)
+        cls.event = Event.objects.create(name='Full Moon Run',
+                                         date=datetime.date(2020, 1, 1),
+                                         host=cls.kennel)
+        cls.attend = cls.event.attendance.create(user=cls.user)
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, name, terms):
+        response = self.client.get(f'/api/{name}/', {'search': terms})
+        return [row['url'] for row in response.data['results']]
+
+    def assertFound(self, terms, found=True):
+        urls = {
+            'kennels': f'http://testserver/api/kennels/{self.kennel.pk}/',
+            'users': f'http://testserver/api/users/{self.user.pk}/',
+            'attendance':
+            f'http://testserver/api/attendance/{self.attend.pk}/',
+        }
+        for name, url in urls.items():
+            self.assertEqual(url in self.search(name, terms), found,
+                             (name, terms))
+
+    def test_search_matches_prefixes_of_related_names(self):
+        self.assertFound('speed gonz')
+        self.assertEqual(
+            self.search('events', 'anch full'),
+            [f'http://testserver/api/events/{self.event.pk}/'])
+        self.assertEqual(self.search('events', 'anch half'), [])
+
+    def test_related_changes_update_documents(self):
+        profile = self.user.profile
+        profile.hash_name = 'Slowpoke'
+        profile.save()
+        self.assertFound('slowpoke')
+        self.assertFound('speedy', found=False)
+        self.kennel.name = 'Juneau H3'
+        self.kennel.save()
+        self.assertEqual(
+            self.search('events', 'juneau'),
+            [f'http://testserver/api/events/{self.event.pk}/'])
+        self.assertEqual(self.search('attendance', 'anchorage'), [])
+
+    def test_saves_without_indexed_changes_skip_reindexing(self):
+        with mock.patch.object(SearchIndex, 'update',
+                               autospec=True) as update:
+            update_last_login(None, self.user)
+            self.user.profile.save(update_fields=['avatar'])
+            self.kennel.about = 'on on'
+            self.kennel.save()
+        # only the kennel's own document is rewritten
+        self.assertEqual(
+            [(call.args[0].table, list(call.args[1]))
+             for call in update.call_args_list],
+            [('search_kennel', [self.kennel.pk])])
+        with mock.patch.object(SearchIndex, 'update',
+                               autospec=True) as update:
+            self.kennel.acronym = 'AKH3'
+            self.kennel.save()
+        self.assertEqual(
+            {call.args[0].table
+             for call in update.call_args_list},
+            {'search_kennel', 'search_user', 'search_event', 'search_attend'})
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            for index in search_indexes.values():
+                cursor.execute(f'DELETE FROM {index.table}')
+        self.assertFound('speedy', found=False)
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 1 rows into search_attend', out.getvalue())
+        self.assertFound('speedy')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BenchmarkCommandTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        call_command('seed_benchmark',
+                     kennels=3,
+                     users=30,
+                     events_per_kennel=6,
+                     attendance=5,
+                     consensuses=1,
+                     legacy=0.5,
+                     stdout=StringIO())
+
+    def setUp(self) -> None:
+        cache.clear()
+
+    def test_seeded_rows_match_what_signals_would_create(self):
+        self.assertEqual(Kennel.objects.count(), 3)
+        self.assertEqual(Event.objects.count(), 18)
+        self.assertFalse(
+            User.objects.filter(username__startswith='bench_',
+                                profile__isnull=True).exists())
+        self.assertFalse(
+            Event.objects.exclude(longevity__kennel=F('host')).exists())
+        self.assertFalse(
+            Kennel.objects.exclude(memberships__is_admin=True).exists())
+        self.assertEqual(
+            LongevityRecord.objects.count(),
+            Attend.objects.aggregate(
+                total=Count('event__longevity'))['total'])
+        stats = set(UserKennelStats.objects.values_list(
+            'user', 'kennel', 'runs', 'hares', 'first_run', 'last_run'))
+        UserKennelStats.rebuild()
+        self.assertEqual(
+            set(UserKennelStats.objects.values_list(
+                'user', 'kennel', 'runs', 'hares', 'first_run', 'last_run')),
+            stats)
+
+    def test_run_benchmark_reports_every_endpoint(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = f'{directory.name}/report.json'
+        call_command('run_benchmark',
+                     repeat=2,
+                     warmup=0,
+                     output=path,
+                     stdout=StringIO())
+        with open(path) as f:
+            report = json.load(f)
+        self.assertEqual(report['meta']['rows']['events.Event'], 18)
+        results = report['results']
+        for name in ['kennel-list', 'kennel-detail', 'event-list',
+                     'attend-count', 'user-summary', 'kennel-cities']:
+            self.assertIn(name, results)
+        for name, result in results.items():
+            self.assertEqual(result['status'], 200, name)
+
+        err = StringIO()
+        call_command('run_benchmark',
+                     repeat=1,
+                     warmup=0,
+                     only=['event-list'],
+                     compare=path,
+                     stdout=StringIO(),
+                     stderr=err)
+        self.assertIn('event-list', err.getvalue())
+        self.assertNotIn('kennel-list', err.getvalue())
+
+    def test_run_benchmark_needs_a_user(self):
+        with self.assertRaisesMessage(CommandError, 'No user named nobody'):
+            call_command('run_benchmark', user='nobody', stdout=StringIO())
+        Membership.objects.update(is_admin=False)
+        with self.assertRaisesMessage(CommandError, 'run seed_benchmark'):
+            call_command('run_benchmark', stdout=StringIO())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ConditionalGetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create(username='user0')
+        cls.kennel = Kennel.objects.create(name='kennel1',
+                                           acronym='K1',
+                                           city='anchorage')
+        Membership.objects.create(user=cls.user, kennel=cls.kennel)
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_unchanged_responses_are_not_modified(self):
+        for url in ['/api/kennels/', f'/api/kennels/{self.kennel.pk}/']:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('no-cache', response['Cache-Control'])
+            self.assertIn('private', response['Cache-Control'])
+            with self.assertNumQueries(0):
+                revalidated = self.client.get(
+                    url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(revalidated.status_code, 304)
+            self.assertEqual(revalidated.content, b'')
+            self.assertEqual(revalidated['ETag'], response['ETag'])
+            with self.assertNumQueries(0):
+                revalidated = self.client.get(
+                    url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(revalidated.status_code, 304)
+
+    def test_writes_change_the_validators(self):
+        url = '/api/kennels/'
+        response = self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.kennel.name = 'kennel one'
+            self.kennel.save()
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+        self.assertEqual(changed.data['results'][0]['name'], 'kennel one')
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE='Mon, 01 Jan 2001 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+    def test_validators_depend_on_format_and_url(self):
+        url = '/api/kennels/'
+        json_etag = self.client.get(url)['ETag']
+        html = self.client.get(url, HTTP_ACCEPT='text/html')
+        self.assertNotEqual(html['ETag'], json_etag)
+        response = self.client.get(url, {'name': 'kennel1'},
+                                   HTTP_IF_NONE_MATCH=json_etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_errors_and_uncached_actions_carry_no_validators(self):
+        response = self.client.get('/api/kennels/999/')
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('ETag', response)
+        response = self.client.get('/api/kennels/cities/',
+                                   {'search': 'anch'})
+        self.assertNotIn('ETag', response)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ValuesListTest(TestCase):
+
+    urls = [
+        ('/api/events/', {}),
+        ('/api/events/', {'page': 2}),
+        ('/api/events/', {'cursor': ''}),
+        ('/api/events/', {'search': 'k1'}),
+        ('/api/attendance/', {}),
+        ('/api/attendance/', {'cursor': ''}),
+        ('/api/attendance/', {'user__username': 'user1', 'is_hare': 'true'}),
+        ('/api/attendance/', {'event__kennels__acronym': 'K1'}),
+        ('/api/kennels/', {}),
+        ('/api/kennels/', {'members__username': 'user0'}),
+        ('/api/kennels/', {'format': 'json', 'search': 'anch'}),
+    ]
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.kennels = [
+            Kennel.objects.create(name=f'Kénnel “{i}”',
+                                  acronym=f'K{i}',
+                                  city='anchorage',
+                                  about='' if i else 'on on\n') for i in range(3)
+        ]
+        cls.users = [User.objects.create(username=f'user{i}') for i in range(3)]
+        for i, user in enumerate(cls.users):
+            user.profile.hash_name = f'Häsh {i}'
+            user.profile.save()
+            Membership.objects.create(user=user,
+                                      kennel=cls.kennels[i % 2],
+                                      is_admin=i == 0)
+        for i in range(25):
+            event = Event.objects.create(name=f'run {i}',
+                                         date=datetime.date(2020, 1,
+                                                            1 + i // 3),
+                                         host=cls.kennels[i % 2])
+            if i % 4 == 0:
+                event.longevity_set.create(kennel=cls.kennels[2])
+            for user in cls.users[:1 + i % 3]:
+                event.attendance.create(user=user, is_hare=i % 5 == 0)
+            event.attendance.create(unclaimed_name=f'anon {i}')
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[1])
+
+    def get(self, url, params):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, (url, params))
+        return response.content, len(queries.captured_queries)
+
+    def test_values_and_serializer_paths_render_the_same(self):
+        for url, params in self.urls:
+            content, queries = self.get(url, params)
+            with mock.patch('core.api.viewsets.common.ValuesSerializer',
+                            side_effect=UnsupportedField):
+                expected, expected_queries = self.get(url, params)
+            self.assertEqual(content, expected, (url, params))
+            self.assertLessEqual(queries, expected_queries, (url, params))
+
+    def test_event_pages_follow_the_keyset_order(self):
+        expected = [
+            f'http://testserver/api/events/{pk}/' for pk in Event.objects.
+            order_by('-date', '-id').values_list('id', flat=True)[:20]
+        ]
+        for params in [{}, {'cursor': ''}]:
+            content = self.get('/api/events/', params)[0]
+            self.assertEqual(
+                [row['url'] for row in json.loads(content)['results']],
+                expected, params)
+
+    def test_unsupported_serializers_fall_back(self):
+        request = Request(APIRequestFactory().get('/api/profiles/'))
+        with self.assertRaises(UnsupportedField):
+            ValuesSerializer(
+                ProfileSerializer(context={'request': request}))
+        content, _ = self.get('/api/profiles/', {})
+        self.assertIn('Häsh 1', content.decode())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CachedHyperlinkTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.users = [
+            User.objects.create(username=name) for name in ['user0', 'a b']
+        ]
+        cls.kennels = [
+            Kennel.objects.create(name=f'kennel{i}',
+                                  acronym=f'K{i}',
+                                  city='anchorage') for i in range(2)
+        ]
+        for user in cls.users:
+            for kennel in cls.kennels:
+                Membership.objects.create(user=user, kennel=kennel)
+        create_events(cls.kennels[0], cls.users, 4)
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def get_request(self, path='/api/kennels/'):
+        return Request(APIRequestFactory().get(path))
+
+    def test_urls_match_reversed_urls(self):
+        request = self.get_request()
+        for view_name, lookup_field, obj in [
+            ('kennel-detail', 'pk', self.kennels[1]),
+            ('user-detail', 'pk', self.users[1]),
+            ('user-summary', 'username', self.users[1]),
+            ('kennel-detail', 'pk', Kennel()),
+        ]:
+            for format in [None, 'json']:
+                cached, plain = [
+                    field_class(view_name=view_name,
+                                lookup_field=lookup_field,
+                                read_only=True).get_url(
+                                    obj, view_name, request, format)
+                    for field_class in [
+                        CachedHyperlinkedRelatedField,
+                        HyperlinkedRelatedField
+                    ]
+                ]
+                self.assertEqual(cached, plain, (view_name, format))
+
+    def test_routes_are_reversed_once_per_request(self):
+        request = self.get_request()
+        with mock.patch('rest_framework.relations.reverse',
+                        wraps=relations.reverse) as reverse:
+            data = MembershipSerializer(Membership.objects.all(),
+                                        many=True,
+                                        context={
+                                            'request': request
+                                        }).data
+        self.assertEqual(len(data), 4)
+        view_names = [call.args[0] for call in reverse.call_args_list]
+        self.assertIn('membership-detail', view_names)
+        self.assertEqual(len(view_names), len(set(view_names)))
+
+    def test_responses_match_reversed_urls(self):
+        paths = [
+            '/api/memberships/', f'/api/kennels/{self.kennels[0].pk}/',
+            '/api/longevityrecords/', '/api/attendance/', '/api/events/',
+            '/api/users/?format=json'
+        ]
+        responses = []
+        for _ in range(2):
+            cache.clear()
+            responses.append([self.client.get(path).content for path in paths])
+            # reverse every hyperlink instead
+            for patcher in [
+                    mock.patch.object(CachedHyperlinkMixin, 'get_url',
+                                      HyperlinkedRelatedField.get_url),
+                    mock.patch.object(
+                        HyperlinkTemplate, 'render', lambda self, value:
+                        None if value in (None, '') else self.get_url(value))
+            ]:
+                patcher.start()
+                self.addCleanup(patcher.stop)
+        self.assertEqual(responses[0], responses[1])
@@ -1,15 +1,24 @@
 from django.db.utils import IntegrityError
 from rest_framework import serializers, exceptions
 from django.utils.translation import gettext_lazy as _
+from django.contrib.auth.models import User
+from django.db.models import Q
 
 from .. import models
 from core.api.serializers.serializers import UserSerializer
-from core.api.serializers.common import NestedDynamicFieldsModelSerializer
+from core.api.serializers.common import (BatchedListField,
+                                         CachedHyperlinkedModelSerializer,
+                                         CachedHyperlinkedRelatedField,
+                                         HyperlinkedLookupField,
+                                         NestedDynamicFieldsModelSerializer)
+from core.search import update_index
+from core.settings import NESTED_LIST_LIMIT
 from kennels.api.serializers import KennelSerializer
+from kennels.permissions import is_kennel_admin
 
 
 class EventSerializer(NestedDynamicFieldsModelSerializer,
-                      serializers.HyperlinkedModelSerializer):
+                      CachedHyperlinkedModelSerializer):
     '''
     
     '''
@@ -17,7 +26,16 @@ class EventSerializer(NestedDynamicFieldsModelSerializer,
     kennels = KennelSerializer(fields=['url', 'name', 'acronym'],
                                many=True,
                                read_only=True)
-    attendance = serializers.SerializerMethodField()
+    attendance = BatchedListField('events.api.serializers.AttendSerializer',
+                                  fields=[
+                                      'url', 'is_hare', 'unclaimed_name',
+                                      'user__url', 'user__username',
+                                      'user__profile__hash_name'
+                                  ],
+                                  parent_lookup='event',
+                                  order_by=('user', 'id'),
+                                  limit=NESTED_LIST_LIMIT,
+                                  expandable=True)
 
     class Meta:
         model = models.Event
@@ -26,19 +44,8 @@ class EventSerializer(NestedDynamicFieldsModelSerializer,
             'url', 'id', 'date', 'host', 'attendance', 'kennels'
         ]
 
-    def get_attendance(self, instance):
-        # get kennels where user is admin
-        return AttendSerializer(instance.attendance.order_by('user'),
-                                fields=[
-                                    'url', 'is_hare', 'unclaimed_name',
-                                    'user__url', 'user__username',
-                                    'user__profile__hash_name'
-                                ],
-                                many=True,
-                                context=self.context).data
 
-
-class EventCreateSerializer(serializers.HyperlinkedModelSerializer):
+class EventCreateSerializer(CachedHyperlinkedModelSerializer):
     '''
     Serializer for Event creation.
     Provides proper fields and kennel-level permissions
@@ -51,14 +58,13 @@ class EventCreateSerializer(serializers.HyperlinkedModelSerializer):
         fields = ['name', 'date', 'host']
 
     def create(self, validated_data):
-        if self.context['request'].user in validated_data[
-                'host'].get_kennel_admins():
+        if is_kennel_admin(self.context['request'], validated_data['host']):
             return super().create(validated_data)
         raise exceptions.PermissionDenied
 
 
 class LongevitySerializer(NestedDynamicFieldsModelSerializer,
-                          serializers.HyperlinkedModelSerializer):
+                          CachedHyperlinkedModelSerializer):
 
     kennel = KennelSerializer(fields=['url', 'name', 'acronym'])
     event = EventSerializer(
@@ -71,16 +77,25 @@ class LongevitySerializer(NestedDynamicFieldsModelSerializer,
 
 
 class AttendSerializer(NestedDynamicFieldsModelSerializer,
-                       serializers.HyperlinkedModelSerializer):
+                       CachedHyperlinkedModelSerializer):
 
     user = UserSerializer(fields=['url', 'username', 'profile__hash_name'],
                           read_only=True)
 
-    longevity_records = serializers.SerializerMethodField()
+    longevity_records = BatchedListField(
+        'events.api.serializers.LongevityRecordSerializer',
+        fields=[
+            'url', 'longevity', 'run_number', 'longevity__kennel__url',
+            'longevity__kennel__name', 'longevity__kennel__acronym'
+        ],
+        parent_lookup='attend')
     event = EventSerializer(fields=[
         'url', 'id', 'name', 'date', 'host__url', 'host__name', 'host__acronym'
     ])
-    claimants = serializers.SerializerMethodField()
+    claimants = BatchedListField(
+        UserSerializer,
+        fields=['url', 'username', 'profile__hash_name'],
+        parent_lookup='attend_claims__attend')
 
     class Meta:
         model = models.Attend
@@ -93,30 +108,9 @@ class AttendSerializer(NestedDynamicFieldsModelSerializer,
             'claimants'
         ]
 
-    def get_longevity_records(self, instance):
-        return LongevityRecordSerializer(instance=instance.longevity_records,
-                                         context=self.context,
-                                         fields=[
-                                             'url', 'longevity',
-                                             'longevity__kennel__url',
-                                             'longevity__kennel__name',
-                                             'longevity__kennel__acronym'
-                                         ],
-                                         many=True).data
-
-    def get_claimants(self, instance):
-        return UserSerializer(instance=instance.claimants,
-                              context=self.context,
-                              fields=[
-                                  'url',
-                                  'username',
-                                  'profile__hash_name',
-                              ],
-                              many=True).data
-
 
 class AttendCreateSerializer(NestedDynamicFieldsModelSerializer,
-                             serializers.HyperlinkedModelSerializer):
+                             CachedHyperlinkedModelSerializer):
     '''
     Serializer for Attend creation.
     Provides proper fields and kennel-level permissions
@@ -127,14 +121,82 @@ class AttendCreateSerializer(NestedDynamicFieldsModelSerializer,
         fields = ['url', 'event', 'user', 'unclaimed_name', 'is_hare']
 
     def create(self, validated_data):
-        if self.context['request'].user in validated_data[
-                'event'].host.get_kennel_admins():
+        if is_kennel_admin(self.context['request'],
+                           validated_data['event'].host_id):
             return super().create(validated_data)
         raise exceptions.PermissionDenied
 
 
+class AttendRosterItemSerializer(serializers.Serializer):
+    '''
+    One hasher in a bulk attendance roster: a user or an unclaimed name.
+    '''
+    user = HyperlinkedLookupField(view_name='user-detail',
+                                  queryset=User.objects.all(),
+                                  required=False,
+                                  allow_null=True)
+    unclaimed_name = serializers.CharField(max_length=64,
+                                           required=False,
+                                           allow_null=True)
+    is_hare = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        if bool(data.get('user')) == bool(data.get('unclaimed_name')):
+            raise serializers.ValidationError(
+                _('Provide either a user or an unclaimed name'))
+        return data
+
+
+class AttendBulkCreateSerializer(serializers.Serializer):
+    '''
+    Serializer for recording a whole event roster at once.
+    Users are loaded and duplicates checked in one query each, and the
+    kennel-level permission is checked once for the roster.
+    '''
+    event = CachedHyperlinkedRelatedField(
+        view_name='event-detail',
+        queryset=models.Event.objects.select_related('host'))
+    roster = AttendRosterItemSerializer(many=True, allow_empty=False)
+
+    def validate(self, data):
+        event, roster = data['event'], data['roster']
+        user_ids = [int(a['user']) for a in roster if a.get('user')]
+        names = [a['unclaimed_name'] for a in roster if not a.get('user')]
+        if len(set(user_ids)) < len(user_ids) or len(set(names)) < len(names):
+            raise serializers.ValidationError(
+                {'roster': _('Roster lists a hasher more than once')})
+
+        users = User.objects.in_bulk(user_ids)
+        if len(users) < len(user_ids):
+            raise serializers.ValidationError(
+                {'roster': _('Roster lists users that do not exist')})
+        if models.Attend.objects.filter(event=event).filter(
+                Q(user__in=user_ids) | Q(unclaimed_name__in=names)).exists():
+            raise serializers.ValidationError({
+                'roster':
+                _('Roster lists hashers already recorded for this event')
+            })
+        for a in roster:
+            if a.get('user'):
+                a['user'] = users[int(a['user'])]
+                a['unclaimed_name'] = None
+        return data
+
+    def create(self, validated_data):
+        event = validated_data['event']
+        if not is_kennel_admin(self.context['request'], event.host_id):
+            raise exceptions.PermissionDenied
+        attendance = models.Attend.objects.bulk_create([
+            models.Attend(event=event, **a) for a in validated_data['roster']
+        ])
+        # bulk_create skips the post_save signals
+        models.create_longevity_records(attendance)
+        update_index(models.Attend, [a.pk for a in attendance])
+        return attendance
+
+
 class AttendModifyClaimedSerializer(NestedDynamicFieldsModelSerializer,
-                                    serializers.HyperlinkedModelSerializer):
+                                    CachedHyperlinkedModelSerializer):
     '''
     Serializer for claimed Attend modification.
     Restricts writable fields
@@ -147,7 +209,7 @@ class AttendModifyClaimedSerializer(NestedDynamicFieldsModelSerializer,
 
 
 class AttendModifyUnclaimedSerializer(NestedDynamicFieldsModelSerializer,
-                                      serializers.HyperlinkedModelSerializer):
+                                      CachedHyperlinkedModelSerializer):
     '''
     Serializer for claimed Attend modification.
     '''
@@ -159,7 +221,7 @@ class AttendModifyUnclaimedSerializer(NestedDynamicFieldsModelSerializer,
 
 
 class LongevityRecordSerializer(NestedDynamicFieldsModelSerializer,
-                                serializers.HyperlinkedModelSerializer):
+                                CachedHyperlinkedModelSerializer):
 
     longevity = LongevitySerializer(fields=[
         'event__url', 'event__name', 'event__host__url', 'event__host__name',
@@ -175,10 +237,11 @@ class LongevityRecordSerializer(NestedDynamicFieldsModelSerializer,
 
     class Meta:
         model = models.LongevityRecord
-        fields = ['url', 'longevity', 'is_longevity', 'attend']
+        fields = ['url', 'longevity', 'is_longevity', 'run_number', 'attend']
+        read_only_fields = ['run_number']
 
 
-class AttendClaimSerializer(serializers.HyperlinkedModelSerializer):
+class AttendClaimSerializer(CachedHyperlinkedModelSerializer):
 
     attend = AttendSerializer(fields=[
         'url', 'event__url', 'event__name', 'event__date', 'event__host__url',
@@ -191,7 +254,7 @@ class AttendClaimSerializer(serializers.HyperlinkedModelSerializer):
         read_only_fields = ['claimant']
 
 
-class AttendClaimCreateSerializer(serializers.HyperlinkedModelSerializer):
+class AttendClaimCreateSerializer(CachedHyperlinkedModelSerializer):
 
     class Meta:
         model = models.AttendClaim
@@ -3,13 +3,33 @@ from django.utils.translation import gettext_lazy as _
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.db.models import Sum
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Sum, Count, Q, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 
-from kennels.models import Kennel, LegacyLongevity, Membership
+from kennels.models import Kennel, LegacyLongevity, UserKennelStats
+from profiles.models import Profile
+from kennels.permissions import admin_kennels, is_kennel_admin
 
 from .. import models
 from . import serializers
-from core.api.viewsets.common import MultiClassModelViewSet
+from core import cache
+from core.api.viewsets.common import (MultiClassModelViewSet, QueryPlanMixin,
+                                      ResponseCacheMixin, ValuesListMixin,
+                                      cached_action)
+from core.search import FullTextSearchFilter
+from core.api.pagination import KeysetPagination
+
+
+def user_cache_dependencies(username: str) -> list:
+    '''
+    Cache generations for responses about one user's attendance.
+    '''
+    user = User.objects.filter(username=username).values_list('pk',
+                                                              flat=True)
+    # a user created later bumps the User generation
+    return [f'user:{pk}' for pk in user] or [cache.model_generation(User)]
 
 
 class EventPermission(permissions.BasePermission):
@@ -33,8 +53,7 @@ class EventPermission(permissions.BasePermission):
         if not request.user.is_authenticated:
             return False
         elif view.action == 'create':  # user is admin for any kennel
-            return Membership.objects.filter(user=request.user,
-                                             is_admin=True).count() > 0
+            return bool(admin_kennels(request))
         elif view.action in [
                 'list', 'retrieve', 'update', 'partial_update', 'destroy'
         ]:
@@ -48,26 +67,33 @@ class EventPermission(permissions.BasePermission):
         elif view.action == 'retrieve':
             return True
         elif view.action == 'destroy':
-            return (request.user in obj.host.get_kennel_admins()) and (
+            return (is_kennel_admin(request, obj.host_id)) and (
                 obj.attendance.filter(user__isnull=False).count() == 0)
         elif view.action in ['update', 'partial update']:
-            return request.user in obj.host.get_kennel_admins()
+            return is_kennel_admin(request, obj.host_id)
         else:
             return False
 
 
-class EventViewSet(MultiClassModelViewSet):
+class EventViewSet(QueryPlanMixin, ResponseCacheMixin, ValuesListMixin,
+                   MultiClassModelViewSet):
     '''
     API endpoint for Event model
     '''
-    queryset = models.Event.objects.all()
+    queryset = models.Event.objects.all().order_by('-date', '-id')
     serializer_class = serializers.EventSerializer
+    pagination_class = KeysetPagination
+    keyset_field = '-date'
     serializer_action_classes = {'create': serializers.EventCreateSerializer}
+    cache_models = [
+        models.Event, models.Longevity, models.Attend, Kennel, User, Profile
+    ]
+    shared_cache = True
     permission_classes = [EventPermission]
     http_method_names = [
         'get', 'head', 'put', 'patch', 'options', 'post', 'delete'
     ]
-    filter_backends = [filters.SearchFilter, DjangoFilterBackend]
+    filter_backends = [FullTextSearchFilter, DjangoFilterBackend]
     filterset_fields = [
         'name', 'date', 'host__name', 'host__acronym', 'kennels__name',
         'kennels__acronym', 'id'
@@ -87,6 +113,10 @@ class AttendPermission(permissions.BasePermission):
         (this permission resticts creation to any user that has admin rights to
         any kennel.  Kennel-level restrictions are implemented in AttendCreateSerializer)
 
+    BULK:
+    Kennel admins can record a whole event roster
+        (kennel-level restrictions are implemented in AttendBulkCreateSerializer)
+
     UPDATE:
     For unclaimed Attend (user is null): `user`, `unclaimed_name`, `is_hare` can be modified
         by Attend event host admins
@@ -100,9 +130,8 @@ class AttendPermission(permissions.BasePermission):
     def has_permission(self, request, view):
         if not request.user.is_authenticated:
             return False
-        elif view.action == 'create':
-            return Membership.objects.filter(user=request.user,
-                                             is_admin=True).count() > 0
+        elif view.action in ['create', 'bulk']:
+            return bool(admin_kennels(request))
         elif view.action in [
                 'list', 'retrieve', 'update', 'partial_update', 'destroy',
                 'count'
@@ -119,27 +148,38 @@ class AttendPermission(permissions.BasePermission):
         elif view.action == 'destroy':
             return obj.user == request.user or (
                 obj.unclaimed_name
-                and request.user in obj.event.host.get_kennel_admins())
+                and is_kennel_admin(request, obj.event.host_id))
         elif view.action in ['update', 'partial update']:
-            return request.user in obj.event.host.get_kennel_admins()
+            return is_kennel_admin(request, obj.event.host_id)
         else:
             return False
 
 
-class AttendViewSet(MultiClassModelViewSet):
+class AttendViewSet(QueryPlanMixin, ResponseCacheMixin, ValuesListMixin,
+                    MultiClassModelViewSet):
     '''
     API endpoint for Attend model
     '''
-    queryset = models.Attend.objects.all().order_by('-event__date')
+    queryset = models.Attend.objects.all().order_by('-event__date', '-id')
     serializer_class = serializers.AttendSerializer
+    pagination_class = KeysetPagination
+    keyset_field = '-event__date'
+    # run numbers shift with event dates and legacy longevity
+    cache_models = [
+        models.Attend, models.Event, models.Longevity,
+        models.LongevityRecord, models.AttendClaim, LegacyLongevity, Kennel,
+        User, Profile
+    ]
+    shared_cache = True
     serializer_action_classes = {
         'create': serializers.AttendCreateSerializer,
+        'bulk': serializers.AttendBulkCreateSerializer,
     }
     permission_classes = [AttendPermission]
     http_method_names = [
         'get', 'head', 'put', 'patch', 'options', 'post', 'delete'
     ]
-    filter_backends = [filters.SearchFilter, DjangoFilterBackend]
+    filter_backends = [FullTextSearchFilter, DjangoFilterBackend]
     filterset_fields = [
         'is_hare', 'user__username', 'user__profile__hash_name', 'event__name',
         'event__host__name', 'event__host__acronym', 'event__kennels__name',
@@ -167,22 +207,48 @@ class AttendViewSet(MultiClassModelViewSet):
             else:
                 return serializers.AttendModifyUnclaimedSerializer
 
+    def get_cache_dependencies(self):
+        # counts filtered by nothing but the user only change with the user
+        if self.action == 'count' and set(self.request.GET.keys()) <= {
+                'user__username', 'is_hare', 'format'
+        }:
+            return user_cache_dependencies(
+                self.request.GET.get('user__username'))
+        return super().get_cache_dependencies()
+
     @action(detail=False)
+    @cached_action
     def count(self, request):
         queryset = self.filter_queryset(self.get_queryset())
         count = queryset.count()
         legacy_queryset = LegacyLongevity.objects.filter(
             user__username=request.GET['user__username'])
-        legacy_count = legacy_queryset.aggregate(Sum('count'))
-        legacy_hares = legacy_queryset.aggregate(Sum('hares'))
+        legacy = legacy_queryset.aggregate(Sum('count'), Sum('hares'))
         if 'is_hare' in request.GET.keys(
-        ) and request.GET['is_hare'] and legacy_hares['hares__sum']:
-            count += legacy_hares['hares__sum']
-        elif legacy_count['count__sum']:
-            count += legacy_count['count__sum']
+        ) and request.GET['is_hare'] and legacy['hares__sum']:
+            count += legacy['hares__sum']
+        elif legacy['count__sum']:
+            count += legacy['count__sum']
         content = {'count': count}
         return Response(content, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        '''
+        Records a roster of users and unclaimed names for one event in a
+        single transaction.
+        '''
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            attendance = serializer.save()
+        queryset = self.apply_query_plan(
+            models.Attend.objects.filter(
+                pk__in=[a.pk for a in attendance]).order_by('id'))
+        data = serializers.AttendSerializer(
+            queryset, many=True, context=self.get_serializer_context()).data
+        return Response(data, status=status.HTTP_201_CREATED)
+
 
 class LongevityRecordPermission(permissions.BasePermission):
     '''
@@ -208,74 +274,96 @@ class LongevityRecordPermission(permissions.BasePermission):
         elif view.action == 'retrieve':
             return True
         elif view.action in ['update', 'partial update']:
-            return request.user in obj.longevity.kennel.get_kennel_admins()
+            return is_kennel_admin(request, obj.longevity.kennel_id)
         else:
             return False
 
 
-class LongevityRecordViewSet(viewsets.ModelViewSet):
+class LongevityRecordViewSet(QueryPlanMixin, ResponseCacheMixin,
+                             viewsets.ModelViewSet):
     '''
     API endpoint for LongevityRecord model
     '''
-    queryset = models.LongevityRecord.objects.all().order_by('longevity')
+    queryset = models.LongevityRecord.objects.all().order_by(
+        '-attend__event__date', '-id')
     serializer_class = serializers.LongevityRecordSerializer
+    pagination_class = KeysetPagination
+    keyset_field = '-attend__event__date'
+    cache_models = [
+        models.LongevityRecord, models.Longevity, models.Attend,
+        models.Event, LegacyLongevity, Kennel, User, Profile
+    ]
+    shared_cache = True
     permission_classes = [LongevityRecordPermission]
     http_method_names = ['get', 'head', 'put', 'patch', 'options']
     filter_backends = [filters.SearchFilter, DjangoFilterBackend]
     filterset_fields = [
         'attend__user', 'attend__user__username',
         'attend__user__profile__hash_name', 'longevity__kennel__name',
-        'longevity__kennel__acronym', 'id'
+        'longevity__kennel__acronym', 'run_number', 'id'
     ]
     search_fields = [
         'attend__user__username', 'attend__user__profile__hash_name',
         'longevity__kennel__name', 'longevity__kennel__acronym'
     ]
 
+    def get_cache_dependencies(self):
+        if self.action == 'count' and set(self.request.GET.keys()) <= {
+                'attend__user__username', 'format'
+        }:
+            return user_cache_dependencies(
+                self.request.GET.get('attend__user__username'))
+        return super().get_cache_dependencies()
+
     @action(detail=False)
+    @cached_action
     def count(self, request):
-        queryset = self.filter_queryset(self.get_queryset())
-        legacy_queryset = LegacyLongevity.objects.filter(
-            user__username=request.GET['attend__user__username'])
-        kennels = Kennel.objects.filter(
-            id__in=[lr.longevity.kennel.id for lr in queryset])
-        content = {'results': []}
-        for k in kennels:
-            legacy_longevity = legacy_queryset.filter(kennel=k)
-            if legacy_longevity.exists():
-                legacy_longevity = legacy_longevity.get()
-                legacy_count = legacy_longevity.count
-                legacy_hares = legacy_longevity.hares
-            else:
-                legacy_count = 0
-                legacy_hares = 0
-            content['results'].append({
-                'kennel__name':
-                k.name,
-                'run_count':
-                queryset.filter(longevity__kennel=k).count(),
-                'hare_count':
-                queryset.filter(longevity__kennel=k,
-                                attend__is_hare=True).count(),
-                'legacy_run_count':
-                legacy_count,
-                'legacy_hare_count':
-                legacy_hares
-            })
-        content['results'] = sorted(
-            content['results'],
-            key=lambda r: r['run_count'] + r['hare_count'] + r[
-                'legacy_run_count'] + r['legacy_hare_count'],
-            reverse=True)
-        content['count'] = len(content['results'])
+        '''
+        Per-kennel run/hare totals for a user.
+        Plain user lookups read the UserKennelStats table. Other filters are
+        counted in a single grouped query with legacy longevity joined per
+        kennel, over the same runs (records counted toward longevity).
+        '''
+        if set(request.GET.keys()) <= {'attend__user__username', 'format'}:
+            results = list(
+                UserKennelStats.get_totals(
+                    user__username=request.GET['attend__user__username']))
+        else:
+            queryset = self.filter_queryset(
+                self.get_queryset()).filter(is_longevity=True)
+            legacy_queryset = LegacyLongevity.objects.filter(
+                user__username=request.GET['attend__user__username'],
+                kennel=OuterRef('longevity__kennel'))
+            totals = queryset.order_by().values(
+                'longevity__kennel', 'longevity__kennel__name').annotate(
+                    run_count=Count('id', distinct=True),
+                    hare_count=Count('id',
+                                     distinct=True,
+                                     filter=Q(attend__is_hare=True)),
+                    legacy_run_count=Coalesce(
+                        Subquery(legacy_queryset.values('count')[:1]), 0),
+                    legacy_hare_count=Coalesce(
+                        Subquery(legacy_queryset.values('hares')[:1]), 0),
+                ).annotate(total=F('run_count') + F('hare_count') +
+                           F('legacy_run_count') +
+                           F('legacy_hare_count')).order_by(
+                               '-total', 'longevity__kennel')
+            results = [{
+                'kennel__name': t['longevity__kennel__name'],
+                'run_count': t['run_count'],
+                'hare_count': t['hare_count'],
+                'legacy_run_count': t['legacy_run_count'],
+                'legacy_hare_count': t['legacy_hare_count']
+            } for t in totals]
+        content = {'results': results, 'count': len(results)}
         return Response(content, status=status.HTTP_200_OK)
 
 
-class LongevityViewSet(viewsets.ReadOnlyModelViewSet):
+class LongevityViewSet(QueryPlanMixin, viewsets.ReadOnlyModelViewSet):
     '''
     API endpoint for Longevity model
     '''
-    queryset = models.Longevity.objects.all().order_by('event')
+    queryset = models.Longevity.objects.all().order_by('event', 'id')
     serializer_class = serializers.LongevitySerializer
     permission_classes = [permissions.IsAuthenticated]
     http_method_names = ['get', 'head', 'options']
@@ -319,7 +407,7 @@ class AttendClaimPermission(permissions.BasePermission):
             return False
 
 
-class AttendClaimViewSet(MultiClassModelViewSet):
+class AttendClaimViewSet(QueryPlanMixin, MultiClassModelViewSet):
     '''
     API endpoint for AttendClaim
     '''
@@ -0,0 +1,53 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:10
+
+from django.db import migrations, models
+
+
+def number_runs(apps, schema_editor):
+    from django.db.models import F, OuterRef, Subquery, Window
+    from django.db.models.functions import Coalesce, RowNumber
+    LongevityRecord = apps.get_model('events', 'LongevityRecord')
+    LegacyLongevity = apps.get_model('kennels', 'LegacyLongevity')
+    legacy = LegacyLongevity.objects.filter(
+        user=OuterRef('attend__user'),
+        kennel=OuterRef('longevity__kennel')).values('count')
+    ranked = LongevityRecord.objects.filter(
+        attend__user__isnull=False, is_longevity=True).annotate(
+            ranked_id=F('pk'),
+            ranked_number=Coalesce(Subquery(legacy), 0) + Window(
+                RowNumber(),
+                partition_by=[F('attend__user'),
+                              F('longevity__kennel')],
+                order_by=[
+                    F('attend__event__date').asc(),
+                    F('attend__event').asc(),
+                    F('pk').asc()
+                ])).values('ranked_id', 'ranked_number')
+    sql, params = ranked.query.sql_with_params()
+    table = LongevityRecord._meta.db_table
+    schema_editor.execute(
+        f'UPDATE {table} SET run_number = (SELECT ranked.ranked_number '
+        f'FROM ({sql}) AS ranked WHERE ranked.ranked_id = {table}.id) '
+        f'WHERE {table}.id IN (SELECT ranked.ranked_id FROM ({sql}) AS ranked)',
+        (*params, *params))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0012_event_date_id_idx'),
+        ('kennels', '0017_consensus_tallies'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='longevityrecord',
+            name='run_number',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='longevityrecord',
+            index=models.Index(fields=['run_number'], name='longevity_record_run_idx'),
+        ),
+        migrations.RunPython(number_runs, migrations.RunPython.noop),
+    ]
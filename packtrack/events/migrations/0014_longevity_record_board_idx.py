@@ -0,0 +1,17 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0013_longevityrecord_run_number'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='longevityrecord',
+            index=models.Index(fields=['longevity', 'is_longevity', 'attend'], name='longevity_record_board_idx'),
+        ),
+    ]
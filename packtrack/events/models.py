@@ -1,10 +1,12 @@
-from django.db import IntegrityError, models
+from django.db import IntegrityError, connection, models, transaction
 from django.db.models import Q, F
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
 from django.contrib.auth.models import User
 
+from core.cache import expire
+
 
 # a hash event
 class Event(models.Model):
@@ -20,6 +22,10 @@ class Event(models.Model):
             models.UniqueConstraint(fields=['name', 'host'],
                                     name='unique_kennel_event')
         ]
+        indexes = [
+            # keyset pagination order
+            models.Index(fields=['date', 'id'], name='event_date_id_idx')
+        ]
 
     def __str__(self) -> str:
         return f"{self.name} - {self.host}"
@@ -94,12 +100,25 @@ class LongevityRecord(models.Model):
                                related_name='longevity_records')
     longevity = models.ForeignKey(Longevity, on_delete=models.CASCADE)
     is_longevity = models.BooleanField(default=True)
+    # the user's nth run with the kennel, counting legacy longevity (null for
+    # unclaimed attendance and records not counted toward longevity).
+    # Kept current by UserKennelStats.number_runs
+    run_number = models.PositiveIntegerField(null=True)
 
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['attend', 'longevity'],
                                     name='unique_longevity_record')
         ]
+        indexes = [
+            # milestone lookups
+            models.Index(fields=['run_number'],
+                         name='longevity_record_run_idx'),
+            # kennel leaderboards: a kennel's records grouped by attendance
+            # without reading the table
+            models.Index(fields=['longevity', 'is_longevity', 'attend'],
+                         name='longevity_record_board_idx')
+        ]
 
     def __str__(self) -> str:
         return f"{self.attend} - {self.longevity.kennel}"
@@ -112,22 +131,86 @@ def create_initial_longevity(sender, instance, created, **kwargs):
         Longevity.objects.create(event=instance, kennel=instance.host)
 
 
+def create_longevity_records(attends) -> list:
+    '''
+    Creates the longevity records for new attendance (one per kennel each
+    event counts toward) and adds them to the kennel stats.
+    '''
+    from kennels.models import UserKennelStats
+    longevities = {}
+    for l in Longevity.objects.filter(
+            event__in={a.event_id
+                       for a in attends}):
+        longevities.setdefault(l.event_id, []).append(l)
+    records = LongevityRecord.objects.bulk_create([
+        LongevityRecord(attend=a, longevity=l) for a in attends
+        for l in longevities.get(a.event_id, [])
+    ])
+    UserKennelStats.add_runs(records)
+    expire(kennels=[r.longevity.kennel_id for r in records],
+           users=[a.user_id for a in attends],
+           models=[Attend, LongevityRecord])
+    return records
+
+
 # Create Logevity records for each Attend-Longevity pair
 @receiver(post_save, sender=Attend)
 def create_longevity_record_attend(sender, instance, created, **kwargs):
     if created:
-        longevities = Longevity.objects.filter(event=instance.event)
-        LongevityRecord.objects.bulk_create([
-            LongevityRecord(attend=instance, longevity=l) for l in longevities
-        ])
+        create_longevity_records([instance])
+
+
+def add_longevity_records(longevity) -> None:
+    '''
+    Creates the records of a new longevity (one per attendance of its event)
+    with a single INSERT ... SELECT and adds them to the kennel stats, so
+    the cost doesn't grow with the event's attendance.
+    '''
+    from kennels.models import UserKennelStats
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {LongevityRecord._meta.db_table} '
+                '(attend_id, longevity_id, is_longevity) '
+                f'SELECT id, %s, %s FROM {Attend._meta.db_table} '
+                'WHERE event_id = %s',
+                [longevity.pk, True, longevity.event_id])
+            created = cursor.rowcount
+        if created:
+            UserKennelStats.add_event_runs(longevity.event_id,
+                                           longevity.kennel_id)
+    # also expires new events, whose host longevity is created with them
+    expire(kennels=[longevity.kennel_id],
+           users=Attend.objects.filter(event=longevity.event_id).values_list(
+               'user', flat=True),
+           models=[Event, Longevity, LongevityRecord])
+
+
+def remove_longevity(longevity) -> None:
+    '''
+    Deletes a longevity and its records. The records go in a single DELETE
+    and are uncounted from the kennel stats per event, instead of being
+    collected and signalled one by one.
+    '''
+    from kennels.models import UserKennelStats
+    with transaction.atomic():
+        runs = list(
+            UserKennelStats.counted_runs().filter(
+                longevity=longevity).values_list('attend__user',
+                                                 'attend__is_hare'))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {LongevityRecord._meta.db_table} '
+                'WHERE longevity_id = %s', [longevity.pk])
+        UserKennelStats.remove_event_runs(longevity.event_id,
+                                          longevity.kennel_id, runs)
+        longevity.delete()
 
 
 @receiver(post_save, sender=Longevity)
 def create_longevity_record_longevity(sender, instance, created, **kwargs):
     if created:
-        attends = Attend.objects.filter(event=instance.event)
-        LongevityRecord.objects.bulk_create(
-            [LongevityRecord(attend=a, longevity=instance) for a in attends])
+        add_longevity_records(instance)
 
 
 @receiver(post_save, sender=AttendClaim)
@@ -140,4 +223,66 @@ def prevent_claim_of_claimed(sender, instance, created, **kwargs):
 @receiver(post_save, sender=Attend)
 def delete_claims(sender, instance, created, **kwargs):
     if instance.user:
-        AttendClaim.objects.filter(attend=instance).delete()
\ No newline at end of file
+        AttendClaim.objects.filter(attend=instance).delete()
+
+
+# Cached API responses
+
+
+def expire_event(event_id, users=(), models=()) -> None:
+    '''
+    Expires cached responses depending on the kennels an event counts toward,
+    on `users` or on `models`.
+    '''
+    expire(kennels=list(
+        Longevity.objects.filter(event=event_id).values_list('kennel',
+                                                             flat=True)),
+           users=users,
+           models=models)
+
+
+@receiver(post_save, sender=Attend)
+def expire_attend_responses(sender, instance, created, **kwargs) -> None:
+    # new attendance is expired with its longevity records
+    if not created:
+        old = getattr(instance, '_stats_fields', None) or {}
+        expire_event(instance.event_id, [instance.user_id,
+                                         old.get('user')], [Attend])
+
+
+@receiver(post_delete, sender=Attend)
+def expire_deleted_attend_responses(sender, instance, **kwargs) -> None:
+    expire_event(instance.event_id, [instance.user_id], [Attend])
+
+
+@receiver(post_save, sender=AttendClaim)
+@receiver(post_delete, sender=AttendClaim)
+def expire_claim_responses(sender, instance, **kwargs) -> None:
+    expire(users=[instance.claimant_id], models=[AttendClaim])
+
+
+@receiver(post_save, sender=Event)
+def expire_event_responses(sender, instance, created, **kwargs) -> None:
+    # new events are expired with their host longevity
+    if not created:
+        expire_event(instance.pk, models=[Event])
+
+
+@receiver(post_delete, sender=Event)
+def expire_deleted_event_responses(sender, instance, **kwargs) -> None:
+    expire(kennels=[instance.host_id], models=[Event])
+
+
+@receiver(post_delete, sender=Longevity)
+def expire_longevity_responses(sender, instance, **kwargs) -> None:
+    expire(kennels=[instance.kennel_id],
+           users=Attend.objects.filter(event=instance.event_id).values_list(
+               'user', flat=True),
+           models=[Longevity, LongevityRecord])
+
+
+@receiver(post_save, sender=LongevityRecord)
+def expire_longevity_record_responses(sender, instance, **kwargs) -> None:
+    expire(kennels=[instance.longevity.kennel_id],
+           users=[instance.attend.user_id],
+           models=[LongevityRecord])
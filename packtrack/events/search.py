@@ -0,0 +1,42 @@
+from django.contrib.auth.models import User
+
+from core.search import SearchIndex, register
+from kennels.models import Kennel
+from profiles.models import Profile
+
+from . import models
+
+event_index = register(
+    SearchIndex(models.Event,
+                'search_event',
+                columns={
+                    'name': ['name'],
+                    'date': ['date'],
+                    'host': ['host__name', 'host__acronym'],
+                    'kennels': ['kennels__name', 'kennels__acronym'],
+                },
+                dependencies=[
+                    (Kennel, 'host'),
+                    (Kennel, 'kennels'),
+                    (models.Longevity, 'longevity'),
+                ]))
+
+attend_index = register(
+    SearchIndex(models.Attend,
+                'search_attend',
+                columns={
+                    'user': ['user__username', 'user__profile__hash_name'],
+                    'event': ['event__name', 'event__date'],
+                    'kennels': [
+                        'event__host__name', 'event__host__acronym',
+                        'event__kennels__name', 'event__kennels__acronym'
+                    ],
+                },
+                dependencies=[
+                    (User, 'user'),
+                    (Profile, 'user__profile'),
+                    (models.Event, 'event'),
+                    (Kennel, 'event__host'),
+                    (Kennel, 'event__kennels'),
+                    (models.Longevity, 'event__longevity'),
+                ]))
@@ -1,3 +1,451 @@
-from django.test import TestCase
+import datetime
+from base64 import b64encode
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from core.api.serializers.values import UnsupportedField
+from core.settings import NESTED_LIST_LIMIT
+from kennels.models import (Kennel, LegacyLongevity, Membership,
+                            UserKennelStats)
+from .models import Attend, Event, Longevity, LongevityRecord
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+    }
+}
+
+
+def create_events(kennel, users, count, start=datetime.date(2020, 1, 1)):
+    '''
+    Creates `count` events hosted by `kennel`, two a day, each attended by
+    every user and one unclaimed hasher.
+    '''
+    events = []
+    for i in range(count):
+        event = Event.objects.create(name=f'{kennel.acronym} {i}',
+                                     date=start +
+                                     datetime.timedelta(days=i // 2),
+                                     host=kennel)
+        for user in users:
+            Attend.objects.create(event=event, user=user)
+        Attend.objects.create(event=event, unclaimed_name=f'anon {i}')
+        events.append(event)
+    return events
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class KeysetPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.kennel = Kennel.objects.create(name='kennel1',
+                                           acronym='K1',
+                                           city='anchorage ak')
+        cls.users = [
+            User.objects.create(username=f'user{i}') for i in range(3)
+        ]
+        create_events(cls.kennel, cls.users, 7)
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def walk(self, url, link='next'):
+        '''
+        Follows `link` from `url`, returning every page's result urls.
+        '''
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            pages.append([row['url'] for row in response.data['results']])
+            url = response.data[link]
+        return pages
+
+    def get_urls(self, name, queryset):
+        return [f'http://testserver/api/{name}/{pk}/' for pk in queryset]
+
+    def test_pages_cover_every_row_once(self):
+        expected = self.get_urls(
+            'attendance',
+            Attend.objects.order_by('-event__date',
+                                    '-id').values_list('id', flat=True))
+        pages = self.walk('/api/attendance/?cursor=')
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_previous_links_walk_back(self):
+        forward = self.walk('/api/attendance/?cursor=')
+        last = self.client.get('/api/attendance/?cursor=').data['next']
+        back = self.walk(last, link='previous')
+        self.assertEqual(back[1], forward[0])
+
+    def test_longevity_record_pages_keep_list_order(self):
+        listed = []
+        url = '/api/longevityrecords/'
+        while url:
+            response = self.client.get(url)
+            listed += [row['url'] for row in response.data['results']]
+            url = response.data['next']
+        expected = self.get_urls(
+            'longevityrecords',
+            LongevityRecord.objects.order_by(
+                '-attend__event__date', '-id').values_list('id', flat=True))
+        self.assertEqual(listed, expected)
+        self.assertEqual(
+            sum(self.walk('/api/longevityrecords/?cursor='), []), expected)
+
+    def test_event_pages_keep_list_order(self):
+        listed = []
+        url = '/api/events/'
+        while url:
+            response = self.client.get(url)
+            listed += [row['url'] for row in response.data['results']]
+            url = response.data['next']
+        expected = self.get_urls(
+            'events',
+            Event.objects.order_by('-date', '-id').values_list('id',
+                                                                flat=True))
+        self.assertEqual(listed, expected)
+        self.assertEqual(sum(self.walk('/api/events/?cursor='), []), expected)
+
+    def test_forged_cursors_are_not_found(self):
+        for querystring in [
+                'p=not-a-date&i=1&r=0', 'p=2020-02-30&i=1&r=0',
+                'p=&i=1&r=0', 'p=2020-01-01&i=99999999999999999999&r=0',
+                'p=2020-01-01&r=0'
+        ]:
+            cursor = b64encode(querystring.encode()).decode()
+            for name in ['attendance', 'longevityrecords', 'events']:
+                response = self.client.get(f'/api/{name}/?cursor={cursor}')
+                self.assertEqual(response.status_code, 404, querystring)
+        response = self.client.get('/api/events/?cursor=%%%')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LongevityRecordCountTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.kennels = [
+            Kennel.objects.create(name=f'kennel{i}',
+                                  acronym=f'K{i}',
+                                  city='anchorage ak') for i in range(2)
+        ]
+        cls.users = [
+            User.objects.create(username=f'user{i}') for i in range(3)
+        ]
+        for i, event in enumerate(create_events(cls.kennels[0], cls.users,
+                                                6)):
+            if i % 2:
+                Longevity.objects.create(event=event, kennel=cls.kennels[1])
+        for attend in Attend.objects.filter(
+                user=cls.users[1], event__name__in=['K0 0', 'K0 1', 'K0 4']):
+            attend.is_hare = True
+            attend.save()
+        record = LongevityRecord.objects.filter(
+            attend__user=cls.users[1]).first()
+        record.is_longevity = False
+        record.save()
+        LegacyLongevity.objects.create(user=cls.users[1],
+                                       kennel=cls.kennels[0],
+                                       count=10,
+                                       hares=2)
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def get_expected(self, user, kennels):
+        expected = []
+        for kennel in kennels:
+            runs = LongevityRecord.objects.filter(attend__user=user,
+                                                  longevity__kennel=kennel,
+                                                  is_longevity=True)
+            legacy = LegacyLongevity.objects.filter(user=user,
+                                                    kennel=kennel).first()
+            expected.append({
+                'kennel__name': kennel.name,
+                'run_count': runs.count(),
+                'hare_count': runs.filter(attend__is_hare=True).count(),
+                'legacy_run_count': legacy.count if legacy else 0,
+                'legacy_hare_count': legacy.hares if legacy else 0
+            })
+        return sorted(expected, key=lambda row: -sum(list(row.values())[1:]))
+
+    def test_filtered_count_is_one_grouped_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/longevityrecords/count/', {
+                'attend__user__username': 'user1',
+                'longevity__kennel__acronym': 'K1'
+            })
+        self.assertEqual(response.data['results'],
+                         self.get_expected(self.users[1], self.kennels[1:]))
+        self.assertEqual(response.data['count'], 1)
+
+    def test_grouped_and_stats_totals_agree(self):
+        for user in self.users:
+            plain = self.client.get('/api/longevityrecords/count/',
+                                    {'attend__user__username': user.username})
+            grouped = self.client.get('/api/longevityrecords/count/', {
+                'attend__user__username': user.username,
+                'longevity__kennel__acronym': ''
+            })
+            expected = self.get_expected(user, self.kennels)
+            self.assertEqual(grouped.data['results'], expected)
+            self.assertEqual(plain.data['results'], expected)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BulkRosterTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.kennels = [
+            Kennel.objects.create(name=f'kennel{i}',
+                                  acronym=f'K{i}',
+                                  city='anchorage ak') for i in range(2)
+        ]
+        cls.users = [
+            User.objects.create(username=f'user{i}') for i in range(12)
+        ]
+        cls.admin = cls.users[0]
+        Membership.objects.create(user=cls.admin,
+                                  kennel=cls.kennels[0],
+                                  is_admin=True)
+        Membership.objects.create(user=cls.users[1],
+                                  kennel=cls.kennels[1],
+                                  is_admin=True)
+        cls.events = []
+        for i in range(2):
+            event = Event.objects.create(name=f'run {i}',
+                                         date=datetime.date(2020, 1, 1 + i),
+                                         host=cls.kennels[0])
+            Longevity.objects.create(event=event, kennel=cls.kennels[1])
+            cls.events.append(event)
+        Attend.objects.create(event=cls.events[0],
+                              user=cls.users[11],
+                              is_hare=True)
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def get_roster(self, users, names=()):
+        return [{
+            'user': f'http://testserver/api/users/{user.pk}/',
+            'is_hare': i == 0
+        } for i, user in enumerate(users)] + [{
+            'unclaimed_name': name
+        } for name in names]
+
+    def post(self, event, roster):
+        return self.client.post('/api/attendance/bulk/', {
+            'event': f'http://testserver/api/events/{event.pk}/',
+            'roster': roster
+        },
+                                format='json')
+
+    def get_state(self):
+        return (set(
+            Attend.objects.values_list('event', 'user', 'unclaimed_name',
+                                       'is_hare')),
+                set(
+                    LongevityRecord.objects.values_list(
+                        'attend__event', 'attend__user',
+                        'attend__unclaimed_name', 'longevity__kennel')),
+                set(
+                    UserKennelStats.objects.values_list(
+                        'user', 'kennel', 'runs', 'hares', 'first_run',
+                        'last_run')))
+
+    def test_roster_matches_single_creates(self):
+        response = self.post(self.events[0],
+                             self.get_roster(self.users[:10], ['anon']))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data), 11)
+        self.assertEqual(response.data[0]['is_hare'], True)
+        self.assertEqual(LongevityRecord.objects.filter(
+            attend__event=self.events[0]).count(), 24)
+        bulk = self.get_state()
+        UserKennelStats.rebuild()
+        self.assertEqual(self.get_state(), bulk)
+
+        Attend.objects.filter(event=self.events[0]).exclude(
+            user=self.users[11]).delete()
+        for i, user in enumerate(self.users[:10]):
+            Attend.objects.create(event=self.events[0],
+                                  user=user,
+                                  is_hare=i == 0)
+        Attend.objects.create(event=self.events[0], unclaimed_name='anon')
+        self.assertEqual(self.get_state(), bulk)
+
+    def test_queries_do_not_grow_with_the_roster(self):
+        queries = []
+        for event, users in zip(self.events, [self.users[:2], self.users[:10]]):
+            with CaptureQueriesContext(connection) as context:
+                response = self.post(event, self.get_roster(users, ['anon']))
+            self.assertEqual(response.status_code, 201)
+            queries.append(len(context.captured_queries))
+        self.assertEqual(queries[0], queries[1])
+
+    def test_new_rows_are_searchable(self):
+        user = self.users[5]
+        self.post(self.events[1], self.get_roster([user]))
+        response = self.client.get('/api/attendance/', {'search': 'user5'})
+        self.assertEqual(
+            [row['user']['url'] for row in response.data['results']],
+            [f'http://testserver/api/users/{user.pk}/'])
+
+    def test_invalid_rosters_record_nothing(self):
+        before = self.get_state()
+        for roster in [
+                self.get_roster(self.users[:2] + self.users[:1]),
+                self.get_roster([], ['anon', 'anon']),
+                self.get_roster(self.users[10:]),
+                [{'user': 'http://testserver/api/users/999/'}],
+                [{'user': 'http://testserver/api/users/abc/'}],
+                [{'is_hare': True}],
+                [{'user': f'http://testserver/api/users/{self.admin.pk}/',
+                  'unclaimed_name': 'anon'}],
+                [],
+        ]:
+            response = self.post(self.events[0], roster)
+            self.assertEqual(response.status_code, 400, roster)
+        self.assertEqual(self.get_state(), before)
+
+    def test_only_host_admins_record_rosters(self):
+        before = self.get_state()
+        for user in self.users[1:3]:
+            self.client.force_authenticate(user)
+            response = self.post(self.events[0],
+                                 self.get_roster(self.users[3:5]))
+            self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.get_state(), before)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class NestedAttendanceTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.kennel = Kennel.objects.create(name='kennel1',
+                                           acronym='K1',
+                                           city='anchorage ak')
+        cls.users = [
+            User.objects.create(username=f'user{i}') for i in range(5)
+        ]
+        cls.big = Event.objects.create(name='big run',
+                                       date=datetime.date(2020, 1, 2),
+                                       host=cls.kennel)
+        for i in range(NESTED_LIST_LIMIT * 2 + 5):
+            Attend.objects.create(event=cls.big, unclaimed_name=f'anon {i}')
+        for user in reversed(cls.users):
+            Attend.objects.create(event=cls.big, user=user)
+        cls.small = Event.objects.create(name='small run',
+                                         date=datetime.date(2020, 1, 1),
+                                         host=cls.kennel)
+        Attend.objects.create(event=cls.small, user=cls.users[0])
+        cls.empty = Event.objects.create(name='empty run',
+                                         date=datetime.date(2019, 1, 1),
+                                         host=cls.kennel)
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def get_url(self, event):
+        return f'http://testserver/api/events/{event.pk}/'
+
+    def get_expected(self, event):
+        return [
+            f'http://testserver/api/attendance/{pk}/'
+            for pk in event.attendance.order_by('user', 'id').values_list(
+                'id', flat=True)
+        ]
+
+    def get_events(self, params):
+        response = self.client.get('/api/events/', params)
+        self.assertEqual(response.status_code, 200)
+        return {row['url']: row['attendance'] for row in response.data['results']}
+
+    def test_attendance_is_only_counted_unless_expanded(self):
+        events = self.get_events({})
+        for event in [self.big, self.small]:
+            self.assertEqual(events[self.get_url(event)], {
+                'count': event.attendance.count(),
+                'next': f'{self.get_url(event)}?expand=attendance'
+            })
+        self.assertEqual(events[self.get_url(self.empty)], {
+            'count': 0,
+            'next': None
+        })
+
+    def test_expanded_attendance_is_capped(self):
+        for expand in ['attendance', 'kennels,attendance']:
+            events = self.get_events({'expand': expand})
+            big = events[self.get_url(self.big)]
+            self.assertEqual(big['count'], NESTED_LIST_LIMIT * 2 + 10)
+            self.assertEqual([row['url'] for row in big['results']],
+                             self.get_expected(self.big)[:NESTED_LIST_LIMIT])
+            self.assertEqual(
+                big['next'], f'{self.get_url(self.big)}'
+                '?expand=attendance&attendance_page=2')
+            small = events[self.get_url(self.small)]
+            self.assertEqual(len(small['results']), 1)
+            self.assertIsNone(small['next'])
+
+    def test_next_links_page_through_attendance(self):
+        listed = []
+        url = f'{self.get_url(self.big)}?expand=attendance'
+        while url:
+            attendance = self.client.get(url).data['attendance']
+            listed += [row['url'] for row in attendance['results']]
+            url = attendance['next']
+        self.assertEqual(listed, self.get_expected(self.big))
+        response = self.client.get(self.get_url(self.big), {
+            'expand': 'attendance',
+            'attendance_page': 9
+        })
+        self.assertEqual(response.data['attendance']['results'], [])
+        for page in ['0', 'x']:
+            response = self.client.get(self.get_url(self.big), {
+                'expand': 'attendance',
+                'attendance_page': page
+            })
+            self.assertEqual(response.status_code, 404)
+
+    def test_queries_do_not_grow_with_attendance(self):
+        queries = []
+        for event in [self.small, self.big]:
+            cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                self.client.get('/api/events/', {
+                    'name': event.name,
+                    'expand': 'attendance'
+                })
+            queries.append(len(context.captured_queries))
+        self.assertEqual(queries[0], queries[1])
+
+    def test_values_path_renders_the_same_pages(self):
+        for params in [{}, {'expand': 'attendance'}]:
+            cache.clear()
+            content = self.client.get('/api/events/', params).content
+            cache.clear()
+            with mock.patch('core.api.viewsets.common.ValuesSerializer',
+                            side_effect=UnsupportedField):
+                expected = self.client.get('/api/events/', params).content
+            self.assertEqual(content, expected, params)
@@ -1,40 +1,38 @@
-from json import JSONDecoder
 from rest_framework import serializers, exceptions
 from django.utils.translation import gettext_lazy as _
 
-import requests
 import re
 
-from .. import models, settings
-from core.api.serializers.common import NestedDynamicFieldsModelSerializer
+from .. import gazetteer, models, settings
+from ..permissions import is_kennel_admin
+from core.api.serializers.common import (BatchedListField,
+                                         CachedHyperlinkedModelSerializer,
+                                         NestedDynamicFieldsModelSerializer)
 
 
 class KennelSerializer(NestedDynamicFieldsModelSerializer,
-                       serializers.HyperlinkedModelSerializer):
+                       CachedHyperlinkedModelSerializer):
     '''
     Serializer for creating and modifying Kennels.
 
-    Kennel city field uses GeoNames database for verification:
-    https://data.opendatasoft.com/explore/dataset/geonames-all-cities-with-a-population-500%40public/
+    Kennel city field is verified against a local index of the GeoNames
+    cities500 dump (see `manage.py load_gazetteer`):
+    https://download.geonames.org/export/dump/
     '''
 
-    membership = serializers.SerializerMethodField()
+    membership = BatchedListField(
+        'kennels.api.serializers.MembershipSerializer',
+        fields=[
+            'url', 'is_approved', 'is_admin', 'user__url', 'user__username',
+            'user__profile__hash_name'
+        ],
+        parent_lookup='kennel')
 
     class Meta:
         model = models.Kennel
         fields = ['url', 'name', 'acronym', 'city', 'membership', 'is_active']
         read_only_fields = ['membership']
 
-    def get_membership(self, instance):
-        return MembershipSerializer(instance.memberships,
-                                    many=True,
-                                    context=self.context,
-                                    fields=[
-                                        'url', 'is_approved', 'is_admin',
-                                        'user__url', 'user__username',
-                                        'user__profile__hash_name'
-                                    ]).data
-
     def parse_city(record: dict) -> str:
         '''
         Returns a readable string from a GeoNames database record
@@ -51,23 +49,22 @@ class KennelSerializer(NestedDynamicFieldsModelSerializer,
 
     def get_cities(value: str) -> dict:
         '''
-        Make a GET request to GeoNames database 
+        Searches the local GeoNames index. Records are shaped like the
+        opendatasoft API's so parse_city and the city picker can read them.
         '''
-
-        # Parse input string by spaces, commas, semicolons
-        strs = re.split('[\s,;]+', value)
-
-        url = 'https://data.opendatasoft.com/api/v2/catalog/datasets/geonames-all-cities-with-a-population-500@public/records?select=name,country,admin1_code&where='
-
-        # Build request url
-        for str in strs:
-            url += f'(name like "*{str}*" OR country like "*{str}*" OR admin1_code like "*{str}*")'
-            if str is not strs[-1]:  # not last search term
-                url += " AND "
-        url = url + '&limit = 10'
-
-        response = requests.get(url)
-        return JSONDecoder().decode(response.content.decode("utf-8"))
+        return {
+            'records': [{
+                'record': {
+                    'id': geonameid,
+                    'fields': {
+                        'name': name,
+                        'admin1_code': admin1,
+                        'country': country
+                    }
+                }
+            } for geonameid, name, admin1, country in
+                        gazetteer.get_gazetteer().search(value)]
+        }
 
     def validate_city(self, value: str) -> str:
         '''
@@ -76,26 +73,29 @@ class KennelSerializer(NestedDynamicFieldsModelSerializer,
         if not value:
             raise serializers.ValidationError(_('City cannot be empty'))
 
-        response = KennelSerializer.get_cities(value)
         try:
-            records = response['records']
-        except KeyError:  # Problem communicating with database
+            records = KennelSerializer.get_cities(value)['records']
+        except gazetteer.GazetteerUnavailable:
             raise serializers.ValidationError(
                 _('Kennel creation is currently down for maintenance'))
+        cities = [KennelSerializer.parse_city(record) for record in records]
 
         # search returned 1 result
-        if len(records) == 1:
-            return KennelSerializer.parse_city(records[0])
+        if len(cities) == 1:
+            return cities[0]
         # search didn't return any results
-        elif len(records) == 0:
+        elif len(cities) == 0:
             raise serializers.ValidationError(_("Could not find city"))
+        # input is exactly one of the results (as picked from the dropdown)
+        exact = [
+            city for city in cities
+            if gazetteer.normalize(city) == gazetteer.normalize(value)
+        ]
+        if len(exact) == 1:
+            return exact[0]
         # search returned multiple results
-        else:
-            cities = []
-            for record in records:
-                cities.append(KennelSerializer.parse_city(record))
-            raise serializers.ValidationError(
-                [_("Multiple matching cities found"), cities])
+        raise serializers.ValidationError(
+            [_("Multiple matching cities found"), cities])
 
     def create(self, validated_data):
         '''
@@ -110,7 +110,7 @@ class KennelSerializer(NestedDynamicFieldsModelSerializer,
 
 
 class MembershipSerializer(NestedDynamicFieldsModelSerializer,
-                           serializers.HyperlinkedModelSerializer):
+                           CachedHyperlinkedModelSerializer):
 
     kennel = KennelSerializer(fields=['url', 'name', 'acronym'])
     from core.api.serializers.serializers import UserSerializer
@@ -124,7 +124,7 @@ class MembershipSerializer(NestedDynamicFieldsModelSerializer,
 
 
 class MembershipCreateSerializer(NestedDynamicFieldsModelSerializer,
-                                 serializers.HyperlinkedModelSerializer):
+                                 CachedHyperlinkedModelSerializer):
 
     class Meta:
         model = models.Membership
@@ -132,7 +132,7 @@ class MembershipCreateSerializer(NestedDynamicFieldsModelSerializer,
         read_only_fields = ['url', 'user', 'is_approved', 'is_admin']
 
 
-class MembershipUpdateSerializer(serializers.HyperlinkedModelSerializer):
+class MembershipUpdateSerializer(CachedHyperlinkedModelSerializer):
 
     class Meta:
         model = models.Membership
@@ -141,7 +141,7 @@ class MembershipUpdateSerializer(serializers.HyperlinkedModelSerializer):
 
 
 class ConsensusSerializer(NestedDynamicFieldsModelSerializer,
-                          serializers.HyperlinkedModelSerializer):
+                          CachedHyperlinkedModelSerializer):
 
     kennel = KennelSerializer(fields=['url', 'name', 'acronym'],
                               read_only=True)
@@ -170,7 +170,7 @@ class ConsensusSerializer(NestedDynamicFieldsModelSerializer,
 
 
 class ConsensusCreateSerializer(NestedDynamicFieldsModelSerializer,
-                                serializers.HyperlinkedModelSerializer):
+                                CachedHyperlinkedModelSerializer):
 
     type = serializers.ChoiceField([
         (key, value) for key, value in settings.CONSENSUS_TYPES.items()
@@ -185,8 +185,8 @@ class ConsensusCreateSerializer(NestedDynamicFieldsModelSerializer,
         '''
         Extends super method to create a consensus item
         '''
-        if not self.context['request'].user in validated_data[
-                'kennel'].get_kennel_admins():
+        if not is_kennel_admin(self.context['request'],
+                               validated_data['kennel']):
             raise PermissionError
         elif self.validated_data['membership'] and self.validated_data[
                 'membership'].kennel != self.validated_data['kennel']:
@@ -195,7 +195,7 @@ class ConsensusCreateSerializer(NestedDynamicFieldsModelSerializer,
         return consensus
 
 
-class ConsensusVoteSerializer(serializers.HyperlinkedModelSerializer):
+class ConsensusVoteSerializer(CachedHyperlinkedModelSerializer):
 
     consensus = ConsensusSerializer(fields=[
         'url', 'type', 'kennel_url', 'kennel__name', 'initiator__url',
@@ -213,7 +213,7 @@ class ConsensusVoteSerializer(serializers.HyperlinkedModelSerializer):
         read_only_fields = ['url', 'consensus', 'voter']
 
 
-class LegacyLongevitySerializer(serializers.HyperlinkedModelSerializer):
+class LegacyLongevitySerializer(CachedHyperlinkedModelSerializer):
 
     from core.api.serializers.serializers import UserSerializer
     user = UserSerializer(fields=['username', 'profile__hash_name'],
@@ -226,8 +226,52 @@ class LegacyLongevitySerializer(serializers.HyperlinkedModelSerializer):
         read_only_fields = ['url', 'user', 'kennel']
 
 
-class LegacyLongevityCreateSerializer(serializers.HyperlinkedModelSerializer):
+class LegacyLongevityCreateSerializer(CachedHyperlinkedModelSerializer):
 
     class Meta:
         model = models.LegacyLongevity
         fields = ['url', 'user', 'kennel', 'count', 'hares']
+
+
+class MilestoneSerializer(NestedDynamicFieldsModelSerializer,
+                          CachedHyperlinkedModelSerializer):
+
+    from core.api.serializers.serializers import UserSerializer
+    user = UserSerializer(fields=['url', 'username', 'profile__hash_name'],
+                          read_only=True)
+    kennel = KennelSerializer(fields=['url', 'name', 'acronym'],
+                              read_only=True)
+    event = serializers.SerializerMethodField()
+
+    class Meta:
+        model = models.Milestone
+        fields = [
+            'url', 'user', 'kennel', 'event', 'kind', 'count', 'created_at',
+            'is_announced'
+        ]
+        read_only_fields = [
+            'url', 'user', 'kennel', 'event', 'kind', 'count', 'created_at'
+        ]
+
+    def get_event(self, instance):
+        from events.api.serializers import EventSerializer
+        return EventSerializer(instance=instance.event,
+                               context=self.context,
+                               fields=['url', 'name', 'date']).data
+
+
+class LeaderboardQuerySerializer(serializers.Serializer):
+    '''
+    Query parameters of the kennel leaderboard.
+    '''
+    since = serializers.DateField(required=False)
+    until = serializers.DateField(required=False)
+    metric = serializers.ChoiceField(['runs', 'hares'], default='runs')
+
+
+class RankQuerySerializer(serializers.Serializer):
+    '''
+    Query parameters of a hasher's kennel rank.
+    '''
+    user__username = serializers.CharField()
+    metric = serializers.ChoiceField(['runs', 'hares'], default='runs')
@@ -16,3 +16,6 @@ router.register(r'votes',
 router.register(r'legacy_longevity',
                 viewsets.LegacyLongevityViewSet,
                 basename='legacylongevity')
+router.register(r'milestones',
+                viewsets.MilestoneViewSet,
+                basename='milestone')
@@ -1,12 +1,23 @@
-from rest_framework import viewsets, permissions, filters
+from rest_framework import viewsets, permissions, filters, status
+from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.utils.translation import gettext_lazy as _
+from django.contrib.auth.models import User
 from django.http import Http404
+from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 
-from core.api.viewsets.common import MultiClassModelViewSet
+from core.api.pagination import KeysetPagination
+from core.api.serializers.serializers import UserSerializer
+from core.api.viewsets.common import (MultiClassModelViewSet, QueryPlanMixin,
+                                      ResponseCacheMixin, ValuesListMixin,
+                                      cached_action)
+from core.search import FullTextSearchFilter
+from profiles.models import Profile
 
 from .. import models
+from ..gazetteer import GazetteerUnavailable
+from ..permissions import admin_kennels, is_kennel_admin
 from . import serializers
 
 http_method_names = [
@@ -29,7 +40,8 @@ class KennelPermission(permissions.BasePermission):
         if not request.user.is_authenticated:
             return False
         elif view.action in [
-                'create', 'list', 'retrieve', 'update', 'partial_update'
+                'create', 'list', 'retrieve', 'update', 'partial_update',
+                'cities', 'leaderboard', 'rank'
         ]:
             return True
         else:
@@ -38,15 +50,16 @@ class KennelPermission(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if not request.user.is_authenticated:
             return False
-        elif view.action == 'retrieve':
+        elif view.action in ['retrieve', 'leaderboard', 'rank']:
             return True
         elif view.action in ['update', 'partial update']:
-            return request.user in obj.get_kennel_admins()
+            return is_kennel_admin(request, obj)
         else:
             return False
 
 
-class KennelViewSet(viewsets.ModelViewSet):
+class KennelViewSet(QueryPlanMixin, ResponseCacheMixin, ValuesListMixin,
+                    viewsets.ModelViewSet):
     """
     API endpoint that allows kennels to be created, viewed, or edited.
     """
@@ -55,8 +68,10 @@ class KennelViewSet(viewsets.ModelViewSet):
     serializer_class = serializers.KennelSerializer
     permission_classes = [KennelPermission]
     http_method_names = ['get', 'head', 'put', 'patch', 'options', 'post']
+    cache_models = [models.Kennel, models.Membership, User, Profile]
+    shared_cache = True
 
-    filter_backends = [filters.SearchFilter, DjangoFilterBackend]
+    filter_backends = [FullTextSearchFilter, DjangoFilterBackend]
     filterset_fields = [
         'name', 'acronym', 'city', 'is_active', 'members__username',
         'members__profile__hash_name', 'id'
@@ -66,6 +81,72 @@ class KennelViewSet(viewsets.ModelViewSet):
         'members__profile__hash_name'
     ]
 
+    def get_cache_dependencies(self):
+        if self.action in ['retrieve', 'leaderboard', 'rank']:
+            return [f'kennel:{self.kwargs["pk"]}']
+        return super().get_cache_dependencies()
+
+    @action(detail=True)
+    @cached_action
+    def leaderboard(self, request, pk=None):
+        '''
+        The kennel's hashers ranked by runs or hares
+        (`?metric=runs|hares&since=&until=`).
+        '''
+        kennel = self.get_object()
+        params = serializers.LeaderboardQuerySerializer(data=request.GET)
+        params.is_valid(raise_exception=True)
+        results = models.UserKennelStats.get_leaderboard(
+            kennel.pk, **params.validated_data)
+        page = self.paginate_queryset(results)
+        users = User.objects.select_related('profile').in_bulk(
+            [row['user'] for row in page])
+        users = UserSerializer([users[row['user']] for row in page],
+                               many=True,
+                               context=self.get_serializer_context(),
+                               fields=['url', 'username', 'profile__hash_name'])
+        return self.get_paginated_response([{
+            'rank': row['rank'],
+            'user': user,
+            'count': row['count'],
+            'legacy_count': row['legacy_count'],
+            'total': row['total']
+        } for row, user in zip(page, users.data)])
+
+    @action(detail=True)
+    @cached_action
+    def rank(self, request, pk=None):
+        '''
+        A hasher's rank and percentile among the kennel's hashers
+        (`?user__username=&metric=runs|hares`).
+        '''
+        kennel = self.get_object()
+        params = serializers.RankQuerySerializer(data=request.GET)
+        params.is_valid(raise_exception=True)
+        user = get_object_or_404(
+            User, username=params.validated_data['user__username'])
+        content = models.UserKennelStats.get_rank(
+            user.pk, kennel.pk, params.validated_data['metric'])
+        return Response(
+            {
+                'user__username': user.username,
+                'metric': params.validated_data['metric'],
+                **content
+            },
+            status=status.HTTP_200_OK)
+
+    @action(detail=False)
+    def cities(self, request):
+        '''
+        City picker lookups (`?search=`) against the local GeoNames index.
+        '''
+        try:
+            content = serializers.KennelSerializer.get_cities(
+                request.GET.get('search', ''))
+        except GazetteerUnavailable:
+            content = {'records': []}
+        return Response(content)
+
 
 class MembershipPermission(permissions.BasePermission):
     '''
@@ -102,18 +183,21 @@ class MembershipPermission(permissions.BasePermission):
             return request.user == obj.user and (
                 not obj.is_admin or obj.kennel.get_kennel_admins().count() > 1)
         elif view.action in ['update', 'partial update']:
-            return not obj.is_approved and request.user in obj.kennel.get_kennel_admins(
-            )
+            return not obj.is_approved and is_kennel_admin(
+                request, obj.kennel_id)
         else:
             return False
 
 
-class MembershipViewSet(MultiClassModelViewSet):
+class MembershipViewSet(QueryPlanMixin, ResponseCacheMixin,
+                        MultiClassModelViewSet):
     """
     API endpoint that allows memberships to be viewed, created, approved, or deleted.
     """
     queryset = models.Membership.objects.all()
     serializer_class = serializers.MembershipSerializer
+    cache_models = [models.Membership, models.Kennel, User, Profile]
+    shared_cache = True
     serializer_action_classes = {
         'update': serializers.MembershipUpdateSerializer,
         'create': serializers.MembershipCreateSerializer
@@ -157,8 +241,7 @@ class ConsensusPermission(permissions.BasePermission):
         if not request.user.is_authenticated:
             return False
         elif view.action in ['create', 'list', 'retrieve', 'destroy']:
-            return models.Membership.objects.filter(user=request.user,
-                                                    is_admin=True).exists()
+            return bool(admin_kennels(request))
         else:
             return False
 
@@ -166,14 +249,14 @@ class ConsensusPermission(permissions.BasePermission):
         if not request.user.is_authenticated:
             return False
         elif view.action == 'retrieve':
-            return request.user in obj.kennel.get_kennel_admins()
+            return is_kennel_admin(request, obj.kennel_id)
         elif view.action == 'destroy':
             return request.user == obj.initiator
         else:
             return False
 
 
-class ConsensusViewSet(MultiClassModelViewSet):
+class ConsensusViewSet(QueryPlanMixin, MultiClassModelViewSet):
     """
     API endpoint that allows consensus items to be viewed, created, or deleted.
     """
@@ -204,13 +287,10 @@ class ConsensusViewSet(MultiClassModelViewSet):
         Only list consensuses valid to user.
         A consensus will only appear if the user is an admin for the consensus kennel
         '''
-        # get kennels where user is admin
-        kennels = models.Kennel.objects.filter(memberships__user=request.user,
-                                               memberships__is_admin=True)
-
         # serialize
         queryset = models.Consensus.objects.filter(
-            kennel__in=kennels).order_by('kennel').order_by('type')
+            kennel__in=admin_kennels(request)).order_by('kennel').order_by('type')
+        queryset = self.apply_query_plan(queryset)
         serializer = serializers.ConsensusSerializer(
             queryset, many=True, context={'request': request})
         return Response(serializer.data)
@@ -239,8 +319,7 @@ class ConsensusVotePermission(permissions.BasePermission):
         if not request.user.is_authenticated:
             return False
         elif view.action in ['list', 'retrieve', 'update', 'partial_update']:
-            return models.Membership.objects.filter(user=request.user,
-                                                    is_admin=True).exists()
+            return bool(admin_kennels(request))
         else:
             return False
 
@@ -253,7 +332,7 @@ class ConsensusVotePermission(permissions.BasePermission):
             return False
 
 
-class ConsensusVoteViewSet(viewsets.ModelViewSet):
+class ConsensusVoteViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows consensus votes to be viewed and edited.
     """
@@ -275,6 +354,7 @@ class ConsensusVoteViewSet(viewsets.ModelViewSet):
         queryset = models.ConsensusVote.objects.filter(
             voter=request.user).order_by('consensus__kennel').order_by(
                 'consensus__type')
+        queryset = self.apply_query_plan(queryset)
         serializer = serializers.ConsensusVoteSerializer(
             queryset, many=True, context={'request': request})
         return Response(serializer.data)
@@ -297,8 +377,7 @@ class LegacyLongevityPermission(permissions.BasePermission):
         if not request.user.is_authenticated:
             return False
         elif view.action == 'create':
-            return models.Membership.objects.filter(user=request.user,
-                                                    is_admin=True).exists()
+            return bool(admin_kennels(request))
         elif view.action in ['list', 'retrieve', 'update', 'partial_update']:
             return True
         else:
@@ -310,12 +389,12 @@ class LegacyLongevityPermission(permissions.BasePermission):
         elif view.action == 'retrieve':
             return True
         elif view.action in ['update', 'partial_update']:
-            return request.user in obj.kennel.get_kennel_admins()
+            return is_kennel_admin(request, obj.kennel_id)
         else:
             return False
 
 
-class LegacyLongevityViewSet(MultiClassModelViewSet):
+class LegacyLongevityViewSet(QueryPlanMixin, MultiClassModelViewSet):
     """
     API endpoint that allows legacy longevity to be viewed, created, or edited.
     """
@@ -336,3 +415,59 @@ class LegacyLongevityViewSet(MultiClassModelViewSet):
         'kennel__name', 'kennel__acronym', 'user__username',
         'user__profile__hash_name'
     ]
+
+
+class MilestonePermission(permissions.BasePermission):
+    '''
+    Permissions for Milestone viewset
+
+    LIST:
+    Kennel admins can list milestones
+        (this permission resticts listing to any user that has admin rights to
+        any kennel.  Kennel-level restrictions are implemented in viewset)
+
+    UPDATE:
+    Milestone kennel admins can mark milestones announced.
+    '''
+
+    def has_permission(self, request, view):
+        if not request.user.is_authenticated:
+            return False
+        elif view.action in ['list', 'retrieve', 'update', 'partial_update']:
+            return bool(admin_kennels(request))
+        else:
+            return False
+
+    def has_object_permission(self, request, view, obj):
+        if not request.user.is_authenticated:
+            return False
+        elif view.action in ['retrieve', 'update', 'partial_update']:
+            return is_kennel_admin(request, obj.kennel_id)
+        else:
+            return False
+
+
+class MilestoneViewSet(QueryPlanMixin, viewsets.ModelViewSet):
+    """
+    API endpoint that allows kennel admins to page through their kennels'
+    milestones (newest first) and mark them announced.
+    """
+    queryset = models.Milestone.objects.all()
+    serializer_class = serializers.MilestoneSerializer
+    pagination_class = KeysetPagination
+    keyset_field = '-created_at'
+    permission_classes = [MilestonePermission]
+    http_method_names = ['get', 'head', 'options', 'put', 'patch']
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = [
+        'kennel__name', 'kennel__acronym', 'event', 'kind', 'count',
+        'is_announced', 'user__username', 'user__profile__hash_name', 'id'
+    ]
+
+    def get_queryset(self):
+        '''
+        Only the milestones of the user's admin kennels.
+        '''
+        return super().get_queryset().filter(
+            kennel__in=admin_kennels(self.request)).select_related(
+                'event').order_by('-created_at', '-id')
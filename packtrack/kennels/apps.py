@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class KennelsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'kennels'
+
+    def ready(self):
+        # register full-text search indexes
+        from . import search
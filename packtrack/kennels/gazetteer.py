@@ -0,0 +1,157 @@
+import gzip
+import heapq
+import json
+import os
+import re
+import unicodedata
+from bisect import bisect_left
+from typing import Iterable, List, Tuple
+
+from . import settings
+
+# Above this many matching tokens, a prefix is cheaper to answer by scanning
+# cities in population order than by merging its postings
+MERGE_LIMIT = 64
+
+_loaded = {'mtime': None, 'gazetteer': None}
+
+
+class GazetteerUnavailable(Exception):
+    '''
+    The local index hasn't been built (see `manage.py load_gazetteer`).
+    '''
+
+
+def normalize(value: str) -> str:
+    '''
+    Lowercases and strips diacritics.
+    '''
+    decomposed = unicodedata.normalize('NFKD', value)
+    return ''.join(c for c in decomposed
+                   if not unicodedata.combining(c)).casefold()
+
+
+def tokenize(value: str) -> List[str]:
+    return re.findall(r'\w+', normalize(value))
+
+
+class Gazetteer:
+    '''
+    In-memory GeoNames city index.
+
+    `cities` holds (geonameid, name, admin1_code, country) ordered by
+    population, so lower city indexes are the better matches. `tokens` is the
+    sorted list of distinct normalized tokens, and `postings[i]` the sorted
+    city indexes containing `tokens[i]`, so the tokens starting with a prefix
+    are one contiguous range found by bisection.
+    '''
+
+    def __init__(self, cities: List[Tuple], tokens: List[str],
+                 postings: List[List[int]]):
+        self.cities = cities
+        self.tokens = tokens
+        self.postings = postings
+        self.city_tokens = [[] for _ in cities]
+        for token, city_indexes in enumerate(postings):
+            for city in city_indexes:
+                self.city_tokens[city].append(token)
+
+    @classmethod
+    def build(cls, cities: Iterable[Tuple]) -> 'Gazetteer':
+        '''
+        Indexes (geonameid, name, admin1_code, country, country_code,
+        population) rows.
+        '''
+        cities = sorted(cities, key=lambda c: (-c[5], c[0]))
+        postings = {}
+        for i, (_, name, admin1, country, country_code, _) in enumerate(cities):
+            for token in set(
+                    tokenize(f'{name} {admin1} {country} {country_code}')):
+                postings.setdefault(token, []).append(i)
+        tokens = sorted(postings)
+        return cls([tuple(c[:4]) for c in cities], tokens,
+                   [postings[t] for t in tokens])
+
+    @classmethod
+    def load(cls, path) -> 'Gazetteer':
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls([tuple(c) for c in data['cities']], data['tokens'],
+                   data['postings'])
+
+    def save(self, path) -> None:
+        tmp_path = f'{path}.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(
+                {
+                    'cities': self.cities,
+                    'tokens': self.tokens,
+                    'postings': self.postings
+                },
+                f,
+                separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    def prefix_range(self, prefix: str) -> Tuple[int, int]:
+        '''
+        Range of token indexes starting with `prefix`.
+        '''
+        lo = bisect_left(self.tokens, prefix)
+        hi = bisect_left(self.tokens, prefix + '\U0010ffff', lo)
+        return lo, hi
+
+    def estimate_matches(self, token_range: Tuple[int, int]) -> int:
+        '''
+        Upper bound on the cities matched by a token range.
+        '''
+        lo, hi = token_range
+        if hi - lo > MERGE_LIMIT:
+            return len(self.cities)
+        return sum(len(self.postings[i]) for i in range(lo, hi))
+
+    def search(self, value: str, limit: int = 10) -> List[Tuple]:
+        '''
+        Cities where every search term is a prefix of the city's name,
+        admin1 code, country or country code, most populous first.
+        '''
+        terms = tokenize(value)
+        if not terms:
+            return []
+        # start from the term matching the fewest cities
+        ranges = sorted((self.prefix_range(t) for t in set(terms)),
+                        key=self.estimate_matches)
+        lo, hi = ranges[0]
+        if lo == hi:
+            return []
+
+        if hi - lo <= MERGE_LIMIT:
+            candidates = heapq.merge(*self.postings[lo:hi])
+        else:
+            candidates = range(len(self.cities))
+        results = []
+        last = None
+        for city in candidates:
+            if city == last:
+                continue
+            last = city
+            if all(
+                    any(lo <= t < hi for t in self.city_tokens[city])
+                    for lo, hi in ranges):
+                results.append(self.cities[city])
+                if len(results) == limit:
+                    break
+        return results
+
+
+def get_gazetteer() -> Gazetteer:
+    '''
+    Returns the index at GAZETTEER_PATH, reloading it if the file changed.
+    '''
+    try:
+        mtime = os.stat(settings.GAZETTEER_PATH).st_mtime
+    except FileNotFoundError:
+        raise GazetteerUnavailable(settings.GAZETTEER_PATH)
+    if _loaded['mtime'] != mtime:
+        _loaded['gazetteer'] = Gazetteer.load(settings.GAZETTEER_PATH)
+        _loaded['mtime'] = mtime
+    return _loaded['gazetteer']
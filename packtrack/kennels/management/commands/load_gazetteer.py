@@ -0,0 +1,61 @@
+import csv
+import io
+import zipfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from kennels import settings
+from kennels.gazetteer import Gazetteer
+
+
+def open_dump(path: str):
+    '''
+    Opens a GeoNames text dump, or the .txt inside a GeoNames .zip.
+    '''
+    if zipfile.is_zipfile(path):
+        archive = zipfile.ZipFile(path)
+        names = [n for n in archive.namelist() if n.endswith('.txt')]
+        if not names:
+            raise CommandError(f'No .txt file in {path}')
+        return io.TextIOWrapper(archive.open(names[0]), encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+class Command(BaseCommand):
+    '''
+    Builds the local city index used to validate kennel cities.
+    '''
+    help = 'Loads a GeoNames cities dump (e.g. cities500.zip) into the local gazetteer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('cities',
+                            help='cities500.txt/.zip or another GeoNames '
+                            'cities dump')
+        parser.add_argument('--countries',
+                            help='countryInfo.txt, for country names '
+                            '(country codes are used without it)')
+        parser.add_argument('--output', default=settings.GAZETTEER_PATH)
+
+    def handle(self, *args, **options):
+        countries = {}
+        if options['countries']:
+            with open_dump(options['countries']) as f:
+                for row in csv.reader(f, delimiter='\t'):
+                    if row and not row[0].startswith('#'):
+                        countries[row[0]] = row[4]
+
+        cities = []
+        with open_dump(options['cities']) as f:
+            for row in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+                if len(row) < 15:
+                    continue
+                cities.append(
+                    (int(row[0]), row[1], row[10],
+                     countries.get(row[8], row[8]), row[8], int(row[14] or 0)))
+
+        gazetteer = Gazetteer.build(cities)
+        gazetteer.save(options['output'])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Indexed {len(gazetteer.cities)} cities '
+                f'({len(gazetteer.tokens)} tokens) into {options["output"]}'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from kennels.models import UserKennelStats
+
+
+class Command(BaseCommand):
+    '''
+    Rebuilds the UserKennelStats table from scratch.
+    '''
+    help = 'Rebuilds per-user/per-kennel longevity totals from attendance history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = UserKennelStats.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} stats rows'))
@@ -0,0 +1,66 @@
+# Generated by Django 4.0.2 on 2026-10-18 19:03
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_stats(apps, schema_editor):
+    from django.db.models import Count, Min, Max, Q
+    LongevityRecord = apps.get_model('events', 'LongevityRecord')
+    LegacyLongevity = apps.get_model('kennels', 'LegacyLongevity')
+    UserKennelStats = apps.get_model('kennels', 'UserKennelStats')
+    stats = {}
+    totals = LongevityRecord.objects.filter(
+        attend__user__isnull=False).values(
+            'attend__user', 'longevity__kennel').annotate(
+                runs=Count('id'),
+                hares=Count('id', filter=Q(attend__is_hare=True)),
+                first_run=Min('attend__event__date'),
+                last_run=Max('attend__event__date')).order_by()
+    for t in totals:
+        key = (t['attend__user'], t['longevity__kennel'])
+        stats[key] = UserKennelStats(user_id=key[0],
+                                     kennel_id=key[1],
+                                     runs=t['runs'],
+                                     hares=t['hares'],
+                                     first_run=t['first_run'],
+                                     last_run=t['last_run'])
+    for l in LegacyLongevity.objects.values('user', 'kennel', 'count', 'hares'):
+        key = (l['user'], l['kennel'])
+        row = stats.setdefault(
+            key, UserKennelStats(user_id=key[0], kennel_id=key[1]))
+        row.legacy_runs = l['count']
+        row.legacy_hares = l['hares']
+    UserKennelStats.objects.bulk_create(stats.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('kennels', '0015_legacylongevity_and_more'),
+        ('events', '0011_event_kennels_alter_longevity_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserKennelStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('runs', models.PositiveIntegerField(default=0)),
+                ('hares', models.PositiveIntegerField(default=0)),
+                ('legacy_runs', models.PositiveIntegerField(default=0)),
+                ('legacy_hares', models.PositiveIntegerField(default=0)),
+                ('first_run', models.DateField(null=True)),
+                ('last_run', models.DateField(null=True)),
+                ('kennel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_stats', to='kennels.kennel')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='kennel_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='userkennelstats',
+            constraint=models.UniqueConstraint(fields=('user', 'kennel'), name='unique_user_kennel_stats'),
+        ),
+        migrations.RunPython(populate_stats, migrations.RunPython.noop),
+    ]
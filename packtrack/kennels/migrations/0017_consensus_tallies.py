@@ -0,0 +1,47 @@
+# Generated by Django 4.0.2 on 2026-10-18 19:31
+
+from django.db import migrations, models
+
+
+def count_votes(apps, schema_editor):
+    from django.db.models import Count, OuterRef, Subquery
+    from django.db.models.functions import Coalesce
+    Consensus = apps.get_model('kennels', 'Consensus')
+    ConsensusVote = apps.get_model('kennels', 'ConsensusVote')
+    votes = ConsensusVote.objects.filter(
+        consensus=OuterRef('pk')).order_by().values('consensus')
+
+    def count(**filters):
+        return Coalesce(
+            Subquery(votes.filter(**filters).annotate(n=Count('pk')).values('n')),
+            0)
+
+    Consensus.objects.update(yes_votes=count(vote=True),
+                             no_votes=count(vote=False),
+                             pool_size=count())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kennels', '0016_userkennelstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='consensus',
+            name='no_votes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='consensus',
+            name='pool_size',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='consensus',
+            name='yes_votes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_votes, migrations.RunPython.noop),
+    ]
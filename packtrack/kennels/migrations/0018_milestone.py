@@ -0,0 +1,38 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0013_longevityrecord_run_number'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('kennels', '0017_consensus_tallies'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Milestone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('runs', 'runs'), ('hares', 'hares')], max_length=8)),
+                ('count', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('is_announced', models.BooleanField(default=False)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='milestones', to='events.event')),
+                ('kennel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='milestones', to='kennels.kennel')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='milestones', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='milestone',
+            index=models.Index(fields=['kennel', 'created_at', 'id'], name='milestone_kennel_created_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='milestone',
+            constraint=models.UniqueConstraint(fields=('user', 'kennel', 'kind', 'count'), name='unique_milestone'),
+        ),
+    ]
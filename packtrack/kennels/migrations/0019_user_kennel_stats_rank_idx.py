@@ -0,0 +1,22 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:20
+
+from django.db import migrations, models
+import django.db.models.expressions
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kennels', '0018_milestone'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userkennelstats',
+            index=models.Index(django.db.models.expressions.F('kennel'), django.db.models.expressions.CombinedExpression(django.db.models.expressions.F('runs'), '+', django.db.models.expressions.F('legacy_runs')), name='user_kennel_stats_runs_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userkennelstats',
+            index=models.Index(django.db.models.expressions.F('kennel'), django.db.models.expressions.CombinedExpression(django.db.models.expressions.F('hares'), '+', django.db.models.expressions.F('legacy_hares')), name='user_kennel_stats_hares_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.0.2 on 2026-10-18 20:35
+
+from django.db import migrations
+
+
+def recount_stats(apps, schema_editor):
+    '''
+    Recounts the totals of user/kennel pairs with records not counted toward
+    longevity, which were previously included.
+    '''
+    from django.db.models import (Count, Exists, Max, Min, OuterRef, Q,
+                                  Subquery)
+    from django.db.models.functions import Coalesce
+    LongevityRecord = apps.get_model('events', 'LongevityRecord')
+    UserKennelStats = apps.get_model('kennels', 'UserKennelStats')
+    records = LongevityRecord.objects.filter(
+        attend__user=OuterRef('user'), longevity__kennel=OuterRef('kennel'))
+    runs = records.filter(is_longevity=True).order_by().values(
+        'attend__user')
+
+    def total(aggregate):
+        return Subquery(runs.annotate(total=aggregate).values('total'))
+
+    UserKennelStats.objects.filter(
+        Exists(records.filter(is_longevity=False))).update(
+            runs=Coalesce(total(Count('id')), 0),
+            hares=Coalesce(
+                total(Count('id', filter=Q(attend__is_hare=True))), 0),
+            first_run=total(Min('attend__event__date')),
+            last_run=total(Max('attend__event__date')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0014_longevity_record_board_idx'),
+        ('kennels', '0019_user_kennel_stats_rank_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(recount_stats, migrations.RunPython.noop),
+    ]
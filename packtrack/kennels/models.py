@@ -1,14 +1,20 @@
-from django.db import IntegrityError, models
+from django.db import IntegrityError, connection, models, transaction
 from django.db.models.signals import post_save, post_delete, pre_save, pre_delete
-from django.db.models import Q
+from django.db.models import (Q, F, Count, Min, Max, Value, OuterRef,
+                              Subquery, FloatField, ExpressionWrapper, Window)
+from django.db.models.functions import (Coalesce, Greatest, Least, Rank,
+                                       RowNumber)
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.utils.translation import gettext_lazy as _
 from typing import Tuple
 
-from events.models import Longevity
+from core.cache import expire
+from events.models import (Event, Attend, Longevity, LongevityRecord,
+                           remove_longevity)
 
-from .settings import VOTING_MAJORITY, CONSENSUS_TYPES
+from .settings import (VOTING_MAJORITY, CONSENSUS_TYPES, MILESTONES,
+                       ADMIN_KENNELS_SESSION_CACHE)
 
 
 class Kennel(models.Model):
@@ -87,6 +93,10 @@ class Consensus(models.Model):
     event = models.ForeignKey('events.Event',
                               null=True,
                               on_delete=models.CASCADE)
+    # vote tallies, kept current by the vote signals
+    yes_votes = models.PositiveIntegerField(default=0)
+    no_votes = models.PositiveIntegerField(default=0)
+    pool_size = models.PositiveIntegerField(default=0)
 
     class Meta:
         constraints = [
@@ -107,11 +117,88 @@ class Consensus(models.Model):
         '''
         Gets current Yes/No vote percentages based on total admin pool size.
         '''
-        votes = ConsensusVote.objects.filter(consensus=self)
-        pool_size = votes.count()
-        yes_percent = votes.filter(vote=True).count() / pool_size
-        no_percent = votes.filter(vote=False).count() / pool_size
-        return (yes_percent, no_percent)
+        if not self.pool_size:
+            return (0.0, 0.0)
+        return (self.yes_votes / self.pool_size,
+                self.no_votes / self.pool_size)
+
+    def update_tally(self, old_vote=None, new_vote=None, pool: int = 0) -> None:
+        '''
+        Atomically moves one vote from `old_vote` to `new_vote` (None for
+        abstaining) and grows the pool by `pool`, then reloads the tallies.
+        '''
+        yes = int(new_vote is True) - int(old_vote is True)
+        no = int(new_vote is False) - int(old_vote is False)
+        Consensus.objects.filter(pk=self.pk).update(
+            yes_votes=F('yes_votes') + yes,
+            no_votes=F('no_votes') + no,
+            pool_size=F('pool_size') + pool)
+        self.refresh_from_db(fields=['yes_votes', 'no_votes', 'pool_size'])
+
+    @staticmethod
+    def recount(queryset) -> None:
+        '''
+        Recounts the tallies of every consensus in `queryset` in one UPDATE.
+        '''
+        votes = ConsensusVote.objects.filter(
+            consensus=OuterRef('pk')).order_by().values('consensus')
+
+        def count(**filters):
+            return Coalesce(
+                Subquery(
+                    votes.filter(**filters).annotate(
+                        n=Count('pk')).values('n')), 0)
+
+        queryset.update(yes_votes=count(vote=True),
+                        no_votes=count(vote=False),
+                        pool_size=count())
+
+    @classmethod
+    def recheck(cls, kennel, exclude=None) -> None:
+        '''
+        Recounts the kennel's consensuses and settles the ones now decided.
+        '''
+        consensuses = cls.objects.filter(kennel=kennel)
+        if exclude is not None:
+            consensuses = consensuses.exclude(pk=exclude.pk)
+        cls.recount(consensuses)
+        majority = ExpressionWrapper(F('pool_size') * VOTING_MAJORITY,
+                                     output_field=FloatField())
+        decided = consensuses.filter(
+            Q(yes_votes__gte=majority) | Q(no_votes__gte=majority)
+            | Q(pool_size=F('yes_votes') + F('no_votes')))
+        c: Consensus
+        for c in decided.select_related('kennel', 'membership', 'event'):
+            c.check_for_majority()
+
+    @classmethod
+    def add_admin(cls, membership: Membership, exclude=None) -> None:
+        '''
+        Gives a new admin an empty vote on the kennel's open consensuses.
+        '''
+        consensuses = cls.objects.filter(kennel=membership.kennel_id).exclude(
+            consensusvote__voter=membership.user_id)
+        if exclude is not None:
+            consensuses = consensuses.exclude(pk=exclude.pk)
+        pks = list(consensuses.values_list('pk', flat=True))
+        ConsensusVote.objects.bulk_create([
+            ConsensusVote(consensus_id=pk, voter_id=membership.user_id)
+            for pk in pks
+        ])
+        cls.objects.filter(pk__in=pks).update(pool_size=F('pool_size') + 1)
+
+    @classmethod
+    def remove_admin(cls, membership: Membership, exclude=None) -> None:
+        '''
+        Drops a former admin's votes from the kennel's open consensuses and
+        settles the ones now decided.
+        '''
+        votes = ConsensusVote.objects.filter(
+            consensus__kennel=membership.kennel_id, voter=membership.user_id)
+        if exclude is not None:
+            votes = votes.exclude(consensus=exclude.pk)
+        votes.delete()
+        cls.recheck(membership.kennel_id, exclude=exclude)
 
     def get_readable_votes(self) -> str:
         '''
@@ -120,6 +207,7 @@ class Consensus(models.Model):
         yes, no = self.get_split()
         return _(f'Yes: {int(yes*100)}% | No: {int(no*100)}%')
 
+    @transaction.atomic
     def perform_action(self) -> None:
         '''
         performs the required consensus action
@@ -137,16 +225,14 @@ class Consensus(models.Model):
         elif self.type == 1:
             self.membership.is_admin = True
             self.membership.save()
+            Consensus.add_admin(self.membership, exclude=self)
         # revoke admin
         elif self.type == 2:
             if self.kennel.get_kennel_admins().count() > 1:
                 self.membership.is_admin = False
                 self.membership.save()
                 # recheck all consensus majority votes
-                c: Consensus
-                for c in Consensus.objects.filter(kennel=self.kennel):
-                    if c != self:
-                        c.check_for_majority()
+                Consensus.remove_admin(self.membership, exclude=self)
             else:
                 pass
                 # "NONE (cannot revoke last admin)"
@@ -155,8 +241,9 @@ class Consensus(models.Model):
             Longevity.objects.create(kennel=self.kennel, event=self.event)
         # remove event longevity
         elif self.type == 4:
-            Longevity.objects.filter(kennel=self.kennel,
-                                     event=self.event).delete()
+            for longevity in Longevity.objects.filter(kennel=self.kennel,
+                                                      event=self.event):
+                remove_longevity(longevity)
 
     def get_desc(self) -> str:
         '''
@@ -178,7 +265,7 @@ class Consensus(models.Model):
         print([yes, no])
         if yes > VOTING_MAJORITY:
             self.perform_action()
-        elif no > VOTING_MAJORITY or yes + no == 1:
+        elif no > VOTING_MAJORITY or yes + no == 1 or not self.pool_size:
             pass
             # "NONE (no majority vote)"
         else:
@@ -228,11 +315,589 @@ class LegacyLongevity(models.Model):
         ]
 
 
+class UserKennelStats(models.Model):
+    '''
+    Denormalized per-user, per-kennel longevity totals.
+    Kept current by LongevityRecord and LegacyLongevity signals so profile
+    widgets can read totals without scanning attendance history.
+
+    Runs are the longevity records of claimed attendance that count toward
+    longevity (`is_longevity`), the same ones numbered by `number_runs` and
+    ranked by `get_leaderboard`.
+    '''
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name='kennel_stats')
+    kennel = models.ForeignKey(Kennel,
+                               on_delete=models.CASCADE,
+                               related_name='user_stats')
+    runs = models.PositiveIntegerField(default=0)
+    hares = models.PositiveIntegerField(default=0)
+    legacy_runs = models.PositiveIntegerField(default=0)
+    legacy_hares = models.PositiveIntegerField(default=0)
+    first_run = models.DateField(null=True)
+    last_run = models.DateField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'kennel'],
+                                    name='unique_user_kennel_stats')
+        ]
+        indexes = [
+            # rank lookups count a kennel's totals above a user's
+            models.Index(F('kennel'),
+                         F('runs') + F('legacy_runs'),
+                         name='user_kennel_stats_runs_idx'),
+            models.Index(F('kennel'),
+                         F('hares') + F('legacy_hares'),
+                         name='user_kennel_stats_hares_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.user} - {self.kennel}"
+
+    @staticmethod
+    def get_total(metric: str = 'runs'):
+        '''
+        Expression for a run (or hare) total including legacy longevity,
+        matching the rank indexes.
+        '''
+        if metric == 'hares':
+            return F('hares') + F('legacy_hares')
+        return F('runs') + F('legacy_runs')
+
+    @staticmethod
+    def counted_runs():
+        '''
+        The longevity records counted as runs.
+        '''
+        return LongevityRecord.objects.filter(attend__user__isnull=False,
+                                              is_longevity=True)
+
+    @staticmethod
+    def group_runs(records, counted_only: bool = True) -> dict:
+        '''
+        Groups longevity records into {(user_id, kennel_id): [runs, hares, first, last]}.
+        Records for unclaimed attendance are skipped, as are records not
+        counted toward longevity unless `counted_only` is False.
+        '''
+        groups = {}
+        for r in records:
+            if r.attend.user_id is None or (counted_only
+                                            and not r.is_longevity):
+                continue
+            date = r.attend.event.date
+            key = (r.attend.user_id, r.longevity.kennel_id)
+            group = groups.setdefault(key, [0, 0, date, date])
+            group[0] += 1
+            group[1] += int(r.attend.is_hare)
+            group[2] = min(group[2], date)
+            group[3] = max(group[3], date)
+        return groups
+
+    @classmethod
+    def add_runs(cls, records) -> None:
+        '''
+        Increments totals for newly created longevity records, numbers their
+        runs and records the milestones they reach.
+        '''
+        groups = cls.group_runs(records)
+        cls.objects.bulk_create(
+            [cls(user_id=u, kennel_id=k) for u, k in groups],
+            ignore_conflicts=True)
+        # users with identical increments (e.g. one event's roster) share
+        # an update
+        buckets = {}
+        for (u, k), increments in groups.items():
+            buckets.setdefault((k, *increments), []).append(u)
+        for (k, runs, hares, first, last), users in buckets.items():
+            cls.objects.filter(user_id__in=users, kennel_id=k).update(
+                runs=F('runs') + runs,
+                hares=F('hares') + hares,
+                first_run=Least(Coalesce('first_run', Value(first)),
+                                Value(first)),
+                last_run=Greatest(Coalesce('last_run', Value(last)),
+                                  Value(last)))
+        cls.number_records(records)
+        events = {(r.attend.user_id, r.longevity.kennel_id): r.attend.event_id
+                  for r in records}
+        Milestone.detect({
+            key: (runs, hares, events[key])
+            for key, (runs, hares, first, last) in groups.items()
+        })
+
+    @classmethod
+    def remove_runs(cls, groups: dict) -> None:
+        '''
+        Decrements totals for deleted longevity records (grouped by `group_runs`).
+        First/last run dates are re-read from the remaining records.
+        '''
+        dates = cls.counted_runs().filter(
+            attend__user=OuterRef('user'),
+            longevity__kennel=OuterRef('kennel')).values('attend__event__date')
+        for (u, k), (runs, hares, first, last) in groups.items():
+            cls.objects.filter(user_id=u, kennel_id=k).update(
+                runs=F('runs') - runs,
+                hares=F('hares') - hares,
+                first_run=Subquery(
+                    dates.order_by('attend__event__date')[:1]),
+                last_run=Subquery(dates.order_by('-attend__event__date')[:1]))
+
+    @classmethod
+    def add_event_runs(cls, event_id, kennel_id) -> None:
+        '''
+        Increments totals for the claimed attendance of an event that has just
+        started counting toward a kennel (one update per column group, however
+        big the event), renumbers their runs and records the milestones
+        reached.
+        '''
+        attendance = Attend.objects.filter(event=event_id, user__isnull=False)
+        date = Event.objects.values_list('date', flat=True).get(pk=event_id)
+        missing = attendance.exclude(user__in=cls.objects.filter(
+            kennel_id=kennel_id).values('user')).values_list('user',
+                                                             flat=True)
+        cls.objects.bulk_create(
+            [cls(user_id=user, kennel_id=kennel_id) for user in set(missing)],
+            ignore_conflicts=True)
+        stats = cls.objects.filter(kennel_id=kennel_id,
+                                   user__in=attendance.values('user'))
+        stats.update(runs=F('runs') + 1,
+                     first_run=Least(Coalesce('first_run', Value(date)),
+                                     Value(date)),
+                     last_run=Greatest(Coalesce('last_run', Value(date)),
+                                       Value(date)))
+        stats.filter(user__in=attendance.filter(
+            is_hare=True).values('user')).update(hares=F('hares') + 1)
+        cls.number_event_runs(event_id, kennel_id)
+        Milestone.detect_event(event_id, kennel_id)
+
+    @classmethod
+    def remove_event_runs(cls, event_id, kennel_id, runs) -> None:
+        '''
+        Decrements totals for an event that no longer counts toward a kennel,
+        once its records are deleted, given the (user_id, is_hare) pairs of
+        the runs they counted (read before the delete), and renumbers the
+        runs after it. First/last run dates are re-read from the remaining
+        records.
+        '''
+        dates = cls.counted_runs().filter(
+            attend__user=OuterRef('user'),
+            longevity__kennel=OuterRef('kennel')).values('attend__event__date')
+        stats = cls.objects.filter(kennel_id=kennel_id,
+                                   user__in=[u for u, is_hare in runs])
+        stats.filter(user__in=[u for u, is_hare in runs
+                               if is_hare]).update(hares=F('hares') - 1)
+        stats.update(
+            runs=F('runs') - 1,
+            first_run=Subquery(dates.order_by('attend__event__date')[:1]),
+            last_run=Subquery(dates.order_by('-attend__event__date')[:1]))
+        cls.number_event_runs(event_id, kennel_id)
+
+    @classmethod
+    def number_runs(cls, kennel_id=None, users=None, since=None) -> None:
+        '''
+        Stores each longevity record's run number: its position in the user's
+        history with the kennel (by event date), after their legacy runs.
+        Limited to a kennel and `users` (ids or a values() queryset) when
+        given. Only records from `since` on are rewritten, so attendance
+        added or removed mid-history renumbers just the runs after it.
+        '''
+        records = LongevityRecord.objects.filter(attend__user__isnull=False)
+        if kennel_id is not None:
+            records = records.filter(longevity__kennel=kennel_id)
+        if users is not None:
+            records = records.filter(attend__user__in=users)
+        legacy = LegacyLongevity.objects.filter(
+            user=OuterRef('attend__user'),
+            kennel=OuterRef('longevity__kennel')).values('count')
+        ranked = records.filter(is_longevity=True).order_by().annotate(
+            ranked_id=F('pk'),
+            ranked_date=F('attend__event__date'),
+            ranked_number=Coalesce(Subquery(legacy), 0) + Window(
+                RowNumber(),
+                partition_by=[F('attend__user'),
+                              F('longevity__kennel')],
+                order_by=[
+                    F('attend__event__date').asc(),
+                    F('attend__event').asc(),
+                    F('pk').asc()
+                ])).values('ranked_id', 'ranked_date', 'ranked_number')
+        sql, params = ranked.query.sql_with_params()
+        table = LongevityRecord._meta.db_table
+        where, since_params = '', ()
+        if since is not None:
+            where = 'WHERE ranked.ranked_date >= %s'
+            since_params = (connection.ops.adapt_datefield_value(since), )
+        # a correlated subquery rather than UPDATE ... FROM, which SQLite
+        # only supports from 3.33
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {table} SET run_number = (SELECT '
+                f'ranked.ranked_number FROM ({sql}) AS ranked WHERE '
+                f'ranked.ranked_id = {table}.id) WHERE {table}.id IN (SELECT '
+                f'ranked.ranked_id FROM ({sql}) AS ranked {where})',
+                (*params, *params, *since_params))
+        # records that stopped counting
+        uncounted = records.filter(is_longevity=False,
+                                   run_number__isnull=False)
+        if since is not None:
+            uncounted = uncounted.filter(attend__event__date__gte=since)
+        uncounted.update(run_number=None)
+
+    @classmethod
+    def number_records(cls, records) -> None:
+        '''
+        Renumbers runs from each new or changed longevity record on.
+        '''
+        cls.number_groups(cls.group_runs(records, counted_only=False))
+
+    @classmethod
+    def number_groups(cls, groups: dict) -> None:
+        '''
+        Renumbers runs of the user/kennel pairs grouped by `group_runs` from
+        their first grouped run on.
+        '''
+        # users with the same first run (e.g. one event's roster) share an
+        # update
+        buckets = {}
+        for (u, k), (runs, hares, first, last) in groups.items():
+            buckets.setdefault((k, first), []).append(u)
+        for (k, first), users in buckets.items():
+            cls.number_runs(k, users, since=first)
+
+    @classmethod
+    def number_event_runs(cls, event_id, kennel_id) -> None:
+        '''
+        Renumbers runs from an event on for everyone who attended it, after
+        it started or stopped counting toward a kennel.
+        '''
+        date = Event.objects.values_list('date', flat=True).get(pk=event_id)
+        cls.number_runs(kennel_id,
+                        Attend.objects.filter(
+                            event=event_id,
+                            user__isnull=False).values('user'),
+                        since=date)
+
+    @classmethod
+    def refresh(cls, user_id, kennel_id) -> None:
+        '''
+        Recomputes attendance totals for a single user/kennel pair.
+        '''
+        totals = cls.counted_runs().filter(
+            attend__user=user_id, longevity__kennel=kennel_id).aggregate(
+                runs=Count('id'),
+                hares=Count('id', filter=Q(attend__is_hare=True)),
+                first_run=Min('attend__event__date'),
+                last_run=Max('attend__event__date'))
+        cls.objects.update_or_create(user_id=user_id,
+                                     kennel_id=kennel_id,
+                                     defaults=totals)
+
+    @classmethod
+    def count_record(cls, record) -> None:
+        '''
+        Recounts the totals of a longevity record's user/kennel pair after it
+        started or stopped counting toward longevity, renumbers runs from it
+        on and records the milestones it reached.
+        '''
+        user_id, kennel_id = record.attend.user_id, record.longevity.kennel_id
+        if user_id is None:
+            return
+        cls.refresh(user_id, kennel_id)
+        cls.number_records([record])
+        if record.is_longevity:
+            Milestone.detect({
+                (user_id, kennel_id):
+                (1, int(record.attend.is_hare), record.attend.event_id)
+            })
+
+    @classmethod
+    def get_totals(cls, **filters):
+        '''
+        Per-kennel run/hare totals (with legacy longevity) matching `filters`,
+        largest first.
+        '''
+        return cls.objects.filter(runs__gt=0, **filters).annotate(
+            total=F('runs') + F('hares') + F('legacy_runs') +
+            F('legacy_hares')).order_by('-total', 'kennel').values(
+                'kennel__name',
+                run_count=F('runs'),
+                hare_count=F('hares'),
+                legacy_run_count=F('legacy_runs'),
+                legacy_hare_count=F('legacy_hares'))
+
+    @classmethod
+    def get_leaderboard(cls,
+                        kennel_id,
+                        metric: str = 'runs',
+                        since=None,
+                        until=None):
+        '''
+        A kennel's hashers ranked by runs (or hares) dated within
+        [`since`, `until`], largest first, as a values() queryset of
+        {'rank', 'user', 'count', 'legacy_count', 'total'} rows (ordered,
+        ranked and paged in SQL). Ties share a rank.
+        Without a window, the totals table is ranked, legacy longevity
+        included, as by `get_rank`. Windows count the kennel's runs in one
+        grouped query; legacy longevity is undated, so it isn't counted in
+        them.
+        '''
+        if since is None and until is None:
+            column = 'runs' if metric == 'runs' else 'hares'
+            rows = cls.objects.filter(kennel=kennel_id).annotate(
+                total=cls.get_total(metric)).filter(total__gt=0).values(
+                    'user',
+                    count=F(column),
+                    legacy_count=F(f'legacy_{column}'),
+                    total=F('total'))
+        else:
+            runs = cls.counted_runs().filter(longevity__kennel=kennel_id)
+            if since is not None:
+                runs = runs.filter(attend__event__date__gte=since)
+            if until is not None:
+                runs = runs.filter(attend__event__date__lte=until)
+            if metric == 'hares':
+                runs = runs.filter(attend__is_hare=True)
+            rows = runs.values('attend__user').annotate(
+                count=Count('id')).values(user=F('attend__user'),
+                                          count=F('count'),
+                                          legacy_count=Value(0),
+                                          total=F('count'))
+        return rows.annotate(
+            rank=Window(Rank(), order_by=F('total').desc())).order_by(
+                '-total', 'user')
+
+    @classmethod
+    def get_rank(cls, user_id, kennel_id, metric: str = 'runs') -> dict:
+        '''
+        A user's run (or hare) total in a kennel, its rank among the kennel's
+        hashers with any (ties share a rank), their number and the percentage
+        of them the user ranks level with or above.
+        Counted over the totals table's rank indexes instead of sorting the
+        kennel.
+        '''
+        stats = cls.objects.filter(kennel=kennel_id).annotate(
+            total=cls.get_total(metric))
+        total = stats.filter(user=user_id).values_list('total',
+                                                       flat=True).first() or 0
+        counts = stats.filter(total__gt=0).aggregate(
+            roster=Count('pk'), above=Count('pk', filter=Q(total__gt=total)))
+        rank = counts['above'] + 1 if total else None
+        return {
+            'total': total,
+            'rank': rank,
+            'roster': counts['roster'],
+            'percentile': (round(
+                100 * (counts['roster'] - rank + 1) / counts['roster'], 1)
+                           if rank else None)
+        }
+
+    @classmethod
+    def rebuild(cls, batch_size: int = 1000) -> int:
+        '''
+        Rebuilds the whole table from attendance and legacy longevity history,
+        and renumbers every run. Returns the number of rows written.
+        '''
+        stats = {}
+        totals = cls.counted_runs().values(
+                'attend__user', 'longevity__kennel').annotate(
+                    runs=Count('id'),
+                    hares=Count('id', filter=Q(attend__is_hare=True)),
+                    first_run=Min('attend__event__date'),
+                    last_run=Max('attend__event__date')).order_by()
+        for t in totals.iterator():
+            key = (t['attend__user'], t['longevity__kennel'])
+            stats[key] = cls(user_id=key[0],
+                             kennel_id=key[1],
+                             runs=t['runs'],
+                             hares=t['hares'],
+                             first_run=t['first_run'],
+                             last_run=t['last_run'])
+        for l in LegacyLongevity.objects.values('user', 'kennel', 'count',
+                                                'hares').iterator():
+            key = (l['user'], l['kennel'])
+            row = stats.setdefault(key, cls(user_id=key[0], kennel_id=key[1]))
+            row.legacy_runs = l['count']
+            row.legacy_hares = l['hares']
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(stats.values(), batch_size=batch_size)
+            cls.number_runs()
+        return len(stats)
+
+
+class Milestone(models.Model):
+    '''
+    A hasher's run or hare count with a kennel (legacy longevity included)
+    reaching one of the MILESTONES, recorded by the attendance that reached
+    it. Queued for the kennel's admins until they announce it.
+    '''
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name='milestones')
+    kennel = models.ForeignKey(Kennel,
+                               on_delete=models.CASCADE,
+                               related_name='milestones')
+    event = models.ForeignKey(Event,
+                              on_delete=models.CASCADE,
+                              related_name='milestones')
+    kind = models.CharField(max_length=8,
+                            choices=[(kind, kind) for kind in MILESTONES])
+    count = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    is_announced = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'kennel', 'kind', 'count'],
+                                    name='unique_milestone')
+        ]
+        indexes = [
+            # admins' queues, newest first
+            models.Index(fields=['kennel', 'created_at', 'id'],
+                         name='milestone_kennel_created_idx')
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.user} - {self.kennel}: {self.count} {self.kind}"
+
+    @classmethod
+    def detect(cls, increments: dict) -> None:
+        '''
+        Records the milestones reached by new runs, given as
+        {(user_id, kennel_id): (runs, hares, event_id)}, by comparing the
+        updated UserKennelStats totals with the increments (the same work
+        however long the history).
+        '''
+        if not increments:
+            return
+        stats = UserKennelStats.objects.filter(
+            user__in={u
+                      for u, k in increments},
+            kennel__in={k
+                        for u, k in increments}).values_list(
+                            'user', 'kennel', 'runs', 'legacy_runs', 'hares',
+                            'legacy_hares')
+        reached = []
+        for u, k, runs, legacy_runs, hares, legacy_hares in stats:
+            if (u, k) not in increments:
+                continue
+            added_runs, added_hares, event_id = increments[(u, k)]
+            for kind, total, legacy, added in (('runs', runs + legacy_runs,
+                                                legacy_runs, added_runs),
+                                               ('hares', hares + legacy_hares,
+                                                legacy_hares, added_hares)):
+                reached += [(u, k, kind, count, legacy, event_id)
+                            for count in MILESTONES[kind]
+                            if total - added < count <= total]
+        cls.create_reached(reached)
+
+    @classmethod
+    def detect_event(cls, event_id, kennel_id) -> None:
+        '''
+        Records the milestones reached by an event that has just started
+        counting toward a kennel. Everyone who attended it gained one run
+        (and its hares one hare), so only totals now equal to a milestone
+        are read.
+        '''
+        attendance = Attend.objects.filter(event=event_id, user__isnull=False)
+        stats = UserKennelStats.objects.filter(kennel_id=kennel_id).annotate(
+            total_runs=F('runs') + F('legacy_runs'),
+            total_hares=F('hares') + F('legacy_hares'))
+        reached = {
+            'runs':
+            stats.filter(user__in=attendance.values('user'),
+                         total_runs__in=MILESTONES['runs']).values_list(
+                             'user', 'total_runs', 'legacy_runs'),
+            'hares':
+            stats.filter(
+                user__in=attendance.filter(is_hare=True).values('user'),
+                total_hares__in=MILESTONES['hares']).values_list(
+                    'user', 'total_hares', 'legacy_hares'),
+        }
+        cls.create_reached([(u, kennel_id, kind, count, legacy, event_id)
+                            for kind in reached
+                            for u, count, legacy in reached[kind]])
+
+    @classmethod
+    def create_reached(cls, reached: list) -> None:
+        '''
+        Records milestones given as (user_id, kennel_id, kind, count,
+        legacy count, event_id) tuples. Each is credited to the event of the
+        run that reached it: the record numbered `count`, or the hasher's
+        (count - legacy)th counted hare. Runs added out of date order reach
+        milestones on later events than their own. Falls back to `event_id`
+        when the run can't be found.
+        '''
+        runs = UserKennelStats.counted_runs()
+        milestones = []
+        for u, k, kind, count, legacy, event_id in reached:
+            records = runs.filter(attend__user=u, longevity__kennel=k)
+            if kind == 'runs':
+                records = records.filter(run_number=count)
+            else:
+                records = records.filter(attend__is_hare=True).order_by(
+                    'attend__event__date', 'attend__event',
+                    'pk')[count - legacy - 1:]
+            milestones.append(
+                cls(user_id=u,
+                    kennel_id=k,
+                    event_id=records.values_list('attend__event',
+                                                 flat=True).first()
+                    or event_id,
+                    kind=kind,
+                    count=count))
+        cls.objects.bulk_create(milestones, ignore_conflicts=True)
+
+
 ### SIGNALS ###
 
 # Membership
 
 
+@receiver(pre_save, sender=Membership)
+def stash_admin_membership(sender, instance, **kwargs) -> None:
+    '''
+    Remembers the saved admin flag so changes can be detected.
+    '''
+    if ADMIN_KENNELS_SESSION_CACHE and instance.pk:
+        instance._admin_fields = Membership.objects.filter(
+            pk=instance.pk).values('user', 'is_admin').first()
+
+
+def expire_admin_kennels(users) -> None:
+    '''
+    Expires the admin kennel ids cached in the users' sessions once the
+    current transaction commits.
+    '''
+    from .permissions import bump_admin_version
+    for user in set(users):
+        transaction.on_commit(lambda user=user: bump_admin_version(user))
+
+
+@receiver(post_save, sender=Membership)
+def invalidate_admin_kennels(sender, instance, created, **kwargs) -> None:
+    '''
+    Expires the admin kennel ids cached in member sessions when a membership
+    gains or loses admin rights.
+    '''
+    if not ADMIN_KENNELS_SESSION_CACHE:
+        return
+    old = getattr(instance, '_admin_fields', None)
+    if created or old is None:
+        old = {'user': instance.user_id, 'is_admin': False}
+    changes = [(old['user'], old['is_admin']),
+               (instance.user_id, instance.is_admin)]
+    if changes[0] != changes[1]:
+        expire_admin_kennels(user for user, is_admin in changes if is_admin)
+
+
+@receiver(post_delete, sender=Membership)
+def invalidate_deleted_admin_kennels(sender, instance, **kwargs) -> None:
+    if ADMIN_KENNELS_SESSION_CACHE and instance.is_admin:
+        expire_admin_kennels([instance.user_id])
+
+
 @receiver(post_delete, sender=Membership)
 def recheck_consensuses(sender, instance, **kwargs) -> None:
     '''
@@ -240,12 +905,9 @@ def recheck_consensuses(sender, instance, **kwargs) -> None:
     Deletes remaining consensuses initiated by the removed admin
     '''
     if instance.is_admin:
-        c: Consensus
-        for c in Consensus.objects.filter(kennel=instance.kennel):
-            if c.initiator == instance.user:
-                c.delete()
-            else:
-                c.check_for_majority()
+        Consensus.objects.filter(kennel=instance.kennel_id,
+                                 initiator=instance.user_id).delete()
+        Consensus.remove_admin(instance)
 
 
 # Consensus
@@ -277,19 +939,31 @@ def cast_initiator_vote(sender, instance, created, **kwargs) -> None:
     Casts a YES vote for the consensus initiator
     '''
     if created:
-        ConsensusVote.objects.bulk_create([
-            ConsensusVote(consensus=instance, voter=a)
-            for a in instance.kennel.get_kennel_admins()
+        admins = instance.kennel.get_kennel_admins().values_list('pk',
+                                                                 flat=True)
+        votes = ConsensusVote.objects.bulk_create([
+            ConsensusVote(consensus=instance,
+                          voter_id=a,
+                          vote=True if a == instance.initiator_id else None)
+            for a in admins
         ])
-        initiator_vote = ConsensusVote.objects.get(consensus=instance,
-                                                   voter=instance.initiator)
-        initiator_vote.vote = True
-        initiator_vote.save()
+        instance.update_tally(new_vote=True, pool=len(votes))
+        instance.check_for_majority()
 
 
 # Vote
 
 
+@receiver(pre_save, sender=ConsensusVote)
+def stash_vote(sender, instance, **kwargs) -> None:
+    '''
+    Remembers the saved vote so the consensus tallies can be moved.
+    '''
+    if instance.pk:
+        instance._vote_fields = ConsensusVote.objects.filter(
+            pk=instance.pk).values('vote').first()
+
+
 @receiver(pre_save, sender=ConsensusVote)
 def verify_consensus_vote_integrity(sender, instance, **kwargs) -> None:
     '''
@@ -297,7 +971,10 @@ def verify_consensus_vote_integrity(sender, instance, **kwargs) -> None:
     '''
     if not instance.voter in instance.consensus.kennel.get_kennel_admins():
         consensus = instance.consensus
+        old = getattr(instance, '_vote_fields', None)
         instance.delete()
+        if old:
+            consensus.update_tally(old_vote=old['vote'], pool=-1)
         consensus.check_for_majority()
         raise PermissionError
 
@@ -305,6 +982,196 @@ def verify_consensus_vote_integrity(sender, instance, **kwargs) -> None:
 @receiver(post_save, sender=ConsensusVote)
 def check_majority(sender, instance, created, **kwargs) -> None:
     '''
-    Checks for majority vote when a vote is cast.
+    Counts the vote and checks for majority vote when a vote is cast.
     '''
+    old = getattr(instance, '_vote_fields', None)
+    if created:
+        instance.consensus.update_tally(new_vote=instance.vote, pool=1)
+    elif old and old['vote'] != instance.vote:
+        instance.consensus.update_tally(old['vote'], instance.vote)
     instance.consensus.check_for_majority()
+
+
+# Stats
+
+
+@receiver(pre_save, sender=LongevityRecord)
+def stash_stats_record(sender, instance, **kwargs) -> None:
+    '''
+    Remembers the saved longevity flag so changes can be detected.
+    '''
+    if instance.pk:
+        instance._stats_fields = LongevityRecord.objects.filter(
+            pk=instance.pk).values('is_longevity').first()
+
+
+@receiver(post_save, sender=LongevityRecord)
+def add_stats_runs(sender, instance, created, **kwargs) -> None:
+    '''
+    Counts individually created longevity records, and recounts saved ones
+    that started or stopped counting toward longevity.
+    (Records created with bulk_create are counted by the creating signal)
+    '''
+    old = getattr(instance, '_stats_fields', None)
+    if created:
+        UserKennelStats.add_runs([instance])
+    elif old and old['is_longevity'] != instance.is_longevity:
+        UserKennelStats.count_record(instance)
+    else:
+        return
+    instance.refresh_from_db(fields=['run_number'])
+
+
+@receiver(pre_delete, sender=LongevityRecord)
+def stash_stats_runs(sender, instance, **kwargs) -> None:
+    '''
+    Remembers the user/kennel pair of a record before its attendance is gone.
+    '''
+    instance._stats_runs = UserKennelStats.group_runs([
+        LongevityRecord.objects.select_related(
+            'attend__event', 'longevity').get(pk=instance.pk)
+    ])
+
+
+@receiver(post_delete, sender=LongevityRecord)
+def remove_stats_runs(sender, instance, **kwargs) -> None:
+    '''
+    Uncounts deleted longevity records.
+    '''
+    groups = getattr(instance, '_stats_runs', {})
+    UserKennelStats.remove_runs(groups)
+    UserKennelStats.number_groups(groups)
+
+
+@receiver(pre_save, sender=Attend)
+def stash_stats_attend(sender, instance, **kwargs) -> None:
+    '''
+    Remembers the saved user and hare flag so changes can be detected.
+    '''
+    if instance.pk:
+        instance._stats_fields = Attend.objects.filter(
+            pk=instance.pk).values('user', 'is_hare').first()
+
+
+@receiver(pre_save, sender=Event)
+def stash_stats_event(sender, instance, **kwargs) -> None:
+    '''
+    Remembers the saved event date so changes can be detected.
+    '''
+    if instance.pk:
+        instance._stats_fields = Event.objects.filter(
+            pk=instance.pk).values('date').first()
+
+
+@receiver(post_save, sender=Attend)
+def refresh_stats_attend(sender, instance, created, **kwargs) -> None:
+    '''
+    Recounts affected totals when an attendance is claimed, reassigned or
+    has its hare flag changed, renumbers runs when it changes hands and
+    records the milestones its new user (or hare) reached.
+    '''
+    old = getattr(instance, '_stats_fields', None)
+    if created or not old or (old['user'] == instance.user_id
+                              and old['is_hare'] == instance.is_hare):
+        return
+    kennels = list(
+        LongevityRecord.objects.filter(attend=instance).values_list(
+            'longevity__kennel', flat=True))
+    users = {old['user'], instance.user_id} - {None}
+    for k in kennels:
+        for u in users:
+            UserKennelStats.refresh(u, k)
+    if old['user'] != instance.user_id:
+        LongevityRecord.objects.filter(attend=instance).update(run_number=None)
+        for k in kennels:
+            UserKennelStats.number_runs(k, users, since=instance.event.date)
+    # milestones reached by the run (or hare) gained
+    runs = int(old['user'] != instance.user_id)
+    hares = int(instance.is_hare and (runs or not old['is_hare']))
+    if instance.user_id is not None and (runs or hares):
+        counted = LongevityRecord.objects.filter(
+            attend=instance, is_longevity=True).values_list(
+                'longevity__kennel', flat=True)
+        Milestone.detect({(instance.user_id, k): (runs, hares,
+                                                  instance.event_id)
+                          for k in counted})
+
+
+@receiver(post_save, sender=Event)
+def refresh_stats_event(sender, instance, created, **kwargs) -> None:
+    '''
+    Recounts first/last run dates and renumbers runs when an event is moved.
+    '''
+    old = getattr(instance, '_stats_fields', None)
+    if created or not old or old['date'] == instance.date:
+        return
+    pairs = LongevityRecord.objects.filter(
+        attend__event=instance, attend__user__isnull=False).values_list(
+            'attend__user', 'longevity__kennel').distinct()
+    kennels = {}
+    for u, k in pairs:
+        UserKennelStats.refresh(u, k)
+        kennels.setdefault(k, []).append(u)
+    for k, users in kennels.items():
+        UserKennelStats.number_runs(k,
+                                    users,
+                                    since=min(old['date'], instance.date))
+
+
+@receiver(post_save, sender=LegacyLongevity)
+def update_stats_legacy(sender, instance, **kwargs) -> None:
+    '''
+    Copies legacy longevity totals to the stats table and shifts the user's
+    run numbers with the kennel.
+    '''
+    UserKennelStats.objects.update_or_create(
+        user_id=instance.user_id,
+        kennel_id=instance.kennel_id,
+        defaults={
+            'legacy_runs': instance.count,
+            'legacy_hares': instance.hares
+        })
+    UserKennelStats.number_runs(instance.kennel_id, [instance.user_id])
+
+
+@receiver(post_delete, sender=LegacyLongevity)
+def remove_stats_legacy(sender, instance, **kwargs) -> None:
+    '''
+    Clears legacy longevity totals from the stats table and shifts the
+    user's run numbers with the kennel.
+    '''
+    UserKennelStats.objects.filter(user_id=instance.user_id,
+                                   kennel_id=instance.kennel_id).update(
+                                       legacy_runs=0, legacy_hares=0)
+    UserKennelStats.number_runs(instance.kennel_id, [instance.user_id])
+
+
+# Cached API responses
+
+
+@receiver(post_save, sender=Kennel)
+@receiver(post_delete, sender=Kennel)
+def expire_kennel_responses(sender, instance, **kwargs) -> None:
+    '''
+    Expires the kennel and its members' responses (which show its name).
+    '''
+    expire(kennels=[instance.pk],
+           users=Membership.objects.filter(kennel=instance.pk).values_list(
+               'user', flat=True),
+           models=[Kennel])
+
+
+@receiver(post_save, sender=Membership)
+@receiver(post_delete, sender=Membership)
+@receiver(post_save, sender=LegacyLongevity)
+@receiver(post_delete, sender=LegacyLongevity)
+def expire_member_responses(sender, instance, **kwargs) -> None:
+    expire(kennels=[instance.kennel_id],
+           users=[instance.user_id],
+           models=[sender])
+
+
+@receiver(post_save, sender=Consensus)
+@receiver(post_delete, sender=Consensus)
+def expire_consensus_responses(sender, instance, **kwargs) -> None:
+    expire(kennels=[instance.kennel_id], models=[Consensus])
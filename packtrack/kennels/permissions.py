@@ -0,0 +1,64 @@
+from core.cache import bump, get_generations
+
+from .models import Membership
+from .settings import ADMIN_KENNELS_SESSION_CACHE
+
+SESSION_KEY = '_admin_kennels'
+
+
+def _generation(user_id) -> str:
+    return f'admins:{user_id}'
+
+
+def bump_admin_version(user_id) -> None:
+    '''
+    Invalidates the user's admin kennel ids cached in their sessions.
+    '''
+    bump([_generation(user_id)])
+
+
+def _query(user_id) -> frozenset:
+    return frozenset(
+        Membership.objects.filter(user=user_id,
+                                  is_admin=True).values_list('kennel',
+                                                             flat=True))
+
+
+def _load(request, user_id) -> frozenset:
+    session = getattr(request, 'session', None)
+    if not ADMIN_KENNELS_SESSION_CACHE or session is None:
+        return _query(user_id)
+
+    version, = get_generations([_generation(user_id)])
+    stored = session.get(SESSION_KEY)
+    if stored and stored['user'] == user_id and stored['version'] == version:
+        return frozenset(stored['kennels'])
+    kennels = _query(user_id)
+    session[SESSION_KEY] = {
+        'user': user_id,
+        'version': version,
+        'kennels': sorted(kennels)
+    }
+    return kennels
+
+
+def admin_kennels(request) -> frozenset:
+    '''
+    Ids of the kennels the requesting user administers. Loaded once per
+    request (shared by the DRF and Django request objects).
+    '''
+    user = request.user
+    if not user.is_authenticated:
+        return frozenset()
+    # DRF requests wrap the HttpRequest
+    request = getattr(request, '_request', request)
+    if not hasattr(request, '_admin_kennels'):
+        request._admin_kennels = _load(request, user.pk)
+    return request._admin_kennels
+
+
+def is_kennel_admin(request, kennel) -> bool:
+    '''
+    Whether the requesting user administers `kennel` (a Kennel or its id).
+    '''
+    return getattr(kennel, 'pk', kennel) in admin_kennels(request)
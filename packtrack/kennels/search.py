@@ -0,0 +1,22 @@
+from django.contrib.auth.models import User
+
+from core.search import SearchIndex, register
+from profiles.models import Profile
+
+from . import models
+
+kennel_index = register(
+    SearchIndex(models.Kennel,
+                'search_kennel',
+                columns={
+                    'name': ['name'],
+                    'acronym': ['acronym'],
+                    'city': ['city'],
+                    'members':
+                    ['members__username', 'members__profile__hash_name'],
+                },
+                dependencies=[
+                    (models.Membership, 'memberships'),
+                    (User, 'members'),
+                    (Profile, 'members__profile'),
+                ]))
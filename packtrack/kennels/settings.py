@@ -1,3 +1,5 @@
+from pathlib import Path
+
 VOTING_MAJORITY = 0.51
 
 CONSENSUS_TYPES = {
@@ -7,3 +9,19 @@ CONSENSUS_TYPES = {
     3: '3: add longevity',
     4: '4: remove longevity'
 }
+
+# GeoNames city index written by `manage.py load_gazetteer`
+GAZETTEER_PATH = Path(__file__).resolve().parent.parent / 'gazetteer.json.gz'
+
+# Keep each user's admin kennel ids in their session between requests.
+# Invalidation bumps a per-user version in the default cache, so only enable
+# this with a CACHES backend shared by every worker process.
+ADMIN_KENNELS_SESSION_CACHE = False
+
+# Run and hare counts with a kennel (legacy longevity included) recorded as
+# milestones when attendance reaches them (kennels.models.Milestone)
+MILESTONES = {
+    'runs': (25, 50, 69, 100, 150, 200, 250, 300, 400, 500, 600, 666, 700,
+             800, 900, 1000),
+    'hares': (5, 10, 25, 50, 69, 100),
+}
@@ -1,7 +1,37 @@
-from django.test import TestCase
+import datetime
+import random
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-from .models import Kennel
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpRequest
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from core.cache import get_generations
+from events.models import (Attend, Event, Longevity, LongevityRecord,
+                           remove_longevity)
+from events.tests import create_events
+from . import settings as kennel_settings
+from .api.serializers import KennelSerializer
+from .gazetteer import get_gazetteer
+from .models import (Consensus, ConsensusVote, Kennel, LegacyLongevity,
+                     Membership, Milestone, UserKennelStats)
+from .permissions import admin_kennels, is_kennel_admin
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+    }
+}
 
 
 class KennelTest(TestCase):
@@ -11,3 +41,1077 @@ class KennelTest(TestCase):
         kennel1 = Kennel.objects.create(name='kennel1',
                                         acronym='1',
                                         city='anchorage ak')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@mock.patch('kennels.permissions.ADMIN_KENNELS_SESSION_CACHE', True)
+@mock.patch('kennels.models.ADMIN_KENNELS_SESSION_CACHE', True)
+class AdminKennelsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create(username='user1')
+        cls.kennels = [
+            Kennel.objects.create(name=f'kennel{i}',
+                                  acronym=f'K{i}',
+                                  city='anchorage ak') for i in range(2)
+        ]
+        cls.membership = Membership.objects.create(user=cls.user,
+                                                   kennel=cls.kennels[0],
+                                                   is_approved=True,
+                                                   is_admin=True)
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.session = {}
+
+    def get_request(self):
+        request = HttpRequest()
+        request.user = self.user
+        request.session = self.session
+        return request
+
+    def get_version(self):
+        return get_generations([f'admins:{self.user.pk}'])[0]
+
+    def test_loaded_once_per_request_and_session(self):
+        request = self.get_request()
+        with self.assertNumQueries(1):
+            self.assertEqual(admin_kennels(request), {self.kennels[0].pk})
+            self.assertTrue(is_kennel_admin(request, self.kennels[0]))
+            self.assertFalse(is_kennel_admin(request, self.kennels[1].pk))
+        with self.assertNumQueries(0):
+            self.assertEqual(admin_kennels(self.get_request()),
+                             {self.kennels[0].pk})
+
+    def test_admin_changes_expire_sessions(self):
+        admin_kennels(self.get_request())
+        version = self.get_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            Membership.objects.create(user=self.user,
+                                      kennel=self.kennels[1],
+                                      is_approved=True,
+                                      is_admin=True)
+        self.assertNotEqual(self.get_version(), version)
+        self.assertEqual(admin_kennels(self.get_request()),
+                         {kennel.pk
+                          for kennel in self.kennels})
+
+        version = self.get_version()
+        self.membership.is_admin = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.membership.save()
+        self.assertNotEqual(self.get_version(), version)
+        self.assertEqual(admin_kennels(self.get_request()),
+                         {self.kennels[1].pk})
+
+    @mock.patch('kennels.permissions.bump_admin_version')
+    def test_other_membership_changes_keep_sessions(self, bump):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.membership.is_approved = False
+            self.membership.save()
+            Membership.objects.create(user=User.objects.create(
+                username='user2'),
+                                      kennel=self.kennels[0],
+                                      is_approved=True)
+            Membership.objects.filter(user__username='user2').delete()
+        bump.assert_not_called()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.membership.delete()
+        bump.assert_called_once_with(self.user.pk)
+
+    @mock.patch('kennels.permissions.bump_admin_version')
+    def test_disabled_session_cache_never_expires(self, bump):
+        with mock.patch('kennels.models.ADMIN_KENNELS_SESSION_CACHE', False), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.membership.is_admin = False
+            self.membership.save()
+        bump.assert_not_called()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RankTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.kennels = [
+            Kennel.objects.create(name=f'kennel{i}',
+                                  acronym=f'K{i}',
+                                  city='anchorage ak') for i in range(2)
+        ]
+        cls.users = [
+            User.objects.create(username=f'user{i}') for i in range(6)
+        ]
+        events = create_events(cls.kennels[0], cls.users[:4], 6)
+        for i, event in enumerate(events):
+            Attend.objects.create(event=event,
+                                  user=cls.users[4 + i % 2],
+                                  is_hare=True)
+            if i % 2:
+                Longevity.objects.create(event=event, kennel=cls.kennels[1])
+        # records kept out of longevity don't count toward rank or board
+        for record in LongevityRecord.objects.filter(
+                attend__user=cls.users[0],
+                longevity__kennel=cls.kennels[0])[:3]:
+            record.is_longevity = False
+            record.save()
+        LegacyLongevity.objects.create(user=cls.users[3],
+                                       kennel=cls.kennels[0],
+                                       count=2,
+                                       hares=1)
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def get_board(self, kennel, metric):
+        board, url = [], f'/api/kennels/{kennel.pk}/leaderboard/?metric={metric}'
+        while url:
+            response = self.client.get(url)
+            board += response.data['results']
+            url = response.data['next']
+        return board
+
+    def get_rank(self, kennel, user, metric):
+        return self.client.get(f'/api/kennels/{kennel.pk}/rank/',
+                               {
+                                   'user__username': user.username,
+                                   'metric': metric
+                               }).data
+
+    def test_rank_agrees_with_leaderboard(self):
+        for kennel in self.kennels:
+            for metric in ['runs', 'hares']:
+                board = {
+                    row['user']['username']: row
+                    for row in self.get_board(kennel, metric)
+                }
+                for user in self.users:
+                    rank = self.get_rank(kennel, user, metric)
+                    self.assertEqual(rank['roster'], len(board))
+                    row = board.get(user.username,
+                                    {'rank': None, 'total': 0})
+                    self.assertEqual((rank['rank'], rank['total']),
+                                     (row['rank'], row['total']),
+                                     (kennel, user, metric))
+
+    def test_rank_counts(self):
+        # user1 and user2 ran all 6, user3 has 2 legacy runs on top of 6,
+        # user0 had 3 of 6 runs kept out of longevity, tying with the hares
+        ranks = {
+            user.username: self.get_rank(self.kennels[0], user, 'runs')
+            for user in self.users
+        }
+        self.assertEqual((ranks['user3']['total'], ranks['user3']['rank']),
+                         (8, 1))
+        self.assertEqual((ranks['user1']['rank'], ranks['user2']['rank']),
+                         (2, 2))
+        self.assertEqual((ranks['user0']['total'], ranks['user0']['rank']),
+                         (3, 4))
+        self.assertEqual((ranks['user4']['total'], ranks['user4']['rank']),
+                         (3, 4))
+        hares = self.get_rank(self.kennels[0], self.users[3], 'hares')
+        self.assertEqual((hares['total'], hares['rank'], hares['roster']),
+                         (1, 3, 3))
+
+    def test_rank_of_unknown_or_absent_hashers(self):
+        absent = User.objects.create(username='absent')
+        rank = self.get_rank(self.kennels[1], absent, 'runs')
+        self.assertEqual((rank['total'], rank['rank']), (0, None))
+        response = self.client.get(f'/api/kennels/{self.kennels[0].pk}/rank/',
+                                   {'user__username': 'nobody'})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(f'/api/kennels/{self.kennels[0].pk}/rank/',
+                                   {
+                                       'user__username': 'user1',
+                                       'metric': 'beers'
+                                   })
+        self.assertEqual(response.status_code, 400)
+
+
+class RandomHistoryMixin:
+    '''
+    Random changes to attendance history, for checking what's maintained
+    incrementally against a full UserKennelStats.rebuild().
+    '''
+    operations = [
+        'attend', 'unattend', 'claim', 'hare', 'move', 'legacy', 'adopt',
+        'drop'
+    ]
+    steps = 80
+
+    def create_history(self) -> None:
+        self.rng = random.Random(7)
+        self.kennels = [
+            Kennel.objects.create(name=f'kennel{i}',
+                                  acronym=f'K{i}',
+                                  city='anchorage ak') for i in range(3)
+        ]
+        self.users = [
+            User.objects.create(username=f'user{i}') for i in range(6)
+        ]
+        for kennel in self.kennels:
+            create_events(kennel, self.users[:3], 3)
+        LegacyLongevity.objects.create(user=self.users[0],
+                                       kennel=self.kennels[0],
+                                       count=3,
+                                       hares=1)
+
+    def apply(self, operation: str) -> None:
+        rng = self.rng
+        event = rng.choice(list(Event.objects.order_by('id')))
+        attend = Attend.objects.filter(event=event).order_by('?').first()
+        user = rng.choice(self.users)
+        kennel = rng.choice(self.kennels)
+        if operation == 'attend':
+            if not event.attendance.filter(user=user).exists():
+                Attend.objects.create(event=event,
+                                      user=user,
+                                      is_hare=rng.random() < 0.3)
+        elif operation == 'unattend' and attend:
+            attend.delete()
+        elif operation == 'claim':
+            attend = Attend.objects.filter(
+                user__isnull=True).order_by('?').first()
+            if attend and not attend.event.attendance.filter(
+                    user=user).exists():
+                attend.user, attend.unclaimed_name = user, None
+                attend.save()
+        elif operation == 'hare' and attend:
+            attend.is_hare = not attend.is_hare
+            attend.save()
+        elif operation == 'move':
+            event.date += datetime.timedelta(days=rng.randint(-5, 5))
+            event.save()
+        elif operation == 'legacy':
+            LegacyLongevity.objects.update_or_create(
+                user=user,
+                kennel=kennel,
+                defaults={
+                    'count': rng.randint(0, 4),
+                    'hares': rng.randint(0, 2)
+                })
+        elif operation == 'adopt':
+            if not event.longevity_set.filter(kennel=kennel).exists():
+                Longevity.objects.create(event=event, kennel=kennel)
+        elif operation == 'drop':
+            longevity = event.longevity_set.exclude(
+                kennel=event.host_id).first()
+            if longevity:
+                remove_longevity(longevity)
+        elif operation == 'flip':
+            record = LongevityRecord.objects.order_by('?').first()
+            record.is_longevity = not record.is_longevity
+            record.save()
+
+    def get_stats(self) -> set:
+        return set(
+            UserKennelStats.objects.exclude(
+                runs=0, legacy_runs=0, legacy_hares=0).values_list(
+                    'user', 'kennel', 'runs', 'hares', 'legacy_runs',
+                    'legacy_hares', 'first_run', 'last_run'))
+
+    def check_random_history(self, *checks) -> None:
+        '''
+        Applies `steps` random operations, comparing the stats table (and
+        whatever `checks` return) before and after a rebuild at each step.
+        '''
+        self.create_history()
+        for step in range(self.steps):
+            operation = self.rng.choice(self.operations)
+            self.apply(operation)
+            maintained = [self.get_stats()] + [check() for check in checks]
+            UserKennelStats.rebuild()
+            rebuilt = [self.get_stats()] + [check() for check in checks]
+            self.assertEqual(maintained, rebuilt, (step, operation))
+
+
+class UserKennelStatsTest(RandomHistoryMixin, TestCase):
+
+    def test_attendance_updates_totals(self):
+        self.create_history()
+        user, kennel = self.users[1], self.kennels[1]
+        stats = UserKennelStats.objects.get(user=user, kennel=kennel)
+        self.assertEqual((stats.runs, stats.hares), (3, 0))
+        event = Event.objects.create(name='late',
+                                     date=datetime.date(2021, 6, 1),
+                                     host=kennel)
+        attend = Attend.objects.create(event=event, user=user, is_hare=True)
+        stats.refresh_from_db()
+        self.assertEqual((stats.runs, stats.hares, stats.last_run),
+                         (4, 1, event.date))
+        attend.delete()
+        stats.refresh_from_db()
+        self.assertEqual((stats.runs, stats.hares, stats.last_run),
+                         (3, 0, datetime.date(2020, 1, 2)))
+
+    def test_random_changes_match_rebuild(self):
+        self.check_random_history()
+
+    def test_rebuild_command(self):
+        self.create_history()
+        expected = self.get_stats()
+        UserKennelStats.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_kennel_stats', stdout=out)
+        self.assertEqual(self.get_stats(), expected)
+        self.assertIn(f'Rebuilt {UserKennelStats.objects.count()}',
+                      out.getvalue())
+
+
+# GeoNames dump rows: geonameid, name, asciiname, alternatenames, latitude,
+# longitude, feature class, feature code, country code, cc2, admin1 code,
+# admin2-4 codes, population
+GEONAMES_CITIES = [
+    (5879400, 'Anchorage', 'AK', 'US', 291826),
+    (5861897, 'Fairbanks', 'AK', 'US', 31535),
+    (4930956, 'Boston', 'MA', 'US', 667137),
+    (2655138, 'Boston', 'ENG', 'GB', 41340),
+    (3117735, 'Madrid', '29', 'ES', 3255944),
+    (3128760, 'Barcelona', '56', 'ES', 1620343),
+    (6458923, 'Mérida', '57', 'ES', 59000),
+]
+GEONAMES_COUNTRIES = {'US': 'United States', 'GB': 'United Kingdom',
+                      'ES': 'Spain'}
+
+
+class GazetteerTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        directory = Path(cls.tmpdir.name)
+        with open(directory / 'cities.txt', 'w', encoding='utf-8') as f:
+            for geonameid, name, admin1, country, population in GEONAMES_CITIES:
+                f.write('\t'.join([
+                    str(geonameid), name, name, '', '0', '0', 'P', 'PPL',
+                    country, '', admin1, '', '', '',
+                    str(population)
+                ]) + '\n')
+        with open(directory / 'countries.txt', 'w', encoding='utf-8') as f:
+            f.write('#ISO\tISO3\tISO-Numeric\tfips\tCountry\n')
+            for code, name in GEONAMES_COUNTRIES.items():
+                f.write(f'{code}\t\t\t\t{name}\n')
+        cls.path = str(directory / 'gazetteer.json.gz')
+        call_command('load_gazetteer',
+                     str(directory / 'cities.txt'),
+                     countries=str(directory / 'countries.txt'),
+                     output=cls.path,
+                     stdout=StringIO())
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.tmpdir.cleanup()
+        super().tearDownClass()
+
+    def setUp(self) -> None:
+        patcher = mock.patch.object(kennel_settings, 'GAZETTEER_PATH',
+                                    self.path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def search(self, value):
+        return [name for _, name, _, _ in get_gazetteer().search(value)]
+
+    def validate(self, value):
+        return KennelSerializer().validate_city(value)
+
+    def test_search_matches_term_prefixes_by_population(self):
+        self.assertEqual(self.search('bost'), ['Boston', 'Boston'])
+        self.assertEqual(get_gazetteer().search('boston united k')[0][3],
+                         'United Kingdom')
+        self.assertEqual(self.search('spain'),
+                         ['Madrid', 'Barcelona', 'Mérida'])
+        self.assertEqual(self.search('MERIDA'), ['Mérida'])
+        self.assertEqual(self.search('an ak'), ['Anchorage'])
+        self.assertEqual(self.search('anch ma'), [])
+        self.assertEqual(self.search(', ;'), [])
+
+    def test_scan_and_merge_agree(self):
+        for value in ['b', 'a us', 'es', 'united', 'm 5']:
+            merged = self.search(value)
+            with mock.patch('kennels.gazetteer.MERGE_LIMIT', 0):
+                self.assertEqual(self.search(value), merged, value)
+
+    def test_validate_city(self):
+        self.assertEqual(self.validate('anchorage'),
+                         'Anchorage, AK, United States')
+        self.assertEqual(self.validate('madrid'), 'Madrid, Spain')
+        # an exact pick from the dropdown's several matches
+        self.assertEqual(self.validate('Boston, MA, United States'),
+                         'Boston, MA, United States')
+        with self.assertRaises(ValidationError) as raised:
+            self.validate('boston')
+        self.assertEqual(raised.exception.detail[1], [
+            'Boston, MA, United States', 'Boston, ENG, United Kingdom'
+        ])
+        with self.assertRaisesMessage(ValidationError, 'Could not find city'):
+            self.validate('juneau')
+        with mock.patch.object(kennel_settings, 'GAZETTEER_PATH',
+                               f'{self.path}.missing'):
+            with self.assertRaisesMessage(ValidationError, 'maintenance'):
+                self.validate('anchorage')
+
+    def test_cities_action(self):
+        client = APIClient()
+        response = client.get('/api/kennels/cities/', {'search': 'fair'})
+        self.assertEqual(response.status_code, 403)
+        client.force_authenticate(User.objects.create(username='user1'))
+        response = client.get('/api/kennels/cities/', {'search': 'fair'})
+        self.assertEqual(response.data['records'], [{
+            'record': {
+                'id': 5861897,
+                'fields': {
+                    'name': 'Fairbanks',
+                    'admin1_code': 'AK',
+                    'country': 'United States'
+                }
+            }
+        }])
+        with mock.patch.object(kennel_settings, 'GAZETTEER_PATH',
+                               f'{self.path}.missing'):
+            response = client.get('/api/kennels/cities/', {'search': 'fair'})
+        self.assertEqual(response.data, {'records': []})
+
+
+class ConsensusTallyTest(TestCase):
+
+    steps = 80
+
+    def setUp(self) -> None:
+        self.rng = random.Random(13)
+        self.kennel = Kennel.objects.create(name='kennel1',
+                                            acronym='K1',
+                                            city='anchorage ak')
+        self.users = [
+            User.objects.create(username=f'user{i}') for i in range(8)
+        ]
+        for i, user in enumerate(self.users):
+            Membership.objects.create(user=user,
+                                      kennel=self.kennel,
+                                      is_admin=i < 4)
+
+    def get_membership(self, user):
+        return Membership.objects.get(user=user, kennel=self.kennel)
+
+    def get_admins(self) -> list:
+        return list(self.kennel.get_kennel_admins().order_by('pk'))
+
+    def vote(self, consensus, user, vote) -> None:
+        cast = ConsensusVote.objects.get(consensus=consensus, voter=user)
+        cast.vote = vote
+        cast.save()
+
+    def get_tallies(self) -> dict:
+        return {
+            c.pk: (c.yes_votes, c.no_votes, c.pool_size)
+            for c in Consensus.objects.all()
+        }
+
+    def check_tallies(self) -> None:
+        tallies = self.get_tallies()
+        admins = set(self.kennel.get_kennel_admins())
+        for consensus in Consensus.objects.all():
+            voters = {v.voter for v in consensus.consensusvote_set.all()}
+            self.assertEqual(voters, admins)
+            yes, no = consensus.get_split()
+            self.assertFalse(yes > 0.51 or no > 0.51 or yes + no == 1)
+        Consensus.recount(Consensus.objects.all())
+        self.assertEqual(self.get_tallies(), tallies)
+
+    def test_creation_casts_the_initiators_vote(self):
+        consensus = Consensus.objects.create(
+            initiator=self.users[0],
+            kennel=self.kennel,
+            type=1,
+            membership=self.get_membership(self.users[5]))
+        with self.assertNumQueries(0):
+            self.assertEqual(consensus.get_split(), (0.25, 0.0))
+        self.assertEqual(
+            (consensus.yes_votes, consensus.no_votes, consensus.pool_size),
+            (1, 0, 4))
+        self.vote(consensus, self.users[1], False)
+        self.vote(consensus, self.users[1], None)
+        self.vote(consensus, self.users[2], True)
+        self.check_tallies()
+        self.assertFalse(self.get_membership(self.users[5]).is_admin)
+        self.vote(consensus, self.users[3], True)
+        self.assertTrue(self.get_membership(self.users[5]).is_admin)
+        self.assertFalse(Consensus.objects.exists())
+
+    def test_promoted_admins_join_open_pools(self):
+        pending = Consensus.objects.create(
+            initiator=self.users[0],
+            kennel=self.kennel,
+            type=1,
+            membership=self.get_membership(self.users[6]))
+        promotion = Consensus.objects.create(
+            initiator=self.users[0],
+            kennel=self.kennel,
+            type=1,
+            membership=self.get_membership(self.users[5]))
+        for user in self.users[1:3]:
+            self.vote(promotion, user, True)
+        self.assertFalse(Consensus.objects.filter(pk=promotion.pk).exists())
+        pending.refresh_from_db()
+        self.assertEqual(
+            (pending.yes_votes, pending.no_votes, pending.pool_size),
+            (1, 0, 5))
+        self.check_tallies()
+
+    def test_removed_admins_settle_decided_consensuses(self):
+        consensus = Consensus.objects.create(
+            initiator=self.users[0],
+            kennel=self.kennel,
+            type=1,
+            membership=self.get_membership(self.users[5]))
+        self.vote(consensus, self.users[1], True)
+        self.vote(consensus, self.users[2], False)
+        # 2 of 3 remaining admins voted yes
+        self.get_membership(self.users[3]).delete()
+        self.assertTrue(self.get_membership(self.users[5]).is_admin)
+        self.assertFalse(Consensus.objects.exists())
+        self.check_tallies()
+
+    def test_random_votes_match_recount(self):
+        for _ in range(self.steps):
+            admins = self.get_admins()
+            members = list(
+                User.objects.filter(memberships__kennel=self.kennel,
+                                    memberships__is_admin=False))
+            open_consensuses = list(Consensus.objects.all())
+            operation = self.rng.choice(
+                ['promote', 'revoke', 'vote', 'vote', 'vote', 'leave', 'join'])
+            if operation == 'promote' and members:
+                membership = self.get_membership(self.rng.choice(members))
+                if not Consensus.objects.filter(
+                        membership=membership).exists():
+                    Consensus.objects.create(initiator=self.rng.choice(admins),
+                                             kennel=self.kennel,
+                                             type=1,
+                                             membership=membership)
+            elif operation == 'revoke' and len(admins) > 2:
+                user = self.rng.choice(admins)
+                membership = self.get_membership(user)
+                if not Consensus.objects.filter(
+                        membership=membership).exists():
+                    Consensus.objects.create(initiator=self.rng.choice(
+                        [a for a in admins if a != user]),
+                                             kennel=self.kennel,
+                                             type=2,
+                                             membership=membership)
+            elif operation == 'vote' and open_consensuses:
+                self.vote(self.rng.choice(open_consensuses),
+                          self.rng.choice(admins),
+                          self.rng.choice([True, False, None]))
+            elif operation == 'leave' and len(admins) > 2:
+                self.get_membership(self.rng.choice(admins + members)).delete()
+            elif operation == 'join':
+                user = User.objects.create(
+                    username=f'user{User.objects.count()}')
+                Membership.objects.create(user=user, kennel=self.kennel)
+            self.check_tallies()
+
+
+class LongevityFanOutTest(RandomHistoryMixin, TestCase):
+
+    operations = ['attend', 'unattend', 'claim', 'move', 'adopt', 'drop']
+
+    def get_records(self) -> set:
+        return set(
+            LongevityRecord.objects.values_list('attend', 'longevity'))
+
+    def get_expected_records(self) -> set:
+        return {(attend, longevity)
+                for attend, longevity in Attend.objects.filter(
+                    event__longevity__isnull=False).values_list(
+                        'id', 'event__longevity')}
+
+    def create_event(self, kennel, attendance: int) -> Event:
+        event = Event.objects.create(name=f'run {Event.objects.count()}',
+                                     date=datetime.date(2021, 1, 1),
+                                     host=kennel)
+        for user in self.users:
+            Attend.objects.create(event=event, user=user)
+        for i in range(attendance - len(self.users)):
+            Attend.objects.create(event=event, unclaimed_name=f'anon {i}')
+        return event
+
+    def test_random_adoptions_match_rebuild(self):
+
+        def check_records():
+            self.assertEqual(self.get_records(), self.get_expected_records())
+
+        self.check_random_history(check_records)
+
+    def test_queries_do_not_grow_with_event_size(self):
+        self.create_history()
+        adopted, removed = [], []
+        # the first adoption also creates the users' stats rows
+        for attendance in [len(self.users), len(self.users), 40]:
+            event = self.create_event(self.kennels[0], attendance)
+            with CaptureQueriesContext(connection) as context:
+                longevity = Longevity.objects.create(event=event,
+                                                     kennel=self.kennels[1])
+            adopted.append(len(context.captured_queries))
+            self.assertEqual(self.get_records(), self.get_expected_records())
+            with CaptureQueriesContext(connection) as context:
+                remove_longevity(longevity)
+            removed.append(len(context.captured_queries))
+            self.assertEqual(self.get_records(), self.get_expected_records())
+        self.assertEqual(adopted[1], adopted[2])
+        self.assertEqual(removed[1], removed[2])
+        stats = self.get_stats()
+        UserKennelStats.rebuild()
+        self.assertEqual(self.get_stats(), stats)
+
+    def test_removal_rereads_first_and_last_runs(self):
+        self.create_history()
+        user, kennel = self.users[4], self.kennels[2]
+        events = [
+            self.create_event(self.kennels[0], len(self.users))
+            for _ in range(3)
+        ]
+        for i, event in enumerate(events):
+            event.date = datetime.date(2021, 1, 1 + i)
+            event.save()
+            Longevity.objects.create(event=event, kennel=kennel)
+        for event in [events[0], events[2]]:
+            remove_longevity(event.longevity_set.get(kennel=kennel))
+        stats = UserKennelStats.objects.get(user=user, kennel=kennel)
+        self.assertEqual((stats.runs, stats.first_run, stats.last_run),
+                         (1, events[1].date, events[1].date))
+
+    def test_votes_apply_completely_or_not_at_all(self):
+        self.create_history()
+        admin = self.users[0]
+        Membership.objects.create(user=admin,
+                                  kennel=self.kennels[1],
+                                  is_admin=True)
+        event = Event.objects.filter(host=self.kennels[0]).first()
+        # the only admin's vote passes it at once
+        Consensus.objects.create(initiator=admin,
+                                 kennel=self.kennels[1],
+                                 type=3,
+                                 event=event)
+        self.assertTrue(event.longevity_set.filter(kennel=self.kennels[1]))
+        records, stats = self.get_records(), self.get_stats()
+        with mock.patch.object(UserKennelStats,
+                               'remove_event_runs',
+                               side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                Consensus.objects.create(initiator=admin,
+                                         kennel=self.kennels[1],
+                                         type=4,
+                                         event=event)
+        self.assertTrue(event.longevity_set.filter(kennel=self.kennels[1]))
+        self.assertEqual(self.get_records(), records)
+        self.assertEqual(self.get_stats(), stats)
+        Consensus.objects.all().delete()
+        Consensus.objects.create(initiator=admin,
+                                 kennel=self.kennels[1],
+                                 type=4,
+                                 event=event)
+        self.assertFalse(event.longevity_set.filter(kennel=self.kennels[1]))
+        self.assertEqual(self.get_records(), self.get_expected_records())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RunNumberTest(RandomHistoryMixin, TestCase):
+
+    operations = RandomHistoryMixin.operations + ['flip']
+
+    def get_run_numbers(self) -> dict:
+        return dict(
+            LongevityRecord.objects.values_list('id', 'run_number'))
+
+    def get_expected_run_numbers(self) -> dict:
+        '''
+        Numbers each user's counted runs with a kennel in event order, after
+        their legacy runs.
+        '''
+        legacy = {(l.user_id, l.kennel_id): l.count
+                  for l in LegacyLongevity.objects.all()}
+        expected, histories = {}, {}
+        for record in LongevityRecord.objects.select_related(
+                'attend__event', 'longevity').order_by(
+                    'attend__event__date', 'attend__event', 'id'):
+            expected[record.pk] = None
+            if record.attend.user_id is None or not record.is_longevity:
+                continue
+            key = (record.attend.user_id, record.longevity.kennel_id)
+            histories[key] = histories.get(key, legacy.get(key, 0)) + 1
+            expected[record.pk] = histories[key]
+        return expected
+
+    def test_random_changes_keep_run_numbers(self):
+
+        def check_run_numbers():
+            numbers = self.get_run_numbers()
+            self.assertEqual(numbers, self.get_expected_run_numbers())
+            return numbers
+
+        self.check_random_history(check_run_numbers)
+
+    def test_run_numbers_in_the_api(self):
+        self.create_history()
+        user, kennel = self.users[0], self.kennels[0]
+        Membership.objects.create(user=user, kennel=kennel, is_admin=True)
+        client = APIClient()
+        client.force_authenticate(user)
+        # after 3 legacy runs
+        response = client.get(
+            '/api/longevityrecords/', {
+                'attend__user__username': user.username,
+                'longevity__kennel__acronym': kennel.acronym,
+                'run_number': 5
+            })
+        record = LongevityRecord.objects.get(
+            attend__event__name=f'{kennel.acronym} 1',
+            attend__user=user,
+            longevity__kennel=kennel)
+        self.assertEqual([row['url'] for row in response.data['results']],
+                         [f'http://testserver/api/longevityrecords/{record.pk}/'])
+        response = client.patch(
+            f'/api/longevityrecords/{record.pk}/', {'run_number': 1})
+        record.refresh_from_db()
+        self.assertEqual(record.run_number, 5)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@mock.patch.dict(kennel_settings.MILESTONES, {
+    'runs': (2, 5, 8),
+    'hares': (1, 3)
+})
+class MilestoneTest(RandomHistoryMixin, TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.kennel = Kennel.objects.create(name='milestones',
+                                            acronym='MS',
+                                            city='anchorage ak')
+        self.user = User.objects.create(username='hasher')
+        self.events = [
+            Event.objects.create(name=f'run {i}',
+                                 date=datetime.date(2020, 1, 1) +
+                                 datetime.timedelta(days=i),
+                                 host=self.kennel) for i in range(10)
+        ]
+
+    def get_milestones(self, user=None) -> list:
+        return list(
+            Milestone.objects.filter(user=user or self.user).order_by(
+                'kind', 'count').values_list('kind', 'count', 'event__name'))
+
+    def test_milestones_are_credited_to_the_run_that_reached_them(self):
+        for event in self.events[:5]:
+            Attend.objects.create(event=event,
+                                  user=self.user,
+                                  is_hare=event.name in ['run 1', 'run 4'])
+        self.assertEqual(self.get_milestones(), [('hares', 1, 'run 1'),
+                                                 ('runs', 2, 'run 1'),
+                                                 ('runs', 5, 'run 4')])
+
+    def test_earlier_runs_shift_the_credited_event(self):
+        for event in self.events[5:7]:
+            Attend.objects.create(event=event, user=self.user)
+        self.assertEqual(self.get_milestones(), [('runs', 2, 'run 6')])
+        # recorded milestones stay put, new ones count the earlier runs
+        for event in self.events[:3]:
+            Attend.objects.create(event=event, user=self.user)
+        self.assertEqual(self.get_milestones(), [('runs', 2, 'run 6'),
+                                                 ('runs', 5, 'run 6')])
+        for event in self.events[7:9] + self.events[4:5]:
+            Attend.objects.create(event=event, user=self.user)
+        self.assertEqual(self.get_milestones()[-1], ('runs', 8, 'run 8'))
+
+    def test_milestones_are_recorded_once(self):
+        attendance = [
+            Attend.objects.create(event=event, user=self.user)
+            for event in self.events[:2]
+        ]
+        attendance[1].delete()
+        self.assertEqual(self.get_milestones(), [('runs', 2, 'run 1')])
+        Attend.objects.create(event=self.events[3], user=self.user)
+        self.assertEqual(Milestone.objects.count(), 1)
+
+    def test_legacy_longevity_covers_earlier_milestones(self):
+        LegacyLongevity.objects.create(user=self.user,
+                                       kennel=self.kennel,
+                                       count=3,
+                                       hares=1)
+        for event in self.events[:2]:
+            Attend.objects.create(event=event, user=self.user, is_hare=True)
+        self.assertEqual(self.get_milestones(), [('hares', 3, 'run 1'),
+                                                 ('runs', 5, 'run 1')])
+
+    def test_adopted_events_record_milestones(self):
+        other = Kennel.objects.create(name='other',
+                                      acronym='OT',
+                                      city='anchorage ak')
+        hare = User.objects.create(username='hare')
+        for event in self.events[:2]:
+            Attend.objects.create(event=event, user=self.user)
+        Attend.objects.create(event=self.events[1], user=hare, is_hare=True)
+        Longevity.objects.create(event=self.events[0], kennel=other)
+        self.assertFalse(Milestone.objects.filter(kennel=other).exists())
+        Longevity.objects.create(event=self.events[1], kennel=other)
+        self.assertEqual(
+            set(
+                Milestone.objects.filter(kennel=other).values_list(
+                    'user', 'kind', 'count', 'event')),
+            {(self.user.pk, 'runs', 2, self.events[1].pk),
+             (hare.pk, 'hares', 1, self.events[1].pk)})
+
+    def get_totals(self) -> dict:
+        return {(stats.user_id, stats.kennel_id, kind): total
+                for stats in UserKennelStats.objects.all()
+                for kind, total in (('runs', stats.runs + stats.legacy_runs),
+                                    ('hares',
+                                     stats.hares + stats.legacy_hares))}
+
+    def test_random_additions_record_each_milestone_crossed(self):
+        self.operations = ['attend', 'claim', 'adopt']
+        self.create_history()
+        recorded = set(
+            Milestone.objects.values_list('user', 'kennel', 'kind', 'count'))
+        start = self.get_totals()
+        for step in range(self.steps):
+            self.apply(self.rng.choice(self.operations))
+        for (user, kennel, kind), total in self.get_totals().items():
+            recorded |= {(user, kennel, kind, count)
+                         for count in kennel_settings.MILESTONES[kind]
+                         if start.get((user, kennel, kind), 0) < count <= total}
+        self.assertEqual(
+            set(
+                Milestone.objects.values_list('user', 'kennel', 'kind',
+                                              'count')), recorded)
+
+    def test_admins_list_and_announce_their_kennels_milestones(self):
+        other = Kennel.objects.create(name='other',
+                                      acronym='OT',
+                                      city='anchorage ak')
+        for event in self.events[:2]:
+            Attend.objects.create(event=event, user=self.user)
+        other_event = Event.objects.create(name='other run',
+                                           date=datetime.date(2020, 1, 1),
+                                           host=other)
+        Attend.objects.create(event=other_event, user=self.user, is_hare=True)
+        admin = User.objects.create(username='admin')
+        Membership.objects.create(user=admin, kennel=self.kennel, is_admin=True)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get('/api/milestones/').status_code, 403)
+
+        client.force_authenticate(admin)
+        response = client.get('/api/milestones/')
+        self.assertEqual(response.status_code, 200)
+        milestone = Milestone.objects.get(kennel=self.kennel)
+        self.assertEqual(
+            [row['url'] for row in response.data['results']],
+            [f'http://testserver/api/milestones/{milestone.pk}/'])
+        other_milestone = Milestone.objects.get(kennel=other)
+        self.assertEqual(
+            client.patch(f'/api/milestones/{other_milestone.pk}/',
+                         {'is_announced': True}).status_code, 404)
+
+        response = client.patch(f'/api/milestones/{milestone.pk}/', {
+            'is_announced': True,
+            'count': 100
+        })
+        self.assertEqual(response.status_code, 200)
+        milestone.refresh_from_db()
+        self.assertEqual((milestone.is_announced, milestone.count), (True, 2))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LeaderboardTest(RandomHistoryMixin, TestCase):
+
+    operations = RandomHistoryMixin.operations + ['flip']
+    windows = [
+        (None, None),
+        (datetime.date(2020, 1, 2), None),
+        (None, datetime.date(2020, 1, 2)),
+        (datetime.date(2019, 12, 30), datetime.date(2020, 1, 2)),
+    ]
+
+    def setUp(self) -> None:
+        cache.clear()
+
+    def get_expected_leaderboard(self, kennel, metric, since, until) -> list:
+        '''
+        Ranks the kennel's hashers by counting their runs one by one.
+        '''
+        counts, legacy = {}, {}
+        records = LongevityRecord.objects.filter(
+            longevity__kennel=kennel,
+            attend__user__isnull=False,
+            is_longevity=True).select_related('attend__event')
+        for record in records:
+            date = record.attend.event.date
+            if (metric == 'hares' and not record.attend.is_hare
+                    or since and date < since or until and date > until):
+                continue
+            user = record.attend.user_id
+            counts[user] = counts.get(user, 0) + 1
+        if since is None and until is None:
+            for l in LegacyLongevity.objects.filter(kennel=kennel):
+                legacy[l.user_id] = l.count if metric == 'runs' else l.hares
+        rows = [{
+            'user': user,
+            'count': counts.get(user, 0),
+            'legacy_count': legacy.get(user, 0),
+            'total': counts.get(user, 0) + legacy.get(user, 0)
+        } for user in set(counts) | set(legacy)]
+        rows = [row for row in rows if row['total']]
+        for row in rows:
+            row['rank'] = 1 + len(
+                [other for other in rows if other['total'] > row['total']])
+        return sorted(rows, key=lambda row: (-row['total'], row['user']))
+
+    def test_random_changes_match_counted_leaderboards(self):
+
+        def check_leaderboards():
+            boards = []
+            for kennel in self.kennels:
+                for metric in ['runs', 'hares']:
+                    for since, until in self.windows:
+                        board = list(
+                            UserKennelStats.get_leaderboard(
+                                kennel.pk, metric, since, until))
+                        self.assertEqual(
+                            board,
+                            self.get_expected_leaderboard(
+                                kennel, metric, since, until),
+                            (kennel, metric, since, until))
+                        boards.append(board)
+            return boards
+
+        self.check_random_history(check_leaderboards)
+
+    def test_ranks_match_the_leaderboard(self):
+        self.create_history()
+        for _ in range(self.steps):
+            self.apply(self.rng.choice(self.operations))
+        for kennel in self.kennels:
+            for metric in ['runs', 'hares']:
+                board = list(UserKennelStats.get_leaderboard(
+                    kennel.pk, metric))
+                ranks = {row['user']: row for row in board}
+                for user in self.users:
+                    rank = UserKennelStats.get_rank(user.pk, kennel.pk,
+                                                    metric)
+                    self.assertEqual(rank['roster'], len(board))
+                    if user.pk not in ranks:
+                        self.assertEqual(
+                            (rank['total'], rank['rank'], rank['percentile']),
+                            (0, None, None))
+                        continue
+                    row = ranks[user.pk]
+                    self.assertEqual((rank['total'], rank['rank']),
+                                     (row['total'], row['rank']))
+                    self.assertEqual(
+                        rank['percentile'],
+                        round(100 * (len(board) - row['rank'] + 1) /
+                              len(board), 1))
+
+    def create_kennel(self) -> None:
+        '''
+        A kennel with more hashers than a page, many of them tied.
+        '''
+        self.kennel = Kennel.objects.create(name='board',
+                                            acronym='BD',
+                                            city='anchorage ak')
+        self.users = [
+            User.objects.create(username=f'hasher{i}') for i in range(25)
+        ]
+        events = [
+            Event.objects.create(name=f'run {i}',
+                                 date=datetime.date(2020, 1, 1) +
+                                 datetime.timedelta(days=i),
+                                 host=self.kennel) for i in range(6)
+        ]
+        for i, user in enumerate(self.users):
+            for event in events[:i % 6 + 1]:
+                Attend.objects.create(event=event,
+                                      user=user,
+                                      is_hare=event == events[i % 6])
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def test_leaderboard_pages(self):
+        self.create_kennel()
+        url = f'/api/kennels/{self.kennel.pk}/leaderboard/'
+        rows, page = [], url
+        while page:
+            response = self.client.get(page)
+            self.assertEqual(response.status_code, 200)
+            rows += response.data['results']
+            page = response.data['next']
+        self.assertEqual(response.data['count'], 25)
+        expected = self.get_expected_leaderboard(self.kennel, 'runs', None,
+                                                 None)
+        self.assertEqual(
+            [(row['rank'], row['user']['username'], row['total'])
+             for row in rows],
+            [(row['rank'], User.objects.get(pk=row['user']).username,
+              row['total']) for row in expected])
+        self.assertEqual(rows[0]['rank'], 1)
+        self.assertEqual(rows[-1]['rank'], 21)
+        self.assertEqual(
+            set(rows[0]['user']), {'url', 'username', 'profile'})
+
+        response = self.client.get(url, {
+            'metric': 'hares',
+            'since': '2020-01-05'
+        })
+        self.assertEqual(response.data['count'], 8)
+        self.assertEqual({row['rank'] for row in response.data['results']},
+                         {1})
+
+    def test_leaderboard_parameters_are_validated(self):
+        self.create_kennel()
+        url = f'/api/kennels/{self.kennel.pk}/leaderboard/'
+        for params in [{'metric': 'beers'}, {'since': 'yesterday'}]:
+            self.assertEqual(self.client.get(url, params).status_code, 400)
+        url = f'/api/kennels/{self.kennel.pk}/rank/'
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(
+            self.client.get(url, {
+                'user__username': 'nobody'
+            }).status_code, 404)
+        response = self.client.get(url, {'user__username': 'hasher6'})
+        self.assertEqual(
+            response.data, {
+                'user__username': 'hasher6',
+                'metric': 'runs',
+                'total': 1,
+                'rank': 21,
+                'roster': 25,
+                'percentile': 20.0
+            })
+
+    def test_cached_leaderboards_follow_attendance(self):
+        self.create_kennel()
+        url = f'/api/kennels/{self.kennel.pk}/leaderboard/'
+        first = self.client.get(url, {'metric': 'hares'})
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(
+                self.client.get(url, {
+                    'metric': 'hares'
+                }).data, first.data)
+        self.assertEqual(len(queries.captured_queries), 0)
+
+        event = Event.objects.create(name='late run',
+                                     date=datetime.date(2021, 1, 1),
+                                     host=self.kennel)
+        with self.captureOnCommitCallbacks(execute=True):
+            Attend.objects.create(event=event,
+                                  user=self.users[0],
+                                  is_hare=True)
+        response = self.client.get(url, {'metric': 'hares'})
+        self.assertEqual(
+            (response.data['results'][0]['user']['username'],
+             response.data['results'][0]['total']), ('hasher0', 2))
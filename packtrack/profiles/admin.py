@@ -5,3 +5,9 @@ from . import models
 @admin.register(models.Profile)
 class ProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'hash_name', 'id')
+
+
+@admin.register(models.AvatarJob)
+class AvatarJobAdmin(admin.ModelAdmin):
+    list_display = ('profile', 'avatar', 'created_at', 'started_at',
+                    'attempts')
@@ -3,12 +3,34 @@ from django.utils.translation import gettext_lazy as _
 from django.contrib.auth.models import User
 
 from .. import models
-from core.api.serializers.common import NestedDynamicFieldsModelSerializer
+from core.api.serializers.common import (CachedHyperlinkedModelSerializer,
+                                         NestedDynamicFieldsModelSerializer)
+
+
+class AvatarField(serializers.ImageField):
+    '''
+    Accepts avatar uploads and represents them by the URL of one of the
+    rendered thumbnail sizes.
+    '''
+
+    def __init__(self, size: str = 'medium', **kwargs):
+        self.size = size
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        url = value.instance.get_avatar_url(self.size)
+        request = self.context.get('request', None)
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
 
 
 class ProfileSerializer(NestedDynamicFieldsModelSerializer,
-                        serializers.HyperlinkedModelSerializer):
+                        CachedHyperlinkedModelSerializer):
 
+    avatar = AvatarField(required=False, allow_null=True)
     email = serializers.EmailField(source='user.email',
                                    allow_blank=True,
                                    allow_null=True)
@@ -21,8 +43,8 @@ class ProfileSerializer(NestedDynamicFieldsModelSerializer,
     def update(self, instance, validated_data):
 
         # save email to user account
-        user_data = validated_data.pop('user')
+        user_data = validated_data.pop('user', {})
         instance.user.email = user_data.get('email', instance.user.email)
         instance.user.save()
 
-        super().update(instance, validated_data)
+        return super().update(instance, validated_data)
@@ -1,6 +1,8 @@
 from rest_framework import viewsets, permissions
 from rest_framework.response import Response
 
+from core.api.viewsets.common import QueryPlanMixin
+
 from .. import models
 from . import serializers
 
@@ -32,7 +34,7 @@ class ProfilePermission(permissions.BasePermission):
             return False
 
 
-class ProfileViewSet(viewsets.ModelViewSet):
+class ProfileViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows member profiles to be viewed or edited.
     """
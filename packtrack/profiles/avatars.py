@@ -0,0 +1,155 @@
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from hashlib import sha256
+from io import BytesIO
+from typing import Dict, Tuple
+
+from PIL import Image, ImageOps
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import AvatarJob, Profile, avatar_thumbnail_name
+from .settings import (AVATAR_JOB_ATTEMPTS, AVATAR_JOB_TIMEOUT, AVATAR_SIZES,
+                       AVATAR_WORKERS, MAX_AVATAR_RATIO)
+
+_executor = {}
+
+
+def crop_to_ratio(image: Image.Image) -> Image.Image:
+    '''
+    Center-crops images more oblong than MAX_AVATAR_RATIO.
+    '''
+    width, height = image.size
+    if width / height > MAX_AVATAR_RATIO:
+        offset = (width - int(height * MAX_AVATAR_RATIO)) // 2
+        return image.crop(box=(offset, 0, width - offset, height))
+    elif height / width > MAX_AVATAR_RATIO:
+        offset = (height - int(width * MAX_AVATAR_RATIO)) // 2
+        return image.crop(box=(0, offset, width, height - offset))
+    return image
+
+
+def render_thumbnails(file) -> Tuple[str, Dict[int, bytes]]:
+    '''
+    Returns the source image's sha256 and a PNG for each of AVATAR_SIZES.
+    '''
+    data = file.read()
+    image = Image.open(BytesIO(data))
+    largest = max(AVATAR_SIZES.values())
+    # let JPEG decode at reduced scale instead of full resolution
+    image.draft('RGB', (largest, largest))
+    image = crop_to_ratio(ImageOps.exif_transpose(image))
+    if image.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+        image = image.convert('RGBA')
+
+    thumbnails = {}
+    # each size is downscaled from the previous one
+    for size in sorted(AVATAR_SIZES.values(), reverse=True):
+        image.thumbnail((size, size), Image.LANCZOS)
+        buffer = BytesIO()
+        image.save(buffer, 'PNG', optimize=True)
+        thumbnails[size] = buffer.getvalue()
+    return sha256(data).hexdigest(), thumbnails
+
+
+def delete_thumbnails(digest: str) -> None:
+    '''
+    Deletes a source image's thumbnails unless another profile still uses it.
+    '''
+    if not digest or Profile.objects.filter(avatar_hash=digest).exists():
+        return
+    storage = Profile._meta.get_field('avatar').storage
+    for size in AVATAR_SIZES.values():
+        storage.delete(avatar_thumbnail_name(digest, size))
+
+
+def claim(job_id: int) -> AvatarJob:
+    '''
+    Marks a job as started. Returns None if another worker has it.
+    '''
+    stale = timezone.now() - timedelta(seconds=AVATAR_JOB_TIMEOUT)
+    claimed = AvatarJob.objects.filter(
+        Q(started_at__isnull=True) | Q(started_at__lt=stale),
+        pk=job_id,
+        attempts__lt=AVATAR_JOB_ATTEMPTS).update(started_at=timezone.now(),
+                                                 attempts=F('attempts') + 1)
+    if not claimed:
+        return None
+    return AvatarJob.objects.select_related('profile').get(pk=job_id)
+
+
+def process(job: AvatarJob) -> None:
+    '''
+    Renders and stores the thumbnails for a claimed job.
+    '''
+    profile = job.profile
+    if profile.avatar.name != job.avatar:
+        # the avatar was replaced or removed since the job was queued
+        job.delete()
+        return
+
+    with profile.avatar.open('rb') as f:
+        digest, thumbnails = render_thumbnails(f)
+    storage = profile.avatar.storage
+    for size, data in thumbnails.items():
+        name = avatar_thumbnail_name(digest, size)
+        if not storage.exists(name):
+            storage.save(name, ContentFile(data))
+
+    updated = Profile.objects.filter(
+        pk=profile.pk, avatar=job.avatar).update(avatar_hash=digest)
+    if not updated:
+        delete_thumbnails(digest)
+    elif profile.avatar_hash != digest:
+        delete_thumbnails(profile.avatar_hash)
+    job.delete()
+
+
+def run(job_id: int) -> bool:
+    '''
+    Claims and processes a job, recording the error if it fails.
+    '''
+    job = claim(job_id)
+    if job is None:
+        return False
+    try:
+        process(job)
+    except Exception:
+        AvatarJob.objects.filter(pk=job_id).update(
+            started_at=None, error=traceback.format_exc())
+        return False
+    return True
+
+
+def run_pending() -> int:
+    '''
+    Processes every queued job. Returns the number processed.
+    '''
+    stale = timezone.now() - timedelta(seconds=AVATAR_JOB_TIMEOUT)
+    job_ids = AvatarJob.objects.filter(
+        Q(started_at__isnull=True) | Q(started_at__lt=stale),
+        attempts__lt=AVATAR_JOB_ATTEMPTS).order_by('id').values_list(
+            'id', flat=True)
+    return sum(run(job_id) for job_id in job_ids)
+
+
+def _run_in_background(job_id: int) -> None:
+    try:
+        run(job_id)
+    finally:
+        connection.close()
+
+
+def dispatch(job_id: int) -> None:
+    '''
+    Hands a queued job to the background workers, if the web process runs any.
+    '''
+    if not AVATAR_WORKERS:
+        return
+    if 'pool' not in _executor:
+        _executor['pool'] = ThreadPoolExecutor(
+            max_workers=AVATAR_WORKERS, thread_name_prefix='avatars')
+    _executor['pool'].submit(_run_in_background, job_id)
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from profiles.avatars import run_pending
+
+
+class Command(BaseCommand):
+    '''
+    Renders queued avatar thumbnails.
+    '''
+    help = 'Processes queued avatar thumbnail jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop',
+                            action='store_true',
+                            help='Keep polling for new jobs')
+        parser.add_argument('--interval', type=float, default=5)
+
+    def handle(self, *args, **options):
+        while True:
+            count = run_pending()
+            if count or not options['loop']:
+                self.stdout.write(
+                    self.style.SUCCESS(f'Processed {count} avatar jobs'))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
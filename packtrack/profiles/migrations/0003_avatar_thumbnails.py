@@ -0,0 +1,46 @@
+# Generated by Django 4.0.2 on 2026-10-18 19:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def queue_existing_avatars(apps, schema_editor):
+    '''
+    Queues thumbnail rendering for avatars uploaded before thumbnails existed.
+    '''
+    Profile = apps.get_model('profiles', 'Profile')
+    AvatarJob = apps.get_model('profiles', 'AvatarJob')
+    AvatarJob.objects.bulk_create([
+        AvatarJob(profile_id=pk, avatar=avatar)
+        for pk, avatar in Profile.objects.exclude(avatar='').exclude(
+            avatar__isnull=True).values_list('pk', 'avatar')
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0002_alter_profile_avatar'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.CreateModel(
+            name='AvatarJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('avatar', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='avatar_jobs', to='profiles.profile')),
+            ],
+        ),
+        migrations.RunPython(queue_existing_avatars,
+                             migrations.RunPython.noop),
+    ]
@@ -1,11 +1,12 @@
 from hashlib import sha256
-from PIL import Image
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.urls import reverse
-from .settings import MAX_AVATAR_RATIO, MAX_AVATAR_SIZE
+
+from core.cache import expire
+from .settings import AVATAR_SIZES
 
 import datetime
 
@@ -17,6 +18,13 @@ def avatar_upload(instance, filename):
     return f'profile_avatars/{sha256((filename+datetime.datetime.now().ctime()).encode()).hexdigest()}.png'
 
 
+def avatar_thumbnail_name(digest: str, size: int) -> str:
+    '''
+    Thumbnails are named by the content hash of their source image.
+    '''
+    return f'profile_avatars/thumbnails/{digest}_{size}.png'
+
+
 class Profile(models.Model):
     '''
     Model for user profile.
@@ -25,34 +33,28 @@ class Profile(models.Model):
                                 on_delete=models.CASCADE,
                                 related_name='profile')
     avatar = models.ImageField(null=True, blank=True, upload_to=avatar_upload)
+    # sha256 of the avatar whose thumbnails have been rendered
+    avatar_hash = models.CharField(max_length=64, blank=True, editable=False)
     hash_name = models.CharField(max_length=64)
 
     def __str__(self) -> str:
         return self.user.username
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-
-        # Rescale avatar to max and crop if user uploads ridiculous dims
-        new_avatar = self.avatar
-        if new_avatar:
-            image = Image.open(self.avatar)
-            width, height = image.size
-            if width / height > MAX_AVATAR_RATIO:
-                width_offset = (width - (height * MAX_AVATAR_RATIO)) // 2
-                image.crop(box=(width_offset, 0, width - width_offset, height))
-            elif height / width > MAX_AVATAR_RATIO:
-                height_offset = (height - (width * MAX_AVATAR_RATIO)) // 2
-                image.crop(box=(height_offset, 0, height - height_offset,
-                                width))
-            factor = 1.0
-            if MAX_AVATAR_SIZE < height > width:
-                factor = MAX_AVATAR_SIZE / height
-            elif MAX_AVATAR_SIZE < width > height:
-                factor = MAX_AVATAR_SIZE / width
-            size = (int(width * factor), int(height * factor))
-            image = image.resize(size, Image.ANTIALIAS)
-            image.save(self.avatar.path)
+    def get_avatar_url(self, size: str = 'medium') -> str:
+        '''
+        URL of the avatar thumbnail for one of AVATAR_SIZES, or of the
+        original upload while its thumbnails are still being rendered.
+        '''
+        if not self.avatar:
+            return None
+        if not self.avatar_hash:
+            return self.avatar.url
+        return self.avatar.storage.url(
+            avatar_thumbnail_name(self.avatar_hash, AVATAR_SIZES[size]))
+
+    @property
+    def avatar_urls(self) -> dict:
+        return {size: self.get_avatar_url(size) for size in AVATAR_SIZES}
 
     def get_absolute_url(self):
         return reverse('profile', args=[self.user.username])
@@ -68,3 +70,77 @@ def create_profile(sender, instance, created, **kwargs) -> None:
             user=instance,
             hash_name=instance.username,
         )
+
+
+class AvatarJob(models.Model):
+    '''
+    Queued rendering of a profile's avatar thumbnails.
+    '''
+    profile = models.ForeignKey(Profile,
+                                on_delete=models.CASCADE,
+                                related_name='avatar_jobs')
+    # avatar file name when queued; superseded jobs are dropped
+    avatar = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+
+@receiver(pre_save, sender=Profile)
+def stash_avatar(sender, instance, **kwargs) -> None:
+    '''
+    Remembers the saved avatar, and clears the thumbnails of a replaced one.
+    '''
+    instance._avatar_fields = Profile.objects.filter(
+        pk=instance.pk).values('avatar', 'avatar_hash').first(
+        ) if instance.pk else None
+    old = instance._avatar_fields or {'avatar': None}
+    if (old['avatar'] or None) != (instance.avatar.name or None):
+        instance.avatar_hash = ''
+
+
+@receiver(post_save, sender=Profile)
+def queue_avatar(sender, instance, **kwargs) -> None:
+    '''
+    Queues thumbnail rendering for a new avatar once the upload is committed.
+    '''
+    old = getattr(instance, '_avatar_fields', None) or {
+        'avatar': None,
+        'avatar_hash': ''
+    }
+    if old['avatar_hash'] and old['avatar_hash'] != instance.avatar_hash:
+        from .avatars import delete_thumbnails
+        transaction.on_commit(lambda: delete_thumbnails(old['avatar_hash']))
+    if instance.avatar and not instance.avatar_hash and (
+            old['avatar'] or None) != instance.avatar.name:
+        from .avatars import dispatch
+        job = AvatarJob.objects.create(profile=instance,
+                                       avatar=instance.avatar.name)
+        transaction.on_commit(lambda: dispatch(job.pk))
+
+
+@receiver(post_delete, sender=Profile)
+def delete_avatar_thumbnails(sender, instance, **kwargs) -> None:
+    if instance.avatar_hash:
+        from .avatars import delete_thumbnails
+        transaction.on_commit(lambda: delete_thumbnails(instance.avatar_hash))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Profile)
+def expire_hasher_responses(sender, instance, update_fields=None,
+                            **kwargs) -> None:
+    '''
+    Expires cached responses showing the hasher's username or hash name:
+    theirs, and those of the kennels they're a member of or ranked in.
+    '''
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    from kennels.models import Membership, UserKennelStats
+    user_id = instance.pk if sender is User else instance.user_id
+    kennels = Membership.objects.filter(user=user_id).values_list(
+        'kennel', flat=True).union(
+            UserKennelStats.objects.filter(user=user_id).values_list(
+                'kennel', flat=True))
+    expire(kennels=kennels, users=[user_id], models=[sender])
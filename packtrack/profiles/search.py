@@ -0,0 +1,21 @@
+from django.contrib.auth.models import User
+
+from core.search import SearchIndex, register
+from kennels.models import Kennel, Membership
+
+from . import models
+
+user_index = register(
+    SearchIndex(User,
+                'search_user',
+                columns={
+                    'username': ['username'],
+                    'email': ['email'],
+                    'hash_name': ['profile__hash_name'],
+                    'kennels': ['kennels__name', 'kennels__acronym'],
+                },
+                dependencies=[
+                    (models.Profile, 'profile'),
+                    (Membership, 'memberships'),
+                    (Kennel, 'kennels'),
+                ]))
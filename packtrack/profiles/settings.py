@@ -1,2 +1,15 @@
 MAX_AVATAR_SIZE = 800
 MAX_AVATAR_RATIO = 16 / 9
+
+# Avatar thumbnails rendered for every upload, by name and bounding box (px)
+AVATAR_SIZES = {'small': 64, 'medium': 256, 'large': MAX_AVATAR_SIZE}
+# Background threads rendering avatars in the web process. With 0, queued
+# jobs are left for `manage.py process_avatars`.
+AVATAR_WORKERS = 1
+# Failed jobs are retried this many times, and claimed jobs that haven't
+# finished after AVATAR_JOB_TIMEOUT seconds are assumed lost.
+AVATAR_JOB_ATTEMPTS = 3
+AVATAR_JOB_TIMEOUT = 600
+# Threads computing the parts of a profile summary concurrently, each on its
+# own database connection. With 0, the parts are computed in turn.
+PROFILE_SUMMARY_WORKERS = 0
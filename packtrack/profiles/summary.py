@@ -0,0 +1,129 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Count, Q, Sum
+from django.urls import reverse
+from rest_framework.utils.urls import replace_query_param
+
+from core.middleware import measure
+from events.models import Attend
+from kennels.models import Kennel, LegacyLongevity, UserKennelStats
+
+from .settings import PROFILE_SUMMARY_WORKERS
+
+_executor = {}
+
+
+def get_counts(user: User) -> dict:
+    '''
+    Attendance and hare totals, with legacy longevity.
+    '''
+    counts = Attend.objects.filter(user=user).aggregate(
+        attendance=Count('id'), hares=Count('id', filter=Q(is_hare=True)))
+    legacy = LegacyLongevity.objects.filter(user=user).aggregate(
+        runs=Sum('count'), hares=Sum('hares'))
+    return {
+        'attendance': counts['attendance'],
+        'runs': counts['attendance'] + (legacy['runs'] or 0),
+        'hares': counts['hares'] + (legacy['hares'] or 0),
+    }
+
+
+def get_kennels(user: User, request) -> dict:
+    from kennels.api.serializers import KennelSerializer
+    kennels = Kennel.objects.filter(members=user).order_by('-is_active', 'id')
+    results = KennelSerializer(kennels,
+                               many=True,
+                               fields=['url', 'name', 'acronym'],
+                               context={
+                                   'request': request
+                               }).data
+    return {'count': len(results), 'results': results}
+
+
+def get_longevity(user: User) -> dict:
+    results = list(UserKennelStats.get_totals(user=user))
+    return {'results': results, 'count': len(results)}
+
+
+def get_attendance(user: User, request) -> list:
+    '''
+    First page of the user's attendance, as `/api/attendance/` lists it.
+    '''
+    from events.api.serializers import AttendSerializer
+    from core.api.serializers.common import get_query_plan
+    serializer = AttendSerializer(context={'request': request})
+    select_related, prefetch_related = get_query_plan(serializer)
+    attendance = Attend.objects.filter(user=user).select_related(
+        *select_related).prefetch_related(*prefetch_related).order_by(
+            '-event__date', '-id')[:settings.REST_FRAMEWORK['PAGE_SIZE']]
+    return AttendSerializer(attendance,
+                            many=True,
+                            context={
+                                'request': request
+                            }).data
+
+
+def _run_in_background(context, func, *args):
+    try:
+        return context.run(func, *args)
+    finally:
+        connection.close()
+
+
+def _run(tasks: dict) -> dict:
+    '''
+    Calls each of {name: (func, *args)}, on PROFILE_SUMMARY_WORKERS threads
+    if configured.
+    '''
+    if not PROFILE_SUMMARY_WORKERS:
+        return {name: func(*args) for name, (func, *args) in tasks.items()}
+    if 'pool' not in _executor:
+        _executor['pool'] = ThreadPoolExecutor(
+            max_workers=PROFILE_SUMMARY_WORKERS,
+            thread_name_prefix='profile-summary')
+    futures = {
+        name: _executor['pool'].submit(_run_in_background,
+                                       contextvars.copy_context(), func,
+                                       *args)
+        for name, (func, *args) in tasks.items()
+    }
+    return {name: future.result() for name, future in futures.items()}
+
+
+def get_summary(user: User, request) -> dict:
+    '''
+    Everything the hasher profile widgets show, in the shapes of the API
+    responses they would otherwise request one by one.
+    '''
+    with measure('summary'):
+        parts = _run({
+            'counts': (get_counts, user),
+            'kennels': (get_kennels, user, request),
+            'longevity': (get_longevity, user),
+            'attendance': (get_attendance, user, request),
+        })
+    counts = parts['counts']
+    page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+    next_link = None
+    if counts['attendance'] > page_size:
+        url = request.build_absolute_uri(reverse('attend-list'))
+        next_link = replace_query_param(
+            replace_query_param(url, 'user__username', user.username),
+            'page', 2)
+    return {
+        'username': user.username,
+        'runs': counts['runs'],
+        'hares': counts['hares'],
+        'kennels': parts['kennels'],
+        'longevity': parts['longevity'],
+        'attendance': {
+            'count': counts['attendance'],
+            'next': next_link,
+            'previous': None,
+            'results': parts['attendance'],
+        },
+    }
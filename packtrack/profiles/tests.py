@@ -1,3 +1,252 @@
-from django.test import TestCase
+import json
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from events.models import Attend, Longevity
+from events.tests import create_events
+from kennels.models import Kennel, LegacyLongevity, Membership
+from .avatars import crop_to_ratio, run_pending
+from .models import AvatarJob, Profile, avatar_thumbnail_name
+from .settings import AVATAR_SIZES
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+    }
+}
+
+
+def create_image(name: str, size=(400, 300), color='red',
+                 format='PNG') -> SimpleUploadedFile:
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, format)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@mock.patch('profiles.avatars.AVATAR_WORKERS', 0)
+class AvatarTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.users = [
+            User.objects.create(username=f'user{i}') for i in range(2)
+        ]
+
+    def setUp(self) -> None:
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def upload(self, profile, image) -> None:
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.avatar = image
+            profile.save()
+
+    def thumbnails_exist(self, digest) -> list:
+        storage = Profile._meta.get_field('avatar').storage
+        return [
+            storage.exists(avatar_thumbnail_name(digest, size))
+            for size in AVATAR_SIZES.values()
+        ]
+
+    def test_crop_to_ratio(self):
+        self.assertEqual(
+            crop_to_ratio(Image.new('RGB', (400, 100))).size, (178, 100))
+        self.assertEqual(
+            crop_to_ratio(Image.new('RGB', (100, 400))).size, (100, 178))
+        self.assertEqual(
+            crop_to_ratio(Image.new('RGB', (160, 100))).size, (160, 100))
+
+    def test_upload_is_rendered_in_the_background(self):
+        url = f'/api/profiles/{self.users[0].profile.pk}/'
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                url, {'avatar': create_image('big.jpg', (2000, 500),
+                                             format='JPEG')},
+                format='multipart')
+        self.assertEqual(response.status_code, 200)
+        profile = Profile.objects.get(pk=self.users[0].profile.pk)
+        self.assertEqual(profile.avatar_hash, '')
+        self.assertEqual(response.data['avatar'],
+                         f'http://testserver{profile.avatar.url}')
+        self.assertEqual(AvatarJob.objects.count(), 1)
+
+        self.assertEqual(run_pending(), 1)
+        self.assertFalse(AvatarJob.objects.exists())
+        profile.refresh_from_db()
+        self.assertTrue(all(self.thumbnails_exist(profile.avatar_hash)))
+        for size, box in AVATAR_SIZES.items():
+            with profile.avatar.storage.open(
+                    avatar_thumbnail_name(profile.avatar_hash, box)) as f:
+                width, height = Image.open(f).size
+            self.assertEqual(max(width, height), box, size)
+            self.assertAlmostEqual(width / height, 16 / 9, places=1)
+        cache.clear()
+        response = self.client.get(url)
+        self.assertEqual(response.data['avatar'],
+                         f'http://testserver{profile.get_avatar_url()}')
+        self.assertIn('thumbnails', response.data['avatar'])
+
+    def test_replaced_avatars_drop_jobs_and_unused_thumbnails(self):
+        first, second = [user.profile for user in self.users]
+        self.upload(first, create_image('a.png', color='red'))
+        self.upload(second, create_image('b.png', color='red'))
+        run_pending()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        shared = first.avatar_hash
+        self.assertEqual(second.avatar_hash, shared)
+
+        self.upload(first, create_image('c.png', color='blue'))
+        self.upload(first, create_image('d.png', color='green'))
+        self.assertEqual(run_pending(), 2)
+        self.assertEqual(AvatarJob.objects.count(), 0)
+        first.refresh_from_db()
+        self.assertNotEqual(first.avatar_hash, shared)
+        # the replaced image's thumbnails are still used by the other profile
+        self.assertTrue(all(self.thumbnails_exist(shared)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.avatar = None
+            second.save()
+        self.assertFalse(any(self.thumbnails_exist(shared)))
+        self.assertIsNone(second.get_avatar_url())
+
+    def test_failed_jobs_are_retried_then_left(self):
+        profile = self.users[0].profile
+        self.upload(profile, create_image('a.png'))
+        with mock.patch('profiles.avatars.render_thumbnails',
+                        side_effect=OSError('truncated')):
+            for _ in range(3):
+                self.assertEqual(run_pending(), 0)
+        job = AvatarJob.objects.get()
+        self.assertEqual(job.attempts, 3)
+        self.assertIn('truncated', job.error)
+        self.assertEqual(run_pending(), 0)
+        out = StringIO()
+        call_command('process_avatars', stdout=out)
+        self.assertIn('Processed 0 avatar jobs', out.getvalue())
+
+    def test_process_avatars_command(self):
+        self.upload(self.users[0].profile, create_image('a.png'))
+        out = StringIO()
+        call_command('process_avatars', stdout=out)
+        self.assertIn('Processed 1 avatar jobs', out.getvalue())
+        self.assertTrue(
+            Profile.objects.get(pk=self.users[0].profile.pk).avatar_hash)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProfileSummaryTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.kennels = [
+            Kennel.objects.create(name=f'kennel{i}',
+                                  acronym=f'K{i}',
+                                  city='anchorage ak') for i in range(3)
+        ]
+        cls.users = [
+            User.objects.create(username=f'user{i}') for i in range(2)
+        ]
+        for kennel in cls.kennels[:2]:
+            Membership.objects.create(user=cls.users[0], kennel=kennel)
+        events = create_events(cls.kennels[0], cls.users, 14)
+        events += create_events(cls.kennels[1], cls.users[:1], 10)
+        for event in events[::3]:
+            Longevity.objects.create(event=event, kennel=cls.kennels[2])
+        for attend in Attend.objects.filter(user=cls.users[0])[::4]:
+            attend.is_hare = True
+            attend.save()
+        LegacyLongevity.objects.create(user=cls.users[0],
+                                       kennel=cls.kennels[2],
+                                       count=40,
+                                       hares=3)
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[1])
+
+    def get_widgets(self, username):
+        '''
+        The responses the profile widgets requested before the summary.
+        '''
+        get = lambda url: self.client.get(url, {
+            'user__username': username
+        }).data
+        kennels = self.client.get('/api/kennels/', {
+            'members__username': username
+        }).data
+        return {
+            'username': username,
+            'runs': get('/api/attendance/count/')['count'],
+            'hares': self.client.get('/api/attendance/count/', {
+                'user__username': username,
+                'is_hare': 'true'
+            }).data['count'],
+            'kennels': {
+                'count':
+                kennels['count'],
+                'results': [{
+                    key: row[key]
+                    for key in ['url', 'name', 'acronym']
+                } for row in kennels['results']],
+            },
+            'longevity': self.client.get('/api/longevityrecords/count/', {
+                'attend__user__username': username
+            }).data,
+            'attendance': get('/api/attendance/'),
+        }
+
+    def test_summary_matches_widget_endpoints(self):
+        for user in self.users:
+            response = self.client.get(f'/api/users/{user.username}/summary/')
+            self.assertEqual(response.status_code, 200)
+            summary = json.loads(response.content)
+            widgets = json.loads(
+                json.dumps(self.get_widgets(user.username)))
+            summary['kennels']['results'].sort(key=lambda row: row['url'])
+            widgets['kennels']['results'].sort(key=lambda row: row['url'])
+            self.assertEqual(summary, widgets)
+        self.assertEqual(summary['username'], 'user1')
+        self.assertIsNone(summary['attendance']['next'])
+
+    def test_summary_queries_do_not_grow_with_history(self):
+        with CaptureQueriesContext(connection) as small:
+            self.client.get('/api/users/user1/summary/')
+        with CaptureQueriesContext(connection) as large:
+            self.client.get('/api/users/user0/summary/')
+        self.assertEqual(len(small.captured_queries),
+                         len(large.captured_queries))
+
+    def test_unknown_hashers_are_not_found(self):
+        response = self.client.get('/api/users/nobody/summary/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_profile_page_embeds_the_summary(self):
+        self.client.force_login(self.users[1])
+        response = self.client.get('/hashers/user0')
+        self.assertEqual(response.status_code, 200)
+        summary = self.client.get('/api/users/user0/summary/')
+        self.assertEqual(
+            json.loads(json.dumps(response.context['summary'])),
+            json.loads(summary.content))
+        self.assertContains(response, 'id="profile_summary"')
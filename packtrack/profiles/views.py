@@ -7,6 +7,7 @@ from core.views import MainContentView
 from django.utils.translation import gettext_lazy as _
 
 from . import models, forms
+from .summary import get_summary
 
 
 @login_required
@@ -92,6 +93,7 @@ def view_profile(request, username):
         request=request,
         context={
             'profile': profile,
+            'summary': get_summary(user, request),
             'active_sidebar': active_link,
             'active_topbar': active_link
         },